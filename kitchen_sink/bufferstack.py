@@ -0,0 +1,127 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# the stack of previously opened buffers. the most recent buffers keep their
+# rendered widgets around so going back to them is instant, older buffers are
+# compressed and, once the stack goes over its memory budget, spilled into a
+# temp file.
+# }}}
+
+import cPickle
+import tempfile
+import zlib
+
+# keys of a buffer that can be rebuilt from its lines (or don't outlive it)
+REBUILT_KEYS = [ 'table', 'token', 'syntax_token', 'watch' ]
+
+def estimate_size(ret):
+  lines = ret.get('lines') or []
+  size = sum(len(line) for line in lines) + len(lines) * 40
+  if isinstance(ret.get('binary'), str):
+    size += len(ret['binary'])
+  return size
+
+def freeze(ret):
+  frozen = dict((key, val) for key, val in ret.iteritems() if not key in REBUILT_KEYS)
+  return zlib.compress(cPickle.dumps(frozen, 2), 1)
+
+def thaw(data):
+  return cPickle.loads(zlib.decompress(data))
+
+class StackEntry(object):
+  def __init__(self, ret, view):
+    self.ret = ret
+    self.view = view
+    self.frozen = None
+    self.spilled = None
+    self.size = estimate_size(ret)
+
+  @property
+  def resident_size(self):
+    if self.ret is not None:
+      return self.size
+    if self.frozen is not None:
+      return len(self.frozen)
+    return 0
+
+class BufferStack(object):
+  def __init__(self, budget, keep_views=3):
+    self.budget = budget
+    self.keep_views = keep_views
+    self.entries = []
+    self.spill_file = None
+
+  def __len__(self):
+    return len(self.entries)
+
+  def push(self, ret, view=None):
+    self.entries.append(StackEntry(ret, view))
+    self.enforce_budget()
+
+  # returns the buffer and its rendered view (if it still has one)
+  def pop(self):
+    entry = self.entries.pop()
+    if entry.ret is None:
+      entry.ret = thaw(self.read_frozen(entry))
+      entry.frozen = None
+      entry.spilled = None
+
+    return entry.ret, entry.view
+
+  # the top buffer's lines, without taking it off the stack. they come back
+  # from a function so that unpacking a frozen buffer can happen off the UI
+  # thread (the spill file is still read here)
+  def peek_lines(self):
+    entry = self.entries[-1]
+    if entry.ret is not None:
+      lines = entry.ret['lines']
+      return lambda: lines
+
+    data = self.read_frozen(entry)
+    return lambda: cPickle.loads(zlib.decompress(data))['lines']
+
+  def read_frozen(self, entry):
+    if entry.frozen is not None:
+      return entry.frozen
+
+    offset, length = entry.spilled
+    self.spill_file.seek(offset)
+    return self.spill_file.read(length)
+
+  def resident_size(self):
+    return sum(entry.resident_size for entry in self.entries)
+
+  def enforce_budget(self):
+    for entry in self.entries[:max(len(self.entries) - self.keep_views, 0)]:
+      entry.view = None
+
+    if self.resident_size() <= self.budget:
+      return
+
+    # compress the oldest buffers first, but only once they are done reading.
+    # mapped files are left alone, the OS pages them out as it is
+    for entry in self.entries:
+      if entry.ret is not None and entry.ret.get('finished') and not entry.ret.get('mapped'):
+        entry.frozen = freeze(entry.ret)
+        entry.ret = None
+        entry.view = None
+        if self.resident_size() <= self.budget:
+          return
+
+    for entry in self.entries:
+      if entry.frozen is not None:
+        self.spill(entry)
+        if self.resident_size() <= self.budget:
+          return
+
+  def spill(self, entry):
+    if not self.spill_file:
+      self.spill_file = tempfile.TemporaryFile(prefix="kk")
+
+    self.spill_file.seek(0, 2)
+    entry.spilled = (self.spill_file.tell(), len(entry.frozen))
+    self.spill_file.write(entry.frozen)
+    self.spill_file.flush()
+    entry.frozen = None
+
+# vim: set foldmethod=marker
@@ -0,0 +1,331 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# transparent decompression of compressed input. the format is sniffed from
+# the magic bytes at the start of the stream, then the data is decompressed a
+# block at a time as it is read. for gzip files on disk, checkpoints of the
+# decompressor are kept every few MB so a later jump deep into the same file
+# can start from the closest checkpoint instead of the beginning. plain files
+# get the same index, their checkpoints are just the offsets of a line. bz2,
+# xz and zstd decompressors can't be copied, so those files are always read
+# from the start.
+# }}}
+
+import bz2
+import os
+import zlib
+
+try:
+  import lzma
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+BLOCK_SIZE = 1 << 16
+CHECKPOINT_EVERY = 4 << 20
+
+MAGIC = [
+  ("gzip", "\x1f\x8b"),
+  ("bzip2", "BZh"),
+  ("xz", "\xfd7zXZ\x00"),
+  ("zstd", "\x28\xb5\x2f\xfd"),
+]
+
+MODULES = {
+  "xz" : "backports.lzma",
+  "zstd" : "zstandard",
+}
+
+class InputError(Exception):
+  pass
+
+class UnsupportedFormat(InputError):
+  pass
+
+class CorruptInput(InputError):
+  pass
+
+# what the decompressors raise on bad data (bz2 raises IOError)
+DECOMPRESS_ERRORS = (zlib.error, IOError, ValueError)
+if lzma:
+  DECOMPRESS_ERRORS += (lzma.LZMAError,)
+if zstandard:
+  DECOMPRESS_ERRORS += (zstandard.ZstdError,)
+
+def sniff_format(head):
+  for name, magic in MAGIC:
+    if head.startswith(magic):
+      return name
+
+def new_decompressor(fmt):
+  if fmt == "gzip":
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+  if fmt == "bzip2":
+    return bz2.BZ2Decompressor()
+  if fmt == "xz" and lzma:
+    return lzma.LZMADecompressor()
+  if fmt == "zstd" and zstandard:
+    return zstandard.ZstdDecompressor().decompressobj()
+
+  raise UnsupportedFormat("reading %s input needs the %s module" % (fmt, MODULES[fmt]))
+
+# {{{ decompressor
+# wraps the per format decompressors so that concatenated streams (pigz, zstd
+# frames, etc) keep going, and so a gzip state can be checkpointed
+class Decompressor(object):
+  def __init__(self, fmt, state=None):
+    self.fmt = fmt
+    self.obj = state or new_decompressor(fmt)
+    self.fresh = state is None
+
+  def decompress(self, data):
+    out = []
+    while data:
+      try:
+        out.append(self.obj.decompress(data))
+      except DECOMPRESS_ERRORS, e:
+        raise CorruptInput("corrupt %s data (%s)" % (self.fmt, e))
+      except EOFError:
+        # the last stream ended right at the end of the previous block and
+        # bz2 won't take anything past it, so this data starts a new one
+        self.obj = new_decompressor(self.fmt)
+        self.fresh = True
+        continue
+
+      self.fresh = False
+      data = getattr(self.obj, 'unused_data', '')
+      if not data and getattr(self.obj, 'eof', False):
+        # stream ended right at the block boundary, the next byte starts a
+        # new one
+        self.obj = new_decompressor(self.fmt)
+        self.fresh = True
+      elif data:
+        self.obj = new_decompressor(self.fmt)
+        self.fresh = True
+
+    return "".join(out)
+
+  # whether the current stream got to its end. py2's zlib and bz2 have no eof,
+  # so they're asked to take more input: past the end, zlib leaves it unused
+  # and bz2 refuses it
+  def ended(self):
+    eof = getattr(self.obj, 'eof', None)
+    if eof is not None:
+      return eof
+
+    if self.fmt == "gzip":
+      probe = self.obj.copy()
+      try:
+        probe.decompress("\0")
+      except zlib.error:
+        return False
+      return bool(probe.unused_data)
+
+    if self.fmt == "bzip2":
+      try:
+        self.obj.decompress("")
+      except EOFError:
+        return True
+      return False
+
+    return True
+
+  # the input ran out in the middle of a stream
+  def finish(self):
+    if not self.fresh and not self.ended():
+      raise CorruptInput("truncated %s data" % self.fmt)
+
+  # a state that decompression can resume from. only zlib can copy itself
+  def checkpoint(self):
+    return self.obj.copy()
+
+  @classmethod
+  def resume(cls, fmt, state):
+    return cls(fmt, state.copy())
+# }}}
+
+# {{{ checkpoints
+# the format is None for a plain file
+class CheckpointIndex(object):
+  def __init__(self, fmt):
+    self.fmt = fmt
+    self.checkpoints = []
+    self.complete = False
+
+  def add(self, line, offset, state, partial):
+    self.checkpoints.append((line, offset, state, partial))
+
+  # the last checkpoint at or before the line
+  def find(self, line):
+    found = None
+    for checkpoint in self.checkpoints:
+      if checkpoint[0] > line:
+        break
+      found = checkpoint
+    return found
+
+  # whether it can be pickled (for the sidecar cache). zlib's states can't,
+  # so only a plain file's offsets are saved
+  def portable(self):
+    return self.fmt is None
+
+INDEXES = {}
+
+def index_key(path):
+  stat = os.stat(path)
+  return (os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+def get_index(path):
+  try:
+    return INDEXES.get(index_key(path))
+  except OSError:
+    return
+
+# an index that was saved from an earlier read of the file
+def put_index(path, index):
+  try:
+    INDEXES[index_key(path)] = index
+  except OSError:
+    pass
+# }}}
+
+# {{{ reading
+def decompressed_blocks(f, path=None):
+  head = f.read(BLOCK_SIZE)
+  fmt = sniff_format(head)
+  if not fmt:
+    for block in plain_blocks(f, head, path):
+      yield block
+    return
+
+  decompressor = Decompressor(fmt)
+  index = None
+  if path and fmt == "gzip":
+    index = CheckpointIndex(fmt)
+
+  data = head
+  offset = 0
+  lines = 0
+  since_newline = 0
+  since_checkpoint = 0
+  while data:
+    out = decompressor.decompress(data)
+    offset += len(data)
+    yield out
+
+    newlines = out.count("\n")
+    lines += newlines
+    if newlines:
+      since_newline = len(out) - out.rfind("\n") - 1
+    else:
+      since_newline += len(out)
+
+    since_checkpoint += len(out)
+    if index and since_checkpoint >= CHECKPOINT_EVERY:
+      # a partial line at the checkpoint is skipped when resuming, so the
+      # checkpoint starts at the line after it
+      index.add(lines + (1 if since_newline else 0), offset, decompressor.checkpoint(), bool(since_newline))
+      since_checkpoint = 0
+
+    data = f.read(BLOCK_SIZE)
+
+  decompressor.finish()
+  if index:
+    index.complete = True
+    INDEXES[index_key(path)] = index
+
+# a plain file's checkpoints are at the first line break after every few MB
+def plain_blocks(f, head, path=None):
+  index = None
+  if path:
+    index = CheckpointIndex(None)
+
+  block = head
+  offset = 0
+  lines = 0
+  since_checkpoint = 0
+  while block:
+    yield block
+
+    if index:
+      lines += block.count("\n")
+      since_checkpoint += len(block)
+      if since_checkpoint >= CHECKPOINT_EVERY:
+        newline = block.rfind("\n")
+        if newline != -1:
+          index.add(lines, offset + newline + 1, None, False)
+          since_checkpoint = len(block) - newline - 1
+
+    offset += len(block)
+    block = f.read(BLOCK_SIZE)
+
+  if index:
+    index.complete = True
+    INDEXES[index_key(path)] = index
+
+def split_lines(blocks):
+  partial = ""
+  for block in blocks:
+    pieces = (partial + block).split("\n")
+    partial = pieces.pop()
+    for piece in pieces:
+      yield piece + "\n"
+
+  if partial:
+    yield partial
+
+def read_lines(f, path=None):
+  return split_lines(decompressed_blocks(f, path))
+
+def open_lines(path):
+  f = open(path, "rb")
+  return read_lines(f, path)
+
+# returns (first line number, lines) starting from the closest checkpoint
+# before the line, or None if the file hasn't been indexed yet
+def open_lines_near(path, line):
+  index = get_index(path)
+  if not index:
+    return
+
+  checkpoint = index.find(line)
+  if not checkpoint:
+    return
+
+  first_line, offset, state, partial = checkpoint
+  def blocks():
+    with open(path, "rb") as f:
+      f.seek(offset)
+      if not index.fmt:
+        data = f.read(BLOCK_SIZE)
+        while data:
+          yield data
+          data = f.read(BLOCK_SIZE)
+        return
+
+      decompressor = Decompressor.resume(index.fmt, state)
+      skip = partial
+      data = f.read(BLOCK_SIZE)
+      while data:
+        out = decompressor.decompress(data)
+        if skip:
+          n = out.find("\n")
+          if n == -1:
+            out = ""
+          else:
+            out = out[n+1:]
+            skip = False
+        yield out
+        data = f.read(BLOCK_SIZE)
+
+  return first_line, split_lines(blocks())
+# }}}
+
+# vim: set foldmethod=marker
@@ -0,0 +1,173 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# debug logging that stays out of the way. a log call only checks the level of
+# its subsystem and appends the raw arguments to a queue, a background thread
+# formats and writes them. turning debugging on barely changes the timing, so
+# races still show up with it on. keep in mind that the arguments are
+# formatted later: pass a copy of anything that is about to change.
+#
+# records are written as text (one line each), jsonl or binary (marshalled
+# tuples of time, subsystem, level and message, see read_binary)
+# }}}
+
+import atexit
+import collections
+import json
+import marshal
+import sys
+import threading
+import time
+
+LEVELS = {
+  "trace" : 5,
+  "debug" : 10,
+  "info" : 20,
+  "warn" : 30,
+  "error" : 40,
+  "off" : 100,
+}
+
+LEVEL_NAMES = dict((value, name) for name, value in LEVELS.iteritems())
+
+# the writer thread is woken up early once this many records are waiting
+WAKE_AFTER = 512
+
+# "syntax=trace,menus=info" -> { "syntax" : 5, "menus" : 20 }
+def parse_levels(spec):
+  levels = {}
+  for part in spec.split(","):
+    if "=" not in part:
+      continue
+    name, level = part.split("=", 1)
+    levels[name.strip()] = LEVELS.get(level.strip().lower(), LEVELS["debug"])
+  return levels
+
+def format_arg(arg):
+  if isinstance(arg, str):
+    return arg
+  if isinstance(arg, unicode):
+    return arg.encode("utf-8", "replace")
+  return str(arg)
+
+def format_args(args):
+  return " ".join([ format_arg(arg) for arg in args ])
+
+def read_binary(f):
+  while True:
+    try:
+      yield marshal.load(f)
+    except EOFError:
+      return
+
+class Channel(object):
+  def __init__(self, log, name):
+    self.log = log
+    self.name = name
+    self.threshold = log.threshold(name)
+
+  def enabled(self, level="debug"):
+    return LEVELS[level] >= self.threshold
+
+  def trace(self, *args):
+    if self.threshold <= 5:
+      self.log.put(self.name, 5, args)
+
+  def debug(self, *args):
+    if self.threshold <= 10:
+      self.log.put(self.name, 10, args)
+
+  def info(self, *args):
+    if self.threshold <= 20:
+      self.log.put(self.name, 20, args)
+
+  def warn(self, *args):
+    if self.threshold <= 30:
+      self.log.put(self.name, 30, args)
+
+  def error(self, *args):
+    if self.threshold <= 40:
+      self.log.put(self.name, 40, args)
+
+class DebugLog(object):
+  def __init__(self, path=None, levels=None, default="debug", fmt="text"):
+    self.path = path
+    self.levels = levels or {}
+    self.default = LEVELS.get(default, LEVELS["debug"])
+    self.fmt = fmt
+    self.records = collections.deque()
+    self.wake = threading.Event()
+    self.thread = None
+    self.closed = False
+
+    if not path:
+      self.default = LEVELS["off"]
+      self.levels = {}
+      return
+
+    self.out = open(path, "wb" if fmt == "binary" else "w")
+    self.thread = threading.Thread(target=self.write_loop, name="kk-debuglog")
+    self.thread.daemon = True
+    self.thread.start()
+    atexit.register(self.close)
+
+  def threshold(self, name):
+    return self.levels.get(name, self.default)
+
+  def channel(self, name):
+    return Channel(self, name)
+
+  def put(self, name, level, args):
+    self.records.append((time.time(), name, level, args))
+    if len(self.records) >= WAKE_AFTER:
+      self.wake.set()
+
+  # {{{ writer
+  def write_loop(self):
+    while not self.closed:
+      self.wake.wait(0.25)
+      self.wake.clear()
+      self.drain()
+
+  def drain(self):
+    records = self.records
+    out = self.out
+    wrote = False
+    while records:
+      when, name, level, args = records.popleft()
+      try:
+        message = format_args(args)
+      except Exception, e:
+        message = "(couldn't format %r: %s)" % (args, e)
+
+      if self.fmt == "jsonl":
+        out.write(json.dumps({ "time" : when, "subsystem" : name,
+          "level" : LEVEL_NAMES[level], "message" : message.decode("utf-8", "replace") }))
+        out.write("\n")
+      elif self.fmt == "binary":
+        marshal.dump((when, name, level, message), out)
+      else:
+        out.write("%.4f %s %s %s\n" % (when, name, LEVEL_NAMES[level].upper(), message))
+      wrote = True
+
+    if wrote:
+      out.flush()
+
+  def close(self):
+    if self.closed or not self.thread:
+      return
+
+    self.closed = True
+    self.wake.set()
+    self.thread.join(1)
+    # whatever was logged while the thread wound down
+    self.drain()
+    self.out.close()
+  # }}}
+
+if __name__ == "__main__":
+  with open(sys.argv[1], "rb") as f:
+    for when, name, level, message in read_binary(f):
+      print "%.4f %s %s %s" % (when, name, LEVEL_NAMES[level].upper(), message)
+
+# vim: set foldmethod=marker
@@ -0,0 +1,265 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# an incremental parser for git log -p / git diff / diff -u output. it is fed
+# the buffer a chunk at a time while reading and keeps an index of the
+# commits, files and hunks in it, with the line range of each. highlighting
+# walks the index instead of guessing where headers end, and the index makes
+# jumping between files and hunks a lookup.
+# }}}
+
+import array
+import bisect
+import re
+
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+COMMIT_RE = re.compile(r'^commit ([0-9a-f]{7,40})\b')
+
+class Commit(object):
+  def __init__(self, start, sha):
+    self.start = start
+    self.end = None
+    self.sha = sha
+    self.files = []
+
+class FileDiff(object):
+  def __init__(self, start, path, commit=None):
+    self.start = start
+    self.end = None
+    # the first hunk, everything before it is the header
+    self.body_start = None
+    self.path = path
+    self.old_path = path
+    self.status = "M"
+    self.commit = commit
+    self.hunks = []
+
+  def describe(self):
+    if self.status == "R":
+      return "R %s -> %s" % (self.old_path, self.path)
+    return "%s %s" % (self.status, self.path)
+
+class Hunk(object):
+  def __init__(self, start, header, old_count, new_count):
+    self.start = start
+    self.end = None
+    self.header = header
+    self.old_left = old_count
+    self.new_left = new_count
+
+def strip_prefix(path):
+  path = path.strip()
+  if path.startswith('"') and path.endswith('"'):
+    path = path[1:-1]
+  if path[:2] in ("a/", "b/"):
+    return path[2:]
+  return path
+
+class DiffIndex(object):
+  def __init__(self):
+    self.commits = []
+    self.files = []
+    self.hunks = []
+    self.starts = {
+      "commit" : array.array('l'),
+      "file" : array.array('l'),
+      "hunk" : array.array('l'),
+    }
+    self.commit = None
+    self.file = None
+    self.hunk = None
+    self.in_header = False
+    self.prev_line = ""
+    self.lines = 0
+    self.complete = False
+
+  # {{{ parsing
+  def feed(self, lines, start_line):
+    for offset, line in enumerate(lines):
+      self.feed_line(start_line + offset, line.rstrip("\r\n"))
+      self.prev_line = line
+    self.lines = start_line + len(lines)
+
+  def feed_line(self, n, line):
+    hunk = self.hunk
+    if hunk and hunk.old_left <= 0 and hunk.new_left <= 0 and line[:1] != "\\":
+      # a full hunk can still get a "\ No newline at end of file"
+      self.close_hunk(n)
+    elif hunk:
+      first = line[:1]
+      # a stripped blank line is still context
+      if first == " " or not line:
+        hunk.old_left -= 1
+        hunk.new_left -= 1
+      elif first == "-":
+        hunk.old_left -= 1
+      elif first == "+":
+        hunk.new_left -= 1
+      elif first != "\\":
+        self.close_hunk(n)
+
+      if self.hunk:
+        return
+
+    match = COMMIT_RE.match(line)
+    if match:
+      self.close_commit(n)
+      self.commit = Commit(n, match.group(1))
+      self.commits.append(self.commit)
+      self.starts['commit'].append(n)
+      return
+
+    if line.startswith("diff --git ") or line.startswith("diff --cc "):
+      path = line.split(" b/", 1)[-1] if " b/" in line else line.split()[-1]
+      self.start_file(n, strip_prefix(path))
+      return
+
+    if line.startswith("+++ ") and self.prev_line.startswith("--- ") and not self.in_header:
+      # diff -u output, without a diff --git line in front
+      self.start_file(n - 1, strip_prefix(line[4:].split("\t")[0]))
+      self.file.old_path = strip_prefix(self.prev_line[4:].split("\t")[0])
+      return
+
+    if line.startswith("@@") and self.file:
+      match = HUNK_RE.match(line)
+      if match:
+        self.start_hunk(n, line, match)
+        return
+
+    if self.in_header:
+      self.parse_header(n, line)
+    elif self.file and self.file.hunks:
+      # text after the last hunk (a blank line, the next commit message)
+      self.close_file(n)
+
+  def parse_header(self, n, line):
+    current = self.file
+    if line.startswith("new file mode"):
+      current.status = "A"
+    elif line.startswith("deleted file mode"):
+      current.status = "D"
+    elif line.startswith("rename from "):
+      current.status = "R"
+      current.old_path = line[len("rename from "):]
+    elif line.startswith("rename to "):
+      current.path = line[len("rename to "):]
+    elif line.startswith("copy from "):
+      current.status = "C"
+      current.old_path = line[len("copy from "):]
+    elif line.startswith("Binary files ") or line.startswith("GIT binary patch"):
+      current.status = "B" if current.status == "M" else current.status
+    elif line.startswith("--- ") or line.startswith("+++ ") or line.startswith("index ") \
+        or line.startswith("old mode") or line.startswith("new mode") \
+        or line.startswith("similarity index") or line.startswith("dissimilarity index") \
+        or line.startswith("copy to ") or not line.strip():
+      pass
+    elif current.status != "B":
+      # not a header line, so the header (of a file without hunks) is over
+      self.in_header = False
+      self.close_file(n)
+
+  def start_file(self, n, path):
+    self.close_file(n)
+    self.file = FileDiff(n, path, self.commit)
+    self.files.append(self.file)
+    self.starts['file'].append(n)
+    if self.commit:
+      self.commit.files.append(self.file)
+    self.in_header = True
+
+  def start_hunk(self, n, line, match):
+    self.close_hunk(n)
+    old_count = int(match.group(2)) if match.group(2) is not None else 1
+    new_count = int(match.group(4)) if match.group(4) is not None else 1
+    self.hunk = Hunk(n, line, old_count, new_count)
+    self.hunks.append(self.hunk)
+    self.starts['hunk'].append(n)
+    self.file.hunks.append(self.hunk)
+    if self.file.body_start is None:
+      self.file.body_start = n
+    self.in_header = False
+    if not old_count and not new_count:
+      self.close_hunk(n + 1)
+
+  def close_hunk(self, n):
+    if self.hunk:
+      self.hunk.end = n
+      self.hunk = None
+
+  def close_file(self, n):
+    self.close_hunk(n)
+    if self.file:
+      self.file.end = n
+      self.file = None
+    self.in_header = False
+
+  def close_commit(self, n):
+    self.close_file(n)
+    if self.commit:
+      self.commit.end = n
+      self.commit = None
+
+  def finish(self):
+    self.close_commit(self.lines)
+    self.complete = True
+  # }}}
+
+  # {{{ lookups
+  def __nonzero__(self):
+    return bool(self.files)
+
+  # the first entry of the kind that starts after the line
+  def next_start(self, kind, line):
+    starts = self.starts[kind]
+    index = bisect.bisect_right(starts, line)
+    if index < len(starts):
+      return starts[index]
+
+  # the last entry of the kind that starts before the line
+  def prev_start(self, kind, line):
+    starts = self.starts[kind]
+    index = bisect.bisect_left(starts, line) - 1
+    if index >= 0:
+      return starts[index]
+
+  # the commit (or the whole diff, for output without commits) that the
+  # line is in, as a list of files
+  def files_near(self, line):
+    commit = self.commit_at(line)
+    if commit:
+      return commit.files
+    return [ entry for entry in self.files if entry.commit is None ]
+
+  def commit_index(self, line):
+    index = bisect.bisect_right(self.starts['commit'], line) - 1
+    if index >= 0:
+      return index
+
+  def commit_at(self, line):
+    index = self.commit_index(line)
+    if index is not None:
+      return self.commits[index]
+
+  def file_at(self, line):
+    index = bisect.bisect_right(self.starts['file'], line) - 1
+    if index >= 0:
+      entry = self.files[index]
+      end = self.file_end(entry)
+      if end is None or line < end:
+        return entry
+
+  def hunk_at(self, line):
+    index = bisect.bisect_right(self.starts['hunk'], line) - 1
+    if index >= 0:
+      hunk = self.hunks[index]
+      if hunk.end is None or line < hunk.end:
+        return hunk
+
+  def file_end(self, entry):
+    if entry.end is not None:
+      return entry.end
+    if self.complete:
+      return self.lines
+  # }}}
+
+# vim: set foldmethod=marker
@@ -0,0 +1,109 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# folded sections of a buffer. a folded range of lines shows up as a single
+# summary row, so the rows on screen stop lining up with the lines of the
+# buffer. FoldMap translates between the two without walking the buffer, it
+# only looks at the folds.
+# }}}
+
+import bisect
+
+class Fold(object):
+  def __init__(self, start, end, label):
+    self.start = start
+    self.end = end
+    self.label = label
+
+  @property
+  def hidden(self):
+    return self.end - self.start - 1
+
+class FoldMap(object):
+  def __init__(self):
+    self.folds = []
+    self.rebuild()
+
+  def __len__(self):
+    return len(self.folds)
+
+  def rebuild(self):
+    self.folds.sort(key=lambda fold: fold.start)
+    self.starts = [ fold.start for fold in self.folds ]
+    # lines hidden by the folds before each fold, and the row each fold is on
+    self.hidden_before = []
+    self.rows = []
+    hidden = 0
+    for fold in self.folds:
+      self.hidden_before.append(hidden)
+      self.rows.append(fold.start - hidden)
+      hidden += fold.hidden
+    self.hidden = hidden
+
+  # folds don't nest, folding a range drops the folds inside it
+  def fold(self, start, end, label):
+    if end - start < 2:
+      return
+
+    self.folds = [ fold for fold in self.folds if fold.end <= start or fold.start >= end ]
+    self.folds.append(Fold(start, end, label))
+    self.rebuild()
+
+  # for folding lots of (non overlapping) ranges at once
+  def fold_many(self, ranges):
+    for start, end, label in ranges:
+      if end - start >= 2:
+        self.folds.append(Fold(start, end, label))
+    self.rebuild()
+
+  def unfold(self, start, end=None):
+    if end is None:
+      end = start + 1
+    self.folds = [ fold for fold in self.folds if fold.end <= start or fold.start >= end ]
+    self.rebuild()
+
+  def clear(self):
+    self.folds = []
+    self.rebuild()
+
+  def fold_starting(self, start):
+    index = bisect.bisect_left(self.starts, start)
+    if index < len(self.starts) and self.starts[index] == start:
+      return self.folds[index]
+
+  def folds_between(self, start, end):
+    index = bisect.bisect_left(self.starts, start)
+    ret = []
+    while index < len(self.folds) and self.folds[index].start < end:
+      ret.append(self.folds[index])
+      index += 1
+    return ret
+
+  # the summary row's fold, if the row is one
+  def fold_at(self, row):
+    index = bisect.bisect_left(self.rows, row)
+    if index < len(self.rows) and self.rows[index] == row:
+      return self.folds[index]
+
+  def to_row(self, line):
+    index = bisect.bisect_right(self.starts, line) - 1
+    if index < 0:
+      return line
+
+    fold = self.folds[index]
+    if line < fold.end:
+      return self.rows[index]
+    return line - self.hidden_before[index] - fold.hidden
+
+  # a summary row maps to the first line of its fold
+  def to_line(self, row):
+    index = bisect.bisect_right(self.rows, row) - 1
+    if index < 0:
+      return row
+
+    fold = self.folds[index]
+    if row == self.rows[index]:
+      return fold.start
+    return row + self.hidden_before[index] + fold.hidden
+
+# vim: set foldmethod=marker
@@ -0,0 +1,112 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# fuzzy filtering for menus with lots of entries. the entries are lowercased
+# once, when they are added. each query is matched against the results of the
+# longest earlier query it extends, so typing one more character only looks
+# at what is still left (and backspace just goes back to an earlier result).
+# matching is a regex (the query's characters in order), run by re over a
+# list comprehension, which keeps the python work per entry small.
+# }}}
+
+import re
+
+# past this many matches, they are only split into substring matches and
+# the rest instead of being scored one by one
+RANK_LIMIT = 3000
+
+# "abc" -> a[^b]*b[^c]*c, the first place the characters show up in order
+def query_pattern(query):
+  parts = [ re.escape(query[0]) ]
+  for char in query[1:]:
+    parts.append("[^%s]*%s" % (re.escape(char), re.escape(char)))
+  return re.compile("".join(parts))
+
+class FuzzyIndex(object):
+  def __init__(self, items=None):
+    self.items = []
+    self.lowered = []
+    # (query, indices of the entries matching it) for the query being typed
+    # and the shorter ones before it
+    self.results = []
+    self.ranked = None
+    for item in items or []:
+      self.add(item)
+
+  def __len__(self):
+    return len(self.items)
+
+  @property
+  def query(self):
+    if self.results:
+      return self.results[-1][0]
+    return ""
+
+  def add(self, item):
+    index = len(self.items)
+    self.items.append(item)
+    lowered = item.lower()
+    self.lowered.append(lowered)
+
+    for query, indices in self.results:
+      if query_pattern(query).search(lowered):
+        indices.append(index)
+    if self.ranked is not None and self.results and self.results[-1][1][-1:] == [ index ]:
+      self.ranked.append(index)
+    return index
+
+  # indices of the entries matching the query, best first
+  def filter(self, query):
+    query = query.lower()
+    if not query:
+      self.results = []
+      self.ranked = None
+      return range(len(self.items))
+
+    if query == self.query and self.ranked is not None:
+      return self.ranked
+
+    while self.results and not query.startswith(self.results[-1][0]):
+      self.results.pop()
+
+    if self.results and self.results[-1][0] == query:
+      self.ranked = self.rank(query, self.results[-1][1])
+      return self.ranked
+
+    lowered = self.lowered
+    if self.results:
+      indices = self.results[-1][1]
+    else:
+      indices = xrange(len(lowered))
+
+    if len(query) == 1:
+      matches = [ index for index in indices if query in lowered[index] ]
+    else:
+      search = query_pattern(query).search
+      matches = [ index for index in indices if search(lowered[index]) ]
+
+    self.results.append((query, matches))
+    self.ranked = self.rank(query, matches)
+    return self.ranked
+
+  def rank(self, query, matches):
+    lowered = self.lowered
+    if len(matches) > RANK_LIMIT:
+      exact = [ index for index in matches if query in lowered[index] ]
+      if len(exact) == len(matches):
+        return list(matches)
+      exact_set = set(exact)
+      return exact + [ index for index in matches if index not in exact_set ]
+
+    # substring matches first, then the tightest match, the earliest one and
+    # the shortest entry
+    search = query_pattern(query).search
+    scored = []
+    for index in matches:
+      text = lowered[index]
+      match = search(text)
+      scored.append((query not in text, match.end() - match.start(), match.start(), len(text), index))
+    scored.sort()
+    return [ entry[-1] for entry in scored ]
+
+# vim: set foldmethod=marker
@@ -0,0 +1,117 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# git show output for the commits in a git log buffer. opening a commit means
+# waiting for git show, so the commits around the one under the cursor are
+# fetched ahead of time (and prepared, e.g. lexed into the highlight cache) as
+# idle work on the scheduler, under the log buffer's token. only the last few
+# commits are kept.
+# }}}
+
+import collections
+import os
+import subprocess
+import threading
+
+from scheduler import PRIORITY_IDLE
+
+def git_show(obj):
+  with open(os.devnull, "w") as fnull:
+    try:
+      return subprocess.check_output(['git', 'show', obj], stderr=fnull)
+    except (OSError, subprocess.CalledProcessError):
+      return None
+
+# a commit queued for fetching. once a worker has started on it, get() waits
+# for it instead of running git show a second time
+class Fetch(object):
+  def __init__(self, token):
+    self.token = token
+    self.started = False
+    self.done = threading.Event()
+
+class CommitCache(object):
+  def __init__(self, work, size=32, prepare=None, show=git_show):
+    self.work = work
+    self.size = size
+    # called as prepare(output, token), on a worker
+    self.prepare = prepare
+    self.show = show
+    self.entries = collections.OrderedDict()
+    self.fetching = {}
+    self.wanted = set()
+    self.lock = threading.Lock()
+
+  def __contains__(self, obj):
+    return obj in self.entries
+
+  # the output of git show for the object (None if git failed), waits for
+  # it if it is being fetched
+  def get(self, obj):
+    with self.lock:
+      if obj in self.entries:
+        output = self.entries.pop(obj)
+        self.entries[obj] = output
+        return output
+      fetching = self.fetching.get(obj)
+      # idle work can sit in the queue for a while, a fetch that hasn't
+      # started is taken over
+      if fetching and not fetching.started:
+        del self.fetching[obj]
+        fetching = None
+
+    if fetching:
+      fetching.done.wait()
+      with self.lock:
+        if obj in self.entries:
+          return self.entries[obj]
+
+    output = self.show(obj)
+    self.store(obj, output)
+    return output
+
+  # the objects are fetched in order, ones from earlier calls that aren't
+  # wanted anymore are skipped. fetches whose token was cancelled before they
+  # started are queued again
+  def prefetch(self, objs, token):
+    with self.lock:
+      self.wanted = set(objs)
+      for obj in objs:
+        fetching = self.fetching.get(obj)
+        if obj in self.entries or (fetching and (fetching.started or not fetching.token.cancelled)):
+          continue
+
+        self.fetching[obj] = Fetch(token)
+        self.work.submit(self.fetch, PRIORITY_IDLE, token, obj)
+
+  def store(self, obj, output):
+    with self.lock:
+      self.entries[obj] = output
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+
+  # runs on a worker. the output is stored before it is prepared, so opening
+  # the commit doesn't wait on the highlighting
+  def fetch(self, obj):
+    with self.lock:
+      fetching = self.fetching.get(obj)
+      if not fetching or fetching.started:
+        return
+      if obj not in self.wanted:
+        del self.fetching[obj]
+        return
+      fetching.started = True
+
+    try:
+      output = self.show(obj)
+      self.store(obj, output)
+    finally:
+      with self.lock:
+        if self.fetching.get(obj) is fetching:
+          del self.fetching[obj]
+      fetching.done.set()
+
+    if output and self.prepare:
+      self.prepare(output, fetching.token)
+
+# vim: set foldmethod=marker
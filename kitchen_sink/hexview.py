@@ -0,0 +1,79 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# binary input is shown as a hexdump instead of going through the text
+# pipeline. the input stays as it is (mapped, for a plain file) and a row of
+# the dump is only formatted once it is on screen.
+# }}}
+
+import mmap
+import os
+
+from compressed import sniff_format
+
+SNIFF_SIZE = 8000
+ROW_BYTES = 16
+
+# the bytes that show up in text: printable ascii, whitespace, escape codes and
+# anything with the high bit set (utf-8, latin-1)
+TEXT_CHARS = "".join(map(chr, [ 7, 8, 9, 10, 12, 13, 27 ] + range(0x20, 0x7f) + range(0x80, 0x100)))
+PRINTABLE = "".join([ chr(c) if 0x20 <= c < 0x7f else "." for c in xrange(256) ])
+
+# a NUL byte or lots of control characters, like file(1) decides
+def is_binary(head):
+  head = head[:SNIFF_SIZE]
+  if not head:
+    return False
+  if "\0" in head:
+    return True
+  return len(head.translate(None, TEXT_CHARS)) > len(head) * 0.3
+
+def sniff_head(lines):
+  head = []
+  size = 0
+  for line in lines:
+    head.append(line[:SNIFF_SIZE - size])
+    size += len(head[-1])
+    if size >= SNIFF_SIZE:
+      break
+  return "".join(head)
+
+# the file, mapped, or None if it can't be (compressed, not a regular file)
+def map_file(path):
+  try:
+    if not os.path.isfile(path) or not os.path.getsize(path):
+      return
+    with open(path, "rb") as f:
+      if sniff_format(f.read(8)):
+        return
+      return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except (IOError, OSError, ValueError, mmap.error):
+    return
+
+# the rows of a hexdump, as (offset, bytes)
+class HexRows(object):
+  def __init__(self, data):
+    self.data = data
+
+  def __len__(self):
+    return (len(self.data) + ROW_BYTES - 1) / ROW_BYTES
+
+  def __getitem__(self, row):
+    if row < 0 or row >= len(self):
+      raise IndexError(row)
+    offset = row * ROW_BYTES
+    return offset, self.data[offset:offset + ROW_BYTES]
+
+def row_markup(offset, chunk):
+  hexed = [ "%02x" % ord(char) for char in chunk ]
+  hexed += [ "  " ] * (ROW_BYTES - len(chunk))
+  half = ROW_BYTES / 2
+  return [
+    ('highlight', "%08x" % offset),
+    "  %s  %s  |%s|" % (" ".join(hexed[:half]), " ".join(hexed[half:]), chunk.translate(PRINTABLE)),
+  ]
+
+def row_text(offset, chunk):
+  return "".join(part if isinstance(part, str) else part[1] for part in row_markup(offset, chunk))
+
+# vim: set foldmethod=marker
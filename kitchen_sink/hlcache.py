@@ -0,0 +1,129 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# on disk cache of syntax highlighted output. the same diffs and files get
+# opened over and over, so the style runs pygments computes for a chunk of
+# text are kept, keyed by a hash of the text, the lexer and the style. the
+# directory is trimmed back to its size budget by dropping the least recently
+# read entries.
+# }}}
+
+import cPickle
+import hashlib
+import os
+import tempfile
+import threading
+import zlib
+
+# lexing small chunks is cheaper than a trip to the disk
+MIN_SIZE = 1024
+
+class HighlightCache(object):
+  def __init__(self, directory, max_size):
+    self.directory = directory
+    self.max_size = max_size
+    self.size = None
+    self.lock = threading.Lock()
+    self.enabled = True
+
+    try:
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+    except OSError:
+      self.enabled = False
+
+  def key(self, text, lexer_name, style):
+    if not self.enabled or len(text) < MIN_SIZE:
+      return
+
+    if isinstance(text, unicode):
+      text = text.encode('utf-8')
+
+    digest = hashlib.sha1()
+    digest.update("%s\0%s\0" % (lexer_name, style))
+    digest.update(text)
+    return digest.hexdigest()
+
+  def path(self, key):
+    return os.path.join(self.directory, key)
+
+  def has(self, key):
+    return os.path.exists(self.path(key))
+
+  # the formatter's attributes are stored by their token type name, so they
+  # can be looked up again in the formatter that reads them back
+  def get(self, key, formatter):
+    if not key:
+      return
+
+    path = self.path(key)
+    try:
+      with open(path, "rb") as f:
+        runs = cPickle.loads(zlib.decompress(f.read()))
+      # reading an entry makes it recently used
+      os.utime(path, None)
+    except Exception:
+      return
+
+    attrs = formatter.style_attrs
+    return [ (attrs.get(name), text) for name, text in runs ]
+
+  def put(self, key, formatted_tokens, formatter):
+    if not key:
+      return
+
+    names = dict((id(attr), name) for name, attr in formatter.style_attrs.iteritems())
+    runs = [ (names.get(id(attr)), text) for attr, text in formatted_tokens ]
+    data = zlib.compress(cPickle.dumps(runs, 2), 1)
+
+    try:
+      fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+      with os.fdopen(fd, "wb") as f:
+        f.write(data)
+      os.rename(tmp, self.path(key))
+    except (OSError, IOError):
+      return
+
+    with self.lock:
+      if self.size is None:
+        self.size = self.disk_usage()
+      else:
+        self.size += len(data)
+
+      if self.size > self.max_size:
+        self.evict()
+
+  def entries(self):
+    entries = []
+    for name in os.listdir(self.directory):
+      if name.startswith("."):
+        continue
+
+      try:
+        stat = os.stat(self.path(name))
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, name))
+
+    return entries
+
+  def disk_usage(self):
+    return sum(size for mtime, size, name in self.entries())
+
+  # drop the least recently used entries until the cache is well under
+  # budget, so this doesn't run on every write
+  def evict(self):
+    entries = sorted(self.entries())
+    self.size = sum(size for mtime, size, name in entries)
+    target = self.max_size * 0.8
+    for mtime, size, name in entries:
+      if self.size <= target:
+        break
+
+      try:
+        os.unlink(self.path(name))
+        self.size -= size
+      except OSError:
+        pass
+
+# vim: set foldmethod=marker
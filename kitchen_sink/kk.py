@@ -21,15 +21,13 @@
 # GENERAL:
 # x speed up the log parsing for git commits (make this more asynchronous)
 # BUGS
-# fix partial syntax highlighting that can happen when switching during reading
+# x fix partial syntax highlighting that can happen when switching during reading
 # MATH
-# o calculate the big stats (avg, mean, etc)
+# x calculate the big stats (avg, mean, etc)
+# x sum a column
 
 # TODO
 
-# MATH
-# o sum a column
-
 # COLORS / WEB DEV
 # o highlight hex colors
 # o print a hex color in multiple formats?
@@ -41,18 +39,24 @@
 
 # {{{ imports
 import curses
+import errno
+import codecs
 import collections
 from collections import defaultdict
 import itertools
 import math
+import multiprocessing
+import optparse
 import os
 import re
+import select
+import shlex
+import string
 import subprocess
 import sys
 import time
 import urlparse
 import urwid
-import fileinput
 import threading
 import traceback
 
@@ -60,6 +64,25 @@ import pygments
 import pygments.formatters
 import pygments.lexers
 from urwidpygments import UrwidFormatter
+from numstats import BufferStats, crunch, PERCENTILES
+from tables import ColumnTable, sniff_table
+from templates import TemplateIndex
+from bufferstack import BufferStack
+from hlcache import HighlightCache
+from diffindex import DiffIndex
+from folds import FoldMap
+from lexpool import LexPool
+from hexview import HexRows, is_binary, map_file, row_markup, row_text, sniff_head, SNIFF_SIZE
+from linediff import line_hashes, diff_lines, patience_diff, unified_diff
+from gitprefetch import CommitCache
+from render import BatchRenderer, source_name
+from fuzzy import FuzzyIndex
+import memstats
+import sidecar
+import timeindex
+from debuglog import DebugLog, parse_levels
+from compressed import read_lines, open_lines, open_lines_near, get_index, put_index, InputError
+from scheduler import WorkScheduler, Cancelled, PRIORITY_INPUT, PRIORITY_INGEST, PRIORITY_SYNTAX, PRIORITY_IDLE
 from pygments.lexers import guess_lexer
 # }}}
 
@@ -71,6 +94,115 @@ TAB_SPACES = TAB_WIDTH * " "
 if 'KK_STYLE' in os.environ:
     PYGMENTS_STYLE = os.environ['KK_STYLE']
 
+# highlighted output is cached on disk (up to HL_CACHE_SIZE MB), so opening the
+# same diff again doesn't re-lex it. an empty KK_HL_CACHE turns it off
+HL_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'kk', 'highlight')
+HL_CACHE_SIZE = 64
+
+if 'KK_HL_CACHE' in os.environ:
+    HL_CACHE_DIR = os.environ['KK_HL_CACHE']
+
+if 'KK_HL_CACHE_SIZE' in os.environ:
+    HL_CACHE_SIZE = int(os.environ['KK_HL_CACHE_SIZE'])
+
+# memory budget (in MB) for the buffers on the stack and how many of the most
+# recent ones keep their rendered widgets
+STACK_BUDGET = 256
+STACK_VIEWS = 3
+
+if 'KK_STACK_BUDGET' in os.environ:
+    STACK_BUDGET = int(os.environ['KK_STACK_BUDGET'])
+
+if 'KK_STACK_VIEWS' in os.environ:
+    STACK_VIEWS = int(os.environ['KK_STACK_VIEWS'])
+
+# start syntax highlighting in the background once a buffer is done reading,
+# so 's' only has to swap the views. it backs off while keys are being pressed
+PREHIGHLIGHT = 'KK_PREHIGHLIGHT' in os.environ
+IDLE_DELAY = 0.2
+
+# the most frames per second that reading and other background work can cause,
+# keyboard driven frames are always drawn right away
+MAX_FPS = 20
+
+if 'KK_MAX_FPS' in os.environ:
+    MAX_FPS = float(os.environ['KK_MAX_FPS'])
+
+# background work runs on a small pool of workers. jobs do a chunk of work at a
+# time (CHUNK_SIZE lines or MATCH_SLICE seconds) before giving the workers back
+WORKERS = 2
+CHUNK_SIZE = 157
+MAX_CHUNK_SIZE = 2273
+MATCH_SLICE = 0.05
+
+if 'KK_WORKERS' in os.environ:
+    WORKERS = int(os.environ['KK_WORKERS'])
+
+# big buffers (of more than PARALLEL_LEX_LINES lines) in languages that can be
+# cut up safely are lexed on LEX_PROCS processes. 0 or 1 turns it off
+LEX_PROCS = multiprocessing.cpu_count()
+PARALLEL_LEX_LINES = 20000
+
+if 'KK_LEX_PROCS' in os.environ:
+    LEX_PROCS = int(os.environ['KK_LEX_PROCS'])
+
+# in a git log, the GIT_PREFETCH commits on either side of the cursor are
+# fetched with git show (and highlighted) in the background, so opening them
+# doesn't wait on git. 0 turns it off
+GIT_PREFETCH = 2
+
+if 'KK_GIT_PREFETCH' in os.environ:
+    GIT_PREFETCH = int(os.environ['KK_GIT_PREFETCH'])
+
+# the template menu ('u') lists this many of the most common templates
+TEMPLATE_MENU_SIZE = 5000
+# the bars of the time histogram ('T') are up to this wide
+HISTOGRAM_WIDTH = 30
+
+# once kk's resident memory goes over SOFT_LIMIT (in MB, 0 is no limit) the
+# caches it can do without are dropped. KK_MEMSTATS prints where the memory
+# went on exit, KK_TRACEMALLOC adds tracemalloc's view. python 2 has no
+# tracemalloc, it needs the pytracemalloc backport
+SOFT_LIMIT = 0
+MEMSTATS = 'KK_MEMSTATS' in os.environ
+TRACEMALLOC = 'KK_TRACEMALLOC' in os.environ
+
+if 'KK_SOFT_LIMIT' in os.environ:
+    SOFT_LIMIT = int(os.environ['KK_SOFT_LIMIT'])
+
+# the indexes built for a file (:t and 'T', 'u', 't', 'm' and the offsets of
+# its lines) are saved in SIDECAR_DIR, keyed by the file's path, size and
+# mtime, and picked up the next time it is opened. the directory is kept
+# under SIDECAR_LIMIT MB.
+# KK_SIDECAR_DIR="" turns it off
+SIDECAR_DIR = sidecar.default_dir()
+SIDECAR_LIMIT = 512
+SIDECAR_KEYS = [ 'times', 'templates', 'table', 'numstats' ]
+
+if 'KK_SIDECAR_DIR' in os.environ:
+    SIDECAR_DIR = os.environ['KK_SIDECAR_DIR']
+
+if 'KK_SIDECAR_LIMIT' in os.environ:
+    SIDECAR_LIMIT = int(os.environ['KK_SIDECAR_LIMIT'])
+
+# lines are stored as the bytes that came in and only decoded when they are
+# shown, searched or highlighted. bad bytes become U+FFFD instead of errors
+ENCODING = 'utf-8'
+LINE_WIDGET_CACHE = 4096
+
+# lines longer than this (in bytes) are never laid out whole, only the part
+# that fits in LONG_LINE is decoded and shown
+LONG_LINE = 4096
+
+if 'KK_ENCODING' in os.environ:
+    ENCODING = os.environ['KK_ENCODING']
+
+# the bytes that continue a character, a long line is never cut before one.
+# other encodings are taken to be a byte per character
+CONTINUATION_BYTES = ""
+if codecs.lookup(ENCODING).name == 'utf-8':
+  CONTINUATION_BYTES = "".join([ chr(i) for i in xrange(0x80, 0xc0) ])
+
 # {{{ util
 def consume(iterator, n):
   '''Advance the iterator n-steps ahead. If n is none, consume entirely.'''
@@ -79,6 +211,7 @@ def consume(iterator, n):
 
 digit_color_re = re.compile('\033\[\d*;?\d*m')
 escape_code_re = re.compile('\033\[\d*[ABCDEFGHIJK]')
+ansi_code_re = re.compile('\033\[\d*;?\d*m|\033\[\d*[ABCDEFGHIJK]')
 backspace_re = re.compile('.\x08')
 
 def clear_escape_codes(line):
@@ -93,6 +226,81 @@ def clear_escape_codes(line):
 
   return newline
 
+def decode_line(line):
+  if isinstance(line, unicode):
+    return line
+
+  return line.decode(ENCODING, 'replace')
+
+# the markup of a text widget, minus its first `start` characters
+def clip_markup(widget, start):
+  text, attrs = widget.get_text()
+  markup = []
+  pos = 0
+  for attr, length in attrs:
+    markup.append((attr, text[pos:pos + length]))
+    pos += length
+  if pos < len(text):
+    markup.append((None, text[pos:]))
+
+  clipped = []
+  for attr, piece in markup:
+    if start >= len(piece):
+      start -= len(piece)
+      continue
+    clipped.append((attr, piece[start:]))
+    start = 0
+
+  return clipped or ""
+
+def char_count(text):
+  return len(text.translate(None, CONTINUATION_BYTES))
+
+# the byte offset of the nth character of text that has no escape codes in it
+def char_offset(text, n):
+  offset = n
+  while offset < len(text):
+    count = char_count(text[:offset])
+    if count >= n:
+      break
+    offset += n - count
+
+  while offset < len(text) and text[offset] in CONTINUATION_BYTES:
+    offset += 1
+  return min(offset, len(text))
+
+# the bytes of a long line from its column'th character on, about size of
+# them. escape codes aren't counted as characters, neither end cuts one (or a
+# character) in half, and the color in effect at the column is carried over.
+# returns the slice and the number of bytes left after it
+def slice_long_line(line, column, size):
+  pos = 0
+  end = len(line)
+  color = ""
+  for match in ansi_code_re.finditer(line):
+    count = char_count(line[pos:match.start()])
+    if count > column:
+      end = match.start()
+      break
+
+    column -= count
+    pos = match.end()
+    if match.group().endswith("m"):
+      color = match.group()
+
+  start = pos + char_offset(line[pos:end], column)
+  cut = min(start + size, len(line))
+  while cut < len(line) and cut > start and line[cut] in CONTINUATION_BYTES:
+    cut -= 1
+
+  escape = line.rfind("\033", start, cut)
+  if escape != -1:
+    match = ansi_code_re.match(line, escape)
+    if not match or match.end() > cut:
+      cut = escape
+
+  return color + line[start:cut], len(line) - cut
+
 def add_vim_movement():
   updatedMappings = {
     'k':        'cursor up',
@@ -109,36 +317,100 @@ def add_vim_movement():
 from os import environ as ENV
 
 PROFILE="PROFILE" in ENV
+# the files to read (stdin if there are none), set from the command line
+INPUT_PATHS = []
+# the command to re-run (kk -w) and how often
+WATCH = None
+# the line to open the file at (kk -l)
+START_LINE = 0
 DEBUG="DEBUG" in ENV
-if DEBUG:
-  debugfile = open(__name__ + ".debug", "w")
-  debugfile.close()
+
+# with DEBUG set, each subsystem logs at KK_DEBUG_LEVEL (debug) unless
+# KK_DEBUG_LEVELS says otherwise, e.g. "syntax=trace,render=off".
+# KK_DEBUG_FORMAT picks text, jsonl or binary
+DEBUG_LEVEL = ENV.get("KK_DEBUG_LEVEL", "debug")
+DEBUG_LEVELS = parse_levels(ENV.get("KK_DEBUG_LEVELS", ""))
+DEBUG_FORMAT = ENV.get("KK_DEBUG_FORMAT", "text")
+DEBUG_SUFFIXES = { "text" : ".debug", "jsonl" : ".debug.jsonl", "binary" : ".debug.bin" }
+
+debug_log = DebugLog(__name__ + DEBUG_SUFFIXES.get(DEBUG_FORMAT, ".debug") if DEBUG else None,
+  DEBUG_LEVELS, DEBUG_LEVEL, DEBUG_FORMAT)
+general_log = debug_log.channel("general")
+ingest_log = debug_log.channel("ingest")
+syntax_log = debug_log.channel("syntax")
+menu_log = debug_log.channel("menus")
+render_log = debug_log.channel("render")
 
 def debug(*args):
-  if DEBUG:
-    debugfile = open(__name__ + ".debug", "a")
-    print >> debugfile, time.time(),
-    print >> debugfile, " ".join([str(i) for i in args])
-    debugfile.close()
+  general_log.debug(*args)
 
 debug("USING STYLE", PYGMENTS_STYLE)
 
 # }}}
 
 # {{{ input
-def tokenize(lines, start_index=0):
-  # http://redd.it (example URL)
-  all_tokens = []
-  for index, line in enumerate(lines):
-    tokens = line.split()
-    for t_index, token in enumerate(tokens):
-      all_tokens.append({
-        "text" : token,
-        "line" : start_index + index,
-        "column" : t_index
-      })
-
-  return all_tokens
+# like fileinput, but compressed files (and stdin) are decompressed on the fly
+def read_input(paths):
+  for path in paths or [ '-' ]:
+    try:
+      if path == '-':
+        lines = read_lines(sys.stdin)
+      else:
+        lines = open_lines(path)
+
+      for line in lines:
+        yield line
+    except (InputError, IOError), e:
+      yield "kk: %s: %s\n" % (path, e)
+
+# a file that is already open, streamed into a buffer. an error while reading
+# it ends the buffer with a line saying so, like read_input
+def reported_lines(path, lines):
+  try:
+    for line in lines:
+      yield line
+  except (InputError, IOError), e:
+    yield "kk: %s: %s\n" % (path, e)
+
+# groups lines (in memory or read from a file) into growing chunks, so the
+# first ones go up on screen quickly and later ones keep the overhead down
+def chunk_lines(gen):
+  size = CHUNK_SIZE
+  while True:
+    lines = list(itertools.islice(gen, int(size)))
+    if not lines:
+      return
+
+    yield lines
+    if size < MAX_CHUNK_SIZE:
+      size *= 1.5
+
+# groups lines from a pipe as they arrive. a batch goes out once it is big
+# enough or has waited long enough, whichever comes first
+def stream_batches(fd, max_delay=0.1, max_lines=MAX_CHUNK_SIZE):
+  partial = ""
+  batch = []
+  last = time.time()
+  while True:
+    ready = select.select([fd], [], [], max_delay)[0]
+    if ready:
+      data = os.read(fd, 65536)
+      if not data:
+        break
+
+      pieces = (partial + data).split("\n")
+      partial = pieces.pop()
+      batch.extend(piece + "\n" for piece in pieces)
+
+    if batch and (len(batch) >= max_lines or time.time() - last >= max_delay):
+      yield batch
+      batch = []
+      last = time.time()
+
+  if partial:
+    batch.append(partial)
+  if batch:
+    yield batch
 
 "http://google.com/the/first/one"
 
@@ -159,7 +431,7 @@ def get_content_from_editor(initial=""):
     # Create the initial temporary file.
     with NamedTemporaryFile(delete=False) as tf:
         tfName = tf.name
-        debug("opening file in editor:" + str(tfName))
+        menu_log.debug("opening file in editor:" + str(tfName))
         tf.write(initial)
 
     # Fire up the editor.
@@ -205,7 +477,7 @@ class DiffLine(urwid.Text):
             tokens[0] = ('diff_add', ' ')
 
     except Exception, e:
-      debug("DIFF LINE EXC: ", e)
+      syntax_log.warn("DIFF LINE EXC: ", e)
 
 
     return super(DiffLine, self).__init__(tokens)
@@ -234,6 +506,11 @@ class TextBox(urwid.ListBox):
   def highlight_middle(self, size, focus):
     vis = self.calculate_visible(size, focus)
 
+    # nothing in the walker (yet)
+    if vis[0] is None:
+      self.top_position = self.bottom_position = self.middle_position = 0
+      return
+
     top_trimmed_rows = vis[1][1]
     bot_trimmed_rows = vis[2][1]
 
@@ -263,17 +540,139 @@ class TextBox(urwid.ListBox):
     self.middle_position = middle
 # }}}
 
+# {{{ LineWalker
+def fold_widget(fold):
+  return urwid.Text(('highlight', "+-- %s (%s lines folded)" % (fold.label, fold.hidden + 1)), wrap='clip')
+
+# a walker over the raw lines of a buffer. the text widget for a line is only
+# built (and its bytes decoded) once the listbox asks for it, so reading a
+# buffer never pays for lines that are not looked at. folded ranges of lines
+# take up one row
+class LineWalker(urwid.ListWalker):
+  def __init__(self, make_widget, lines=None, folds=None):
+    self.make_widget = make_widget
+    self.lines = list(lines or [])
+    self.folds = folds
+    self.widgets = {}
+    self.overrides = {}
+    self.focus = 0
+
+  def __len__(self):
+    if self.folds:
+      return len(self.lines) - self.folds.hidden
+    return len(self.lines)
+
+  def __getitem__(self, position):
+    if position < 0 or position >= len(self):
+      raise IndexError(position)
+
+    if position in self.overrides:
+      return self.overrides[position]
+
+    widget = self.widgets.get(position)
+    if widget is None:
+      if len(self.widgets) >= LINE_WIDGET_CACHE:
+        self.widgets = {}
+
+      fold = self.folds and self.folds.fold_at(position)
+      if fold:
+        widget = fold_widget(fold)
+      else:
+        widget = self.make_widget(self.lines[self.line(position)])
+      self.widgets[position] = widget
+
+    return widget
+
+  def line(self, position):
+    if self.folds:
+      return self.folds.to_line(position)
+    return position
+
+  # replaced lines (search highlights) stick around until they are put back
+  def __setitem__(self, position, widget):
+    self.overrides[position] = widget
+    self._modified()
+
+  def text(self, position):
+    fold = self.folds and self.folds.fold_at(position)
+    if fold:
+      return fold_widget(fold).get_text()[0]
+    return clear_escape_codes(decode_line(self.lines[self.line(position)])).rstrip("\r\n")
+
+  def next_position(self, position):
+    if position + 1 >= len(self):
+      raise IndexError(position)
+    return position + 1
+
+  def prev_position(self, position):
+    if position <= 0:
+      raise IndexError(position)
+    return position - 1
+
+  def set_focus(self, position):
+    self.focus = position
+    self._modified()
+
+  # the way lines are shown (or folded) changed, build their widgets again
+  def refresh(self, folded=False):
+    self.widgets = {}
+    if folded:
+      self.overrides = {}
+    self._modified()
+
+  def extend(self, lines):
+    self.lines.extend(lines)
+    self._modified()
+
+  def append(self, line):
+    self.lines.append(line)
+    self._modified()
+
+  # applies the (tag, i1, i2, j1, j2) changes of a line diff. only the
+  # widgets of changed lines are built again, unless lines moved
+  def apply_diff(self, changes, lines):
+    shifted = False
+    for tag, i1, i2, j1, j2 in reversed(changes):
+      self.lines[i1:i2] = lines[j1:j2]
+      if i2 - i1 != j2 - j1:
+        shifted = True
+      for position in xrange(i1, i2):
+        self.widgets.pop(position, None)
+
+    if shifted or self.folds:
+      self.widgets = {}
+      self.overrides = {}
+    self.focus = min(self.focus, max(len(self) - 1, 0))
+    self._modified()
+
+# a hexdump of binary input. its "lines" are the rows of the dump, read
+# straight from the input's bytes
+class HexWalker(LineWalker):
+  def __init__(self, data):
+    super(HexWalker, self).__init__(self.row_widget)
+    self.lines = HexRows(data)
+
+  def row_widget(self, row):
+    return urwid.Text(row_markup(*row), wrap='clip')
+
+  def text(self, position):
+    return row_text(*self.lines[position])
+# }}}
+
 # {{{ overlay widget
 class OverlayStack(urwid.WidgetPlaceholder):
   def __init__(self, *args, **kwargs):
     super(OverlayStack, self).__init__(*args, **kwargs)
     self.overlay_opened = False
+    self.on_close = None
 
-  def open_overlay(self, widget, modal_keys=None, **options):
+  def open_overlay(self, widget, modal_keys=None, on_close=None, **options):
     global _key_hooks
     if not modal_keys:
       modal_keys = {}
 
+    self.on_close = on_close
+
     modal_keys.update({ "q" : CURSES_HOOKS['q'], "esc" : CURSES_HOOKS['esc'], "backspace" : CURSES_HOOKS['esc'] })
     # we should install these modal keys
     _key_hooks = modal_keys
@@ -303,6 +702,10 @@ class OverlayStack(urwid.WidgetPlaceholder):
 
   def close_overlay(self, ret=None, widget=None):
     global _key_hooks
+    if self.on_close:
+      self.on_close()
+      self.on_close = None
+
     self.original_widget = self.overlay_parent
     self.overlay_opened = False
     _key_hooks = CURSES_HOOKS
@@ -311,46 +714,89 @@ class OverlayStack(urwid.WidgetPlaceholder):
 
 # {{{ character handlers
 
+# a menu only builds buttons for the entries on screen, so it can hold
+# thousands of them. the entries shown are the ones matching the filter
+class MenuWalker(urwid.ListWalker):
+  def __init__(self, make_widget):
+    self.make_widget = make_widget
+    self.entries = []
+    self.widgets = {}
+    self.focus = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __getitem__(self, position):
+    if position < 0 or position >= len(self.entries):
+      raise IndexError(position)
+
+    entry = self.entries[position]
+    widget = self.widgets.get(entry)
+    if widget is None:
+      if len(self.widgets) >= LINE_WIDGET_CACHE:
+        self.widgets = {}
+      widget = self.widgets[entry] = self.make_widget(entry)
+    return widget
+
+  def next_position(self, position):
+    if position + 1 >= len(self.entries):
+      raise IndexError(position)
+    return position + 1
+
+  def prev_position(self, position):
+    if position <= 0:
+      raise IndexError(position)
+    return position - 1
+
+  def set_focus(self, position):
+    self.focus = position
+    self._modified()
+
+  def set_entries(self, entries):
+    self.entries = entries
+    self.focus = 0
+    self._modified()
+
+  def append(self, entry):
+    self.entries.append(entry)
+    self._modified()
+
 class MenuOverlay(object):
   def __init__(self, *args, **kwargs):
-    self.build_menu(*args, **kwargs)
     self.num_entries = 0
     self.entries = {}
     self.entry_lookup = {}
     self.current_entry = ""
+    self.index = FuzzyIndex()
+    self.filtering = False
+    self.build_menu(*args, **kwargs)
 
-  def build_button(self, text, value):
+  def build_button(self, entry):
+    text = self.index.items[entry]
     def button_pressed(but):
       self.cb(text)
 
-    button_text = "[%s] %s" % (self.num_entries, text[:40])
+    button_text = "[%s] %s" % (entry, text[:self.label_width])
     button = urwid.Button(button_text, on_press=button_pressed)
-    button.button_text = value
+    button.button_text = text
 
     return button
 
-  def build_menu(self, widget=None, title="", items=[], focused=None, cb=None, modal_keys=None):
+  def build_menu(self, widget=None, title="", items=[], focused=None, cb=None, modal_keys=None, label_width=40, **options):
 
     self.cb = cb
-    walker = urwid.SimpleListWalker([self.button(token, token) for token in items])
-    self.listbox = urwid.ListBox(walker)
-    self.linebox = urwid.LineBox(self.listbox)
-
-    focused_index = 0
-    for index, token in enumerate(walker):
-      if token.button_text == focused:
-        # Need to account for the insertion of the title at the start (below), so
-        # we add 1
-
-        focused_index = index + 1
-
-    walker.insert(0, urwid.Text(title))
-
-    try:
-      self.listbox.set_focus(focused_index)
-    except:
-      pass
-
+    self.label_width = label_width
+    self.token = None
+    self.title = title
+    self.header = urwid.Text(title)
+    self.walker = MenuWalker(self.build_button)
+    self.listbox = urwid.ListBox(self.walker)
+    self.linebox = urwid.LineBox(urwid.Frame(self.listbox, header=self.header))
+
+    for item in items:
+      index = self.add_entry(item)
+      if item == focused:
+        self.focus(index)
 
     if not modal_keys:
       modal_keys = {}
@@ -368,25 +814,109 @@ class MenuOverlay(object):
 
     modal_keys['enter'] = { "fn" : self.confirm_action }
 
-    widget.open_overlay(self.linebox, modal_keys=modal_keys)
+    widget.open_overlay(self.linebox, modal_keys=modal_keys, on_close=self.closed, **options)
+    self.add_filter_keys(modal_keys)
+
+  # {{{ filtering
+  # '/' starts filtering: from then on typed characters go into the filter
+  # instead of being menu keys, until enter or esc
+  def add_filter_keys(self, modal_keys):
+    def make_func(char, fallback):
+      def handle_key(kv, ret, widget):
+        if self.filtering:
+          self.set_query(self.index.query + char)
+          return
+
+        if fallback:
+          return fallback['fn'](kv, ret, widget)
+
+        # not a menu key, let the listbox have it
+        return True
+
+      return handle_key
+
+    for char in string.printable:
+      if char not in string.whitespace or char == " ":
+        fallback = modal_keys.get(char)
+        modal_keys[char] = { "fn" : make_func(char, fallback), "help" : (fallback or {}).get("help") }
+
+    def start_filtering(kv, ret, widget):
+      if self.filtering:
+        self.set_query(self.index.query + "/")
+      else:
+        self.filtering = True
+        self.update_header()
+
+    def backspace(kv, ret, widget):
+      if not self.filtering:
+        return close_menu['fn'](kv, ret, widget)
+
+      if self.index.query:
+        self.set_query(self.index.query[:-1])
+      else:
+        self.filtering = False
+        self.update_header()
+
+    def escape(kv, ret, widget):
+      if not self.filtering:
+        return close_menu['fn'](kv, ret, widget)
+      self.filtering = False
+      self.update_header()
+
+    close_menu = modal_keys['esc']
+    modal_keys['/'] = { "fn" : start_filtering, "help" : "filter the entries" }
+    modal_keys['backspace'] = { "fn" : backspace }
+    modal_keys['esc'] = { "fn" : escape }
+
+  def set_query(self, query):
+    self.walker.set_entries(self.index.filter(query))
+    self.update_header()
+
+  def update_header(self):
+    header = self.title
+    if self.filtering or self.index.query:
+      header = "%s\n/%s%s  (%s of %s)" % (header, self.index.query, "_" if self.filtering else "",
+        len(self.walker), len(self.index))
+    self.header.set_text(header)
+  # }}}
+
+  # stop looking for more entries once the menu is gone
+  def closed(self):
+    if self.token:
+      self.token.cancel()
 
   def add_entry(self, entry):
     if entry in self.entry_lookup:
         return -1
 
-    button = self.build_button(entry, entry)
-    index = len(self.listbox.body)
-    self.listbox.body.append(button)
+    index = self.index.add(entry)
+    if not self.index.query:
+      self.walker.append(index)
+    elif self.index.ranked and self.index.ranked[-1] == index:
+      self.walker._modified()
+      self.update_header()
 
     self.entry_lookup[entry] = str(self.num_entries)
     self.entries[str(self.num_entries)] = entry
     self.num_entries += 1
     return index
 
+  # focuses the entry, if it is shown
   def focus(self, index):
-    self.listbox.set_focus(index)
+    try:
+      position = self.walker.entries.index(index)
+    except ValueError:
+      return
+
+    self.listbox.set_focus(position)
     self.listbox.set_focus_valign('middle')
 
+  # the text of the focused entry
+  def focused_entry(self):
+    button, position = self.listbox.get_focus()
+    if button is not None:
+      return button.button_text
+
   def number_pressed(self, kv, x):
     self.current_entry += str(x)
     kv.display_status_msg("#%s" % self.current_entry)
@@ -396,6 +926,8 @@ class MenuOverlay(object):
     return text
 
   def confirm_action(self, kv, ret, widget):
+    self.filtering = False
+    self.update_header()
     if self.current_entry in self.entries:
       text = self.get_current_entry()
       kv.display_status_msg("Selecting [%s] %s" % (self.current_entry, text))
@@ -407,82 +939,70 @@ class MenuOverlay(object):
     self.current_entry = ""
 
 
-
-
-
-
 def do_syntax_coloring(kv, ret, widget):
   kv.toggle_syntax_coloring()
 
-def iterate_and_match_tokens_worker(kv, tokens, focused_line_no, func, overlay, cur_closest_distance=10000000000, closest_token=None, focused_once=False):
-  debug("ITERATE AND MATCH TOKENS")
+# matching runs on the work scheduler a slice of tokens at a time, the entries
+# it finds are added to the overlay by the UI thread
+# the buffer isn't split into tokens ahead of time, the lines are split here as
+# they are walked. the iterator is shared by the slices, it copes with lines
+# being added (or swapped by a watch) in between
+def iterate_and_match_tokens_worker(kv, lines, focused_line_no, func, overlay):
+  render_log.trace("ITERATE AND MATCH TOKENS")
   visited = {}
+  token = kv.work.token(kv.ret['token'])
+  overlay.token = token
+  state = {
+    "closest_distance" : 10000000000,
+    "closest_index" : None,
+    "focused_once" : False
+  }
 
-  for index, token in enumerate(tokens):
-    text = token['text']
-    if not text in visited:
-      visited[text] = True
-
-      ret = func(text, visited)
-      if ret:
-        closeness = abs(focused_line_no - token['line'])
-        token_index = overlay.add_entry(ret)
-        if token_index == -1:
-            continue
-
-        if closeness < cur_closest_distance:
-          cur_closest_distance = closeness
-          closest_token = token_index
-          debug("SETTING CLOSEST TOKEN", closeness, closest_token)
-
-        elif closeness > cur_closest_distance and closest_token and not focused_once:
-          # TIME TO FOCUS.
-          debug("FOCUSING CLOSEST TOKEN", closest_token)
-          overlay.focus(closest_token)
-          focused_once = True
-
-
-
-        def future_call(tokens):
-          iterate_and_match_tokens_worker(kv,
-            tokens,
-            focused_line_no,
-            func,
-            overlay,
-            cur_closest_distance=cur_closest_distance,
-            closest_token=closest_token,
-            focused_once=focused_once)
-
-        next_tokens = tokens[index+1:]
-        thread=threading.Thread(target=future_call, args=[next_tokens])
-        time.sleep(0.01)
-        kv.redraw_parent()
-        if not kv.quit:
-          thread.start()
-        return
-
+  def add_matches(matches):
+    for ret, closeness in matches:
+      token_index = overlay.add_entry(ret)
+      if token_index == -1:
+        continue
 
-def iterate_and_match_tokens(tokens, focused_line_no, func):
-  files = []
-  visited = {}
-  cur_closest_distance = 10000000000000
-  closest_token = None
+      if closeness < state['closest_distance']:
+        state['closest_distance'] = closeness
+        state['closest_index'] = token_index
+        render_log.trace("SETTING CLOSEST TOKEN", closeness, token_index)
+
+      elif closeness > state['closest_distance'] and state['closest_index'] and not state['focused_once']:
+        # TIME TO FOCUS.
+        render_log.trace("FOCUSING CLOSEST TOKEN", state['closest_index'])
+        overlay.focus(state['closest_index'])
+        state['focused_once'] = True
+
+    kv.invalidate('overlay')
+
+  rows = enumerate(lines)
+  def match_tokens():
+    matches = []
+    started = time.time()
+    done = True
+    for index, line in rows:
+      for text in clear_escape_codes(line).split():
+        if not text in visited:
+          visited[text] = True
+
+          ret = func(text, visited)
+          if ret:
+            matches.append((ret, abs(focused_line_no - index)))
+
+      token.check()
+      if time.time() - started >= MATCH_SLICE:
+        done = False
+        break
 
-  for token in tokens:
-    text = token['text']
-    if not text in visited:
-      visited[text] = True
+    if matches:
+      kv.work.post(lambda: add_matches(matches), token)
 
-      ret = func(text, visited)
-      if ret:
-        closeness = abs(focused_line_no - token['line'])
-        if closeness < cur_closest_distance:
-          cur_closest_distance = closeness
-          closest_token = ret
-          debug("SETTING CLOSEST TOKEN", closeness, closest_token)
-        files.append(ret)
+    if not done:
+      kv.work.submit(match_tokens, PRIORITY_INPUT, token)
 
-  return (files, closest_token)
+  kv.work.submit(match_tokens, PRIORITY_INPUT, token)
 
 CHECKED_GIT = {}
 def is_git_like(obj):
@@ -503,20 +1023,22 @@ def do_get_git_objects(kv, ret, widget):
     now = time.time()
     match = re.search('[0-9a-f]{5,40}', filename)
     if match:
-      debug(filename, "IS GIT LIKE")
+      menu_log.debug(filename, "IS GIT LIKE")
       if is_git_like(filename):
         return filename[:10]
 
   focused_line = kv.window.original_widget.get_middle_index()
 
   def func(response):
-    contents = subprocess.check_output(['git', 'show', response])
-    lines = [contents]
+    contents = kv.commits.get(response)
     widget.close_overlay()
-    kv.read_and_display(lines)
+    if contents is None:
+      kv.display_status_msg(('diff_del', "git show %s failed" % response))
+      return
+    kv.read_and_display([contents])
 
   overlay = MenuOverlay(widget=widget, title="Choose a git object to open", cb=func)
-  iterate_and_match_tokens_worker(kv, ret['tokens'], focused_line, git_matcher, overlay)
+  iterate_and_match_tokens_worker(kv, ret['lines'], focused_line, git_matcher, overlay)
 
 
 
@@ -571,30 +1093,35 @@ def do_get_files(kv, ret, widget):
     line_no = 0
     if len(split_resp) == 2:
       response, line_no = split_resp
+    line_no = int(line_no)
     try:
-      with open(response, "r") as f:
-        contents = list(f.readlines())
-        widget.close_overlay()
-        kv.read_and_display(contents)
-    except Exception, e:
-      debug("EXCEPTION", e)
+      # deep into a file that was read before, start from the closest
+      # checkpoint instead of reading (or decompressing) everything before it
+      kv.load_offsets(response)
+      near = open_lines_near(response, line_no)
+      if near:
+        first_line, contents = near
+      else:
+        first_line, contents = 0, open_lines(response)
+    except (InputError, IOError), e:
+      kv.display_status_msg(str(e))
+      return
 
-    kv.window.original_widget.set_focus(int(line_no))
+    # only the lines down to the one asked for are read before it goes up on
+    # screen, the rest streams in behind it
+    widget.close_overlay()
+    kv.read_and_display(stream=reported_lines(response, contents), line_offset=first_line,
+      target=max(line_no - first_line, 0))
 
   def open_in_editor(kv, ret, widget):
-    box = kv.window.widget.original_widget
-    button, index = box.get_focus()
-
     filename = None
     if overlay.current_entry:
       filename = overlay.get_current_entry()
 
     if not filename:
-      # assuming first line is not a file
-      if not index:
+      filename = overlay.focused_entry()
+      if not filename:
         return
-
-      filename = button.button_text
     split_resp = filename.split(':')
     line_no = 0
     if len(split_resp) == 2:
@@ -612,12 +1139,10 @@ def do_get_files(kv, ret, widget):
 
   overlay = MenuOverlay(widget, title="Choose a file to open. ('e' to open in editor)",
     cb=func, modal_keys=modal_keys)
-  iterate_and_match_tokens_worker(kv, ret['tokens'], focused_line, file_matcher, overlay)
+  iterate_and_match_tokens_worker(kv, ret['lines'], focused_line, file_matcher, overlay)
 
 
 def do_get_urls(kv, ret, widget=None):
-  tokens = ret['tokens']
-
   def url_matcher(text, visited):
     match = re.search("^\W*(https?://[\w\./]*|www.[\w\./\?&\.]*)", text)
     if match:
@@ -631,7 +1156,7 @@ def do_get_urls(kv, ret, widget=None):
     widget.close_overlay()
 
   overlay = MenuOverlay(widget, title="Choose a URL to open", cb=func)
-  iterate_and_match_tokens_worker(kv, ret['tokens'], focused_line, url_matcher, overlay)
+  iterate_and_match_tokens_worker(kv, ret['lines'], focused_line, url_matcher, overlay)
 
 def do_exit():
   raise urwid.ExitMainLoop()
@@ -639,7 +1164,7 @@ def do_exit():
 
 def do_print(kv, ret, scr):
   def func():
-    print ret['joined']
+    print "".join(ret['lines'])
 
   kv.after_urwid.append(func)
   do_exit()
@@ -667,7 +1192,7 @@ def do_pop_stack(kv, ret, scr):
 def do_yank_text(kv, ret, widget):
   lines = [clear_escape_codes(line) for line in kv.ret['lines']]
 
-  debug("YANKING", len(lines), "LINES")
+  menu_log.debug("YANKING", len(lines), "LINES")
 
   args = [ 'xsel', '-pi' ]
 
@@ -681,6 +1206,16 @@ def do_yank_text(kv, ret, widget):
     kv.display_status_msg(('diff_del', "xsel is required to save the buffer to a clipboard"))
 
 
+def read_clipboard():
+  with open(os.devnull, "w") as fnull:
+    try:
+      return subprocess.check_output([ 'xsel', '-po' ], stderr=fnull)
+    except (OSError, subprocess.CalledProcessError):
+      return None
+
+def do_compare_stack(kv, ret, widget):
+  kv.compare_with_stack()
+
 def do_next_search(kv, ret, widget):
   kv.find_and_focus()
 
@@ -696,30 +1231,107 @@ def do_scroll_bottom(kv, ret, widget):
   kv.readjust_display(widget.original_widget, len(widget.original_widget.body))
 
 def do_list(kv, ret, widget):
-  debug("Entering list mode")
+  menu_log.debug("Entering list mode")
   setup_list_hooks()
 
 def do_general(kv, ret, widget):
-  debug("Entering general mode")
+  menu_log.debug("Entering general mode")
   setup_general_hooks()
 
 def do_math(kv, ret, widget):
-  debug("Entering math mode")
+  menu_log.debug("Entering math mode")
   kv.summarize_math()
 
+def do_table(kv, ret, widget):
+  menu_log.debug("Entering table mode")
+  kv.summarize_columns()
+
+def do_templates(kv, ret, widget):
+  menu_log.debug("Entering template mode")
+  kv.summarize_templates()
+
+def do_time_histogram(kv, ret, widget):
+  kv.show_time_histogram()
+
+
+def do_pipe_prompt(kv, ret, widget):
+  menu_log.debug("Entering pipe mode")
+  kv.open_command_line('!')
+
+def do_command_prompt(kv, ret, widget):
+  menu_log.debug("Entering command mode")
+  kv.open_command_line(':')
+
+def do_kill_pipe(kv, ret, widget):
+  kv.kill_pipe()
+
+def do_next_file(kv, ret, widget):
+  kv.jump_diff('file')
+
+def do_prev_file(kv, ret, widget):
+  kv.jump_diff('file', reverse=True)
+
+def do_next_hunk(kv, ret, widget):
+  kv.jump_diff('hunk')
+
+def do_prev_hunk(kv, ret, widget):
+  kv.jump_diff('hunk', reverse=True)
+
+def do_next_commit(kv, ret, widget):
+  kv.jump_diff('commit')
+
+def do_prev_commit(kv, ret, widget):
+  kv.jump_diff('commit', reverse=True)
+
+def do_open_commit(kv, ret, widget):
+  kv.open_commit()
+
+def do_file_list(kv, ret, widget):
+  kv.open_file_list()
+
+def do_memory_usage(kv, ret, widget):
+  kv.show_memory_usage()
+
+def do_toggle_fold(kv, ret, widget):
+  kv.toggle_fold()
+
+def do_fold_all(kv, ret, widget):
+  kv.fold_all_files()
+
+def do_unfold_prompt(kv, ret, widget):
+  kv.open_command_line('+')
+
+def do_toggle_wrap(kv, ret, widget):
+  kv.toggle_wrap()
+
+def do_scroll_left(kv, ret, widget):
+  kv.scroll_horizontally(-1)
+
+def do_scroll_right(kv, ret, widget):
+  kv.scroll_horizontally(1)
 
 def do_search_prompt(kv, ret, widget):
-  debug("Entering search mode")
+  menu_log.debug("Entering search mode")
   kv.open_command_line('/')
 
 def handle_command(kv, prompt, command):
-  debug("Handling command", prompt, command)
+  menu_log.debug("Handling command", prompt, command)
   if prompt == '/':
     kv.find_and_focus(command)
   elif prompt == ':':
-    kv.display_status_msg('Sorry, command mode is not yet implemented')
+    args = command.split()
+    if args[:1] == [ 'compare' ] and args[1:] in ([], [ 'stack' ]):
+      kv.compare_with_stack()
+    elif args == [ 'compare', 'clip' ]:
+      kv.compare_with_clipboard()
+    elif args[:1] == [ 't' ] and len(args) > 1:
+      kv.jump_to_time(" ".join(args[1:]))
+    else:
+      kv.display_status_msg('Sorry, the only commands are :compare, :compare clip and :t TIME')
   elif prompt == '!':
     kv.pipe_and_display(command)
+  elif prompt == '+':
+    kv.unfold_matching(command)
   else:
     kv.display_status_msg('Sorry, %s mode is not yet implemented' % (prompt))
 
@@ -792,6 +1404,90 @@ CURSES_HOOKS = {
     "fn" : do_math,
     "help" : "get the math on all numbers in the buffer"
   },
+  "t" : {
+    "fn" : do_table,
+    "help" : "get the math on each column in the buffer and sort by them"
+  },
+  "u" : {
+    "fn" : do_templates,
+    "help" : "count the lines of each log message, with numbers, ids and times masked out"
+  },
+  "T" : {
+    "fn" : do_time_histogram,
+    "help" : "show how many lines the log has per minute (:t TIME jumps to a time)"
+  },
+  "!" : {
+    "fn" : do_pipe_prompt,
+    "help" : "pipe the buffer through a command and open its output"
+  },
+  ":" : {
+    "fn" : do_command_prompt,
+    "help" : "run a command (:compare, :compare clip, :t TIME)"
+  },
+  "x" : {
+    "fn" : do_kill_pipe,
+    "help" : "stop the command piping into this buffer"
+  },
+  ")" : {
+    "fn" : do_next_commit,
+    "help" : "jump to the next commit of a git log"
+  },
+  "(" : {
+    "fn" : do_prev_commit,
+    "help" : "jump to the previous commit of a git log"
+  },
+  "c" : {
+    "fn" : do_open_commit,
+    "help" : "open the commit under the cursor (git show)"
+  },
+  "}" : {
+    "fn" : do_next_file,
+    "help" : "jump to the next file of a diff"
+  },
+  "{" : {
+    "fn" : do_prev_file,
+    "help" : "jump to the previous file of a diff"
+  },
+  "]" : {
+    "fn" : do_next_hunk,
+    "help" : "jump to the next hunk of a diff"
+  },
+  "[" : {
+    "fn" : do_prev_hunk,
+    "help" : "jump to the previous hunk of a diff"
+  },
+  "f" : {
+    "fn" : do_file_list,
+    "help" : "list the files changed in the current commit"
+  },
+  "M" : {
+    "fn" : do_memory_usage,
+    "help" : "show how much memory each buffer is using"
+  },
+  "z" : {
+    "fn" : do_toggle_fold,
+    "help" : "fold or unfold the diff hunk (or file header) under the cursor"
+  },
+  "Z" : {
+    "fn" : do_fold_all,
+    "help" : "fold every file of a diff"
+  },
+  "e" : {
+    "fn" : do_unfold_prompt,
+    "help" : "unfold the diff files matching a pattern"
+  },
+  "w" : {
+    "fn" : do_toggle_wrap,
+    "help" : "toggle wrapping of long lines"
+  },
+  "left" : {
+    "fn" : do_scroll_left,
+    "help" : "scroll long lines left (turns off wrapping)"
+  },
+  "right" : {
+    "fn" : do_scroll_right,
+    "help" : "scroll long lines right (turns off wrapping)"
+  },
   "n" : {
     "fn" : do_next_search,
     "help" : ""
@@ -804,6 +1500,10 @@ CURSES_HOOKS = {
     "fn" : do_yank_text,
     "help" : "save the current buffer to the X clipboard with xsel"
   },
+  "D" : {
+    "fn" : do_compare_stack,
+    "help" : "diff the current buffer against the previous one (:compare clip for the clipboard)"
+  },
   "?" : {
     "fn" : do_open_help,
     "help" : "show this screen"
@@ -920,38 +1620,332 @@ for color in COLORS:
 
 # }}}
 
+# {{{ frame scheduler
+# every part of kk that wants the screen redrawn invalidates a region (pager,
+# body or overlay) here. invalidations are coalesced into one frame, background
+# producers are held to MAX_FPS and keyboard driven frames go out immediately.
+class FrameScheduler(object):
+  def __init__(self, render, max_fps=MAX_FPS):
+    self.render = render
+    self.min_interval = 1.0 / max_fps
+    self.lock = threading.Lock()
+    self.dirty = set()
+    self.interactive = False
+    self.woken = False
+    self.alarm = None
+    self.last_frame = 0
+    self.loop = None
+    self.pipe = None
+
+  def attach(self, loop):
+    self.loop = loop
+    self.pipe = loop.watch_pipe(self.on_wake)
+    loop.event_loop.enter_idle(self.on_idle)
+
+  # safe to call from any thread
+  def invalidate(self, region='body', interactive=False):
+    with self.lock:
+      self.dirty.add(region)
+      if interactive:
+        # the UI thread is already awake and will flush on idle
+        self.interactive = True
+        return
+
+      if self.woken or not self.pipe:
+        return
+      self.woken = True
+
+    os.write(self.pipe, "!")
+
+  def on_wake(self, data):
+    with self.lock:
+      self.woken = False
+
+    wait = self.last_frame + self.min_interval - time.time()
+    if wait > 0:
+      if not self.alarm:
+        self.alarm = self.loop.set_alarm_in(wait, self.on_alarm)
+    else:
+      self.flush()
+
+    return True
+
+  def on_alarm(self, loop, data):
+    self.alarm = None
+    self.flush()
+
+  def on_idle(self):
+    if self.interactive:
+      self.flush()
+
+  def flush(self):
+    with self.lock:
+      dirty = self.dirty
+      self.dirty = set()
+      self.interactive = False
+
+    if not dirty:
+      return
+
+    self.last_frame = time.time()
+    self.render(dirty)
+    self.loop.draw_screen()
+# }}}
+
 # {{{ main viewer class
 
 
 _lexer_fname_cache = {}
+
+# the lexer for a file: by its name if pygments knows it, a guess otherwise
+def pick_lexer(fname, output):
+  try:
+    if not fname in _lexer_fname_cache:
+      # keep blank lines at the edges, so the colored view lines up with the buffer
+      _lexer_fname_cache[fname] = pygments.lexers.get_lexer_for_filename(fname, stripnl=False)
+
+    return _lexer_fname_cache[fname]
+  except:
+    pass
+
+  try:
+    return guess_lexer(output, stripnl=False)
+  except Exception, e:
+    syntax_log.warn("EXCEPTION", e)
+    return pygments.lexers.TextLexer()
+
 ESCAPE_CODE = re.compile("[KABCDEF]")
 _key_hooks = CURSES_HOOKS
+
+# reads the rest of a buffer on the workers, one batch of lines per job. the
+# UI thread applies each chunk to the buffer (and to whatever walker is showing
+# it). it can be paused while its buffer sits on the stack and picked up again
+# later. sources that block (pipes) get a thread of their own instead of tying
+# up a worker
+class Ingest(object):
+  def __init__(self, kv, ret, batches, walker, start_line=0, syntax_colored=False, dedicated=False):
+    self.kv = kv
+    self.ret = ret
+    self.batches = batches
+    self.walker = walker
+    self.start_line = start_line
+    self.syntax_colored = syntax_colored
+    self.dedicated = dedicated
+    # the buffer's own token is cancelled whenever it goes on the stack, this
+    # one only once the buffer is thrown away
+    self.token = kv.work.token()
+    self.lock = threading.Lock()
+    self.unpaused = threading.Event()
+    self.unpaused.set()
+    self.paused = False
+    self.running = False
+
+  def start(self):
+    with self.lock:
+      if self.running or self.paused:
+        return
+      self.running = True
+
+    if self.dedicated:
+      thread = threading.Thread(target=self.run_thread)
+      thread.daemon = True
+      thread.start()
+    else:
+      self.kv.work.submit(self.step, PRIORITY_INGEST, self.token)
+
+  def pause(self):
+    with self.lock:
+      self.paused = True
+      self.unpaused.clear()
+
+  # for a buffer that is thrown away: reading stops for good, and a paused
+  # reader thread wakes up to exit
+  def stop(self):
+    self.token.cancel()
+    self.unpaused.set()
+
+  def resume(self, walker=None):
+    if walker is not None:
+      self.walker = walker
+    with self.lock:
+      self.paused = False
+      self.unpaused.set()
+    self.start()
+
+  def run_thread(self):
+    while not self.token.cancelled and self.read_batch():
+      self.unpaused.wait()
+
+  def step(self):
+    with self.lock:
+      if self.paused or self.token.cancelled:
+        self.running = False
+        return
+
+    if not self.read_batch():
+      return
+
+    with self.lock:
+      if self.paused:
+        self.running = False
+        return
+
+    self.kv.work.submit(self.step, PRIORITY_INGEST, self.token)
+
+  # returns False once the source is used up
+  def read_batch(self):
+    ret = self.ret
+    lines = next(self.batches, None)
+    if lines is None:
+      self.kv.work.post(lambda: self.kv.finish_reading(ret), self.token)
+      return False
+
+    chunk = self.kv.parse_chunk(lines, self.start_line, self.syntax_colored, ret['diffs'])
+    self.start_line += len(lines)
+
+    def apply_chunk():
+      self.kv.apply_chunk(ret, chunk, self.walker)
+      self.kv.update_pager()
+
+    self.kv.work.post(apply_chunk, self.token)
+    return True
+
+def run_command(command):
+  proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  return [ proc.communicate()[0] ]
+
+# output of a command (or other text pieces) as the lines of a buffer
+def resplit(lines):
+  resplit_lines = ["%s\n" % line for line in "".join(lines).split("\n")]
+  resplit_lines[-1] = resplit_lines[-1].rstrip()
+  return resplit_lines
+
+# a line that can start a diff (or a commit in git log -p)
+DIFF_HEADER_RE = re.compile(r'^(?:diff |--- |\+\+\+ |@@ |commit [0-9a-f]{7})')
+
+# re-runs a command every so often and hands the UI thread a line diff
+# against the last output. only the lines that changed are parsed, on the
+# watch thread, and the UI thread only swaps in those. what is still done for
+# the whole output on every change: hashing its lines (to find the changes),
+# rebuilding the diff index when the output is a diff (a hunk can't be parsed
+# without the lines above it) and, with syntax coloring on, lexing it again.
+# a change too big for diff_lines (past linediff.FALLBACK_SIZE) replaces all
+# of the lines between the unchanged head and tail
+class Watch(object):
+  def __init__(self, kv, ret, command, interval, highlight=False):
+    self.kv = kv
+    self.ret = ret
+    self.command = command
+    self.interval = interval
+    self.highlight = highlight
+    self.hashes = None
+    # the width of each line, for the buffer's maxx
+    self.widths = None
+    self.is_diff = False
+    self.updated = time.time()
+    self.runs = 0
+    self.changed = (0, 0, 0)
+    # rows highlighted as changed by the last update
+    self.marked = []
+
+  def start(self):
+    thread = threading.Thread(target=self.run, name="kk-watch")
+    thread.daemon = True
+    thread.start()
+
+  def run(self):
+    while not self.kv.quit:
+      time.sleep(self.interval)
+      # only the buffer on screen is kept up to date
+      if self.kv.ret is not self.ret or not self.ret.get('finished'):
+        continue
+
+      try:
+        self.refresh()
+      except Exception:
+        general_log.error("WATCH EXCEPTION", traceback.format_exc(100))
+
+  def refresh(self):
+    lines = [ line.replace("\t", TAB_SPACES) for line in resplit(run_command(self.command)) ]
+    if self.hashes is None:
+      self.hashes = line_hashes(self.ret['lines'])
+      self.widths = [ len(clear_escape_codes(line)) for line in self.ret['lines'] ]
+      self.is_diff = bool(self.ret.get('is_diff'))
+
+    hashes = line_hashes(lines)
+    changes = diff_lines(self.hashes, hashes)
+    self.hashes = hashes
+    self.runs += 1
+    if not changes:
+      self.updated = time.time()
+      self.kv.update_pager()
+      return
+
+    headers = False
+    for tag, i1, i2, j1, j2 in reversed(changes):
+      elines = [ clear_escape_codes(line) for line in lines[j1:j2] ]
+      self.widths[i1:i2] = [ len(eline) for eline in elines ]
+      headers = headers or any(DIFF_HEADER_RE.match(eline) for eline in elines)
+
+    chunk = {
+      "lines" : lines,
+      "maxx" : max(self.widths) if self.widths else 0,
+      # resplit leaves a newline on every line but the last
+      "numlines" : max(len(lines) - 1, 0),
+    }
+
+    # output without any diff headers can't turn into a diff, it keeps its
+    # (empty) index
+    if self.is_diff or headers:
+      diffs = DiffIndex()
+      diffs.feed([ clear_escape_codes(line) for line in lines ], 0)
+      diffs.finish()
+      chunk['diffs'] = diffs
+      self.is_diff = bool(diffs)
+
+    self.kv.work.post(lambda: self.kv.apply_watch(self.ret, chunk, changes))
+
 class Viewer(object):
 
   def __init__(self, *args, **kwargs):
+    # before any worker thread exists
+    self.lex_pool = LexPool(LEX_PROCS, PARALLEL_LEX_LINES)
+    self.lex_pool.start()
     self.after_urwid = []
     self.in_command_prompt = False
     self.prompt_mode = ""
     self.last_search = ""
-    self.stack = []
+    self.stack = BufferStack(STACK_BUDGET * 1024 * 1024, STACK_VIEWS)
     self.last_search_index = 0
     self.last_search_token = None
     self.clear_edit_text = False
     self.syntax_colored = False
-    self.fname = None
     self.last_repaint = time.time()
     self.ret = None
     self.quit = False
     self.color_table = None
-    self.screen_lock = threading.Lock()
-    self.last_redraw = time.time()
-    self.will_redraw = False
+    self.frames = FrameScheduler(self.render_frame)
+    self.work = WorkScheduler(WORKERS, wake=self.invalidate, log=general_log.error)
+    self.wrap = True
+    self.hscroll = 0
+    self.commits = CommitCache(self.work, prepare=self.prehighlight)
+    self.prefetched = None
+    self.memory_checked = 0
+    self.memory_shed_at = 0
+    if TRACEMALLOC:
+      if memstats.can_trace():
+        memstats.start_tracing()
+      else:
+        general_log.warn("KK_TRACEMALLOC IS SET BUT THERE IS NO TRACEMALLOC (PY2 NEEDS PYTRACEMALLOC)")
+    if MEMSTATS:
+      self.after_urwid.append(self.print_memory_report)
+    self.hl_cache = None
+    if HL_CACHE_DIR:
+      self.hl_cache = HighlightCache(HL_CACHE_DIR, HL_CACHE_SIZE * 1024 * 1024)
+    self.previous_widget = None
 
     self.build_color_table()
 
-    self.chunk_size = 157
-    self.max_chunk_size = 2273
-
 
   def reset_line_stats(self):
     self.ret = {}
@@ -960,11 +1954,31 @@ class Viewer(object):
     self.ret['maxy'] = 0
     self.ret['numlines'] = 0
     self.ret['has_content'] = False
-    self.ret['joined'] = ""
     self.ret['lines'] = []
-    self.ret['tokens'] = []
-
-  def update_pager(self, line_count=None):
+    self.ret['version'] = 0
+    self.ret['line_offset'] = 0
+    self.ret['numstats'] = BufferStats()
+    self.ret['diffs'] = DiffIndex()
+    self.ret['folds'] = FoldMap()
+    self.ret['token'] = self.work.token()
+
+  def update_pager(self):
+    self.invalidate('pager')
+
+  def invalidate(self, region='body', interactive=False):
+    self.frames.invalidate(region, interactive)
+
+  # called by the frame scheduler, on the UI thread
+  def render_frame(self, dirty):
+    self.work.apply_pending()
+    self.check_memory()
+    self.prefetch_commits()
+    if 'pager' in dirty:
+      # the pager reads the scroll position the body computes while rendering
+      self.loop.draw_screen()
+      self.refresh_pager()
+
+  def refresh_pager(self):
     try:
       # This can throw if we aren't in text editing mode
       middle_line = self.window.original_widget.get_middle_index()
@@ -973,11 +1987,10 @@ class Viewer(object):
     except Exception, e:
       return
 
-    if not line_count:
-      if self.syntax_colored:
-        line_count = self.ret['syntax_lines']
-      if not self.syntax_colored:
-        line_count = self.ret['maxy']
+    if self.syntax_colored:
+      line_count = self.ret['syntax_lines']
+    if not self.syntax_colored:
+      line_count = self.ret['maxy'] - self.ret['folds'].hidden
 
     if not line_count:
       fraction = 0
@@ -997,22 +2010,44 @@ class Viewer(object):
 
     line_no = min(end_line, line_count)
 
-    pager_msg = "%s/%s (%s%%)" % (line_no, line_count, fraction)
+    # buffers opened from a checkpoint don't start at the first line
+    offset = self.ret['line_offset']
+    pager_msg = "%s/%s (%s%%)" % (line_no + offset, line_count + offset, fraction)
+    if offset:
+      pager_msg = "%s from %s" % (pager_msg, offset)
+
+    if self.ret.get('highlighting') and self.ret['maxy']:
+      highlighted = min(float(self.ret['highlighted']) / self.ret['maxy'] * 100, 100)
+      pager_msg = "%s hl %s%%" % (pager_msg, int(highlighted))
+
+    pipe = self.ret.get('pipe')
+    if pipe and pipe['writing']:
+      source_lines = max(len(pipe['source']['lines']), 1)
+      pager_msg = "%s !%s%%" % (pager_msg, min(pipe['written'] * 100 / source_lines, 100))
+    elif pipe:
+      pager_msg = "%s !.." % pager_msg
+
+    if self.hscroll and not self.wrap:
+      pager_msg = "%s >%s" % (pager_msg, self.hscroll)
+
+    watch = self.ret.get('watch')
+    if watch:
+      changes, added, removed = watch.changed
+      pager_msg = "%s ~%gs %s +%s -%s" % (pager_msg, watch.interval,
+        time.strftime("%H:%M:%S", time.localtime(watch.updated)), added, removed)
 
     if len(self.stack):
       pager_msg = "%s %s" % (pager_msg, len(self.stack) * '=')
 
     self.display_pager_msg(pager_msg)
 
-    self.redraw_parent()
-
   def run(self, stdscr):
     # We're done with stdin,
     # now we want to read input from current terminal
     def handle_input(keys, raw):
       global _key_hooks
       unhandled = []
-      debug("HANDLING INPUT", repr(keys))
+      render_log.trace("HANDLING INPUT", repr(keys))
 
       was_general = False
       # always switch back
@@ -1029,7 +2064,7 @@ class Viewer(object):
         if not unhandle_input(key):
           unhandled.append(key)
 
-      self.loop.event_loop.alarm(0.05, self.update_pager)
+      self.invalidate('pager', interactive=True)
       if was_general:
         _key_hooks = CURSES_HOOKS
         return []
@@ -1050,7 +2085,7 @@ class Viewer(object):
         return
 
       if key in _key_hooks.keys():
-        debug("KEY ", key, "PRESSED")
+        render_log.debug("KEY ", key, "PRESSED")
         stop_press = _key_hooks[key]['fn'](self, self.ret, widget)
         if stop_press:
           return
@@ -1073,49 +2108,28 @@ class Viewer(object):
     self.close_command_line()
     self.loop = urwid.MainLoop(self.panes, palette, unhandled_input=unhandle_input, input_filter=handle_input)
 
-    def pipe_cb(data):
-      return True
-
-    self.redraw_pipe = self.loop.watch_pipe(pipe_cb)
+    self.frames.attach(self.loop)
 
     self.display_status_msg(('banner', "Welcome to the kitchen sink pager. Press '?' for shortcuts"))
 
     self.display_lines([])
-    self.read_and_display()
+    if WATCH:
+      self.watch_command(WATCH.command, WATCH.interval, WATCH.differences)
+    else:
+      self.read_and_display()
     # Don't re-open the TTY until after reading stdin
     with open("/dev/tty") as f:
       os.dup2(f.fileno(), 0)
 
-    if self.ret['has_content']:
-      try:
+    try:
+      if self.ret['has_content']:
         self.loop.run()
-      except Exception, e:
-        debug("EXCEPTION (QUITTING)", traceback.format_exc(100))
-
-        self.quit = True
-      finally:
-        self.quit = True
-
-  def redraw_parent(self, force=False):
-    now = time.time()
-
-    # Need to enforce that the redraw happens (eventually)
-    if not self.will_redraw:
-      self.will_redraw = True
-      def future_call(loop, args):
-        self.redraw_parent()
-        self.will_redraw = False
-
-      self.loop.set_alarm_in(0.1, future_call)
-
-    if now - self.last_redraw > 0.2:
-      os.write(self.redraw_pipe, "REDRAW THYSELF\n")
-      self.last_redraw = now
-
-  # for reals. this is a stub, but used to get an entry point back into the
-  # main loop and redraw the screen
-  def repaint_screen(self, force=False):
-    pass
+    except Exception, e:
+      general_log.error("EXCEPTION (QUITTING)", traceback.format_exc(100))
+    finally:
+      self.quit = True
+      self.work.shutdown()
+      self.lex_pool.shutdown()
 
 
   def open_command_line(self, mode=':'):
@@ -1131,7 +2145,7 @@ class Viewer(object):
     prompt_cols = urwid.Columns([
       ("fixed", 1, urwid.Text(self.prompt_mode)),
       ("weight", 1, self.prompt),
-      ("fixed", 25, urwid.Padding(self.pager, align='right', min_width=10)),
+      ("fixed", 32, urwid.Padding(self.pager, align='right', min_width=10)),
     ])
     self.command_line.original_widget = prompt_cols
     self.in_command_prompt = False
@@ -1214,15 +2228,70 @@ class Viewer(object):
     self.syntax_colored = False
     self.previous_widget = None
     widget = self.window
-    self.walker = urwid.SimpleListWalker([])
+    folds = self.ret['folds'] if self.ret else None
+    self.walker = LineWalker(self.line_widget, folds=folds)
     text = TextBox(self.walker)
     widget.original_widget = text
 
+  def line_widget(self, line):
+    start = 0 if self.wrap else self.hscroll
+    hidden = 0
+    if len(line) > LONG_LINE:
+      # a huge line (minified js, base64) is only decoded where it is looked
+      # at. what's past the visible slice is hidden, not what's scrolled off
+      # to the left
+      line, hidden = slice_long_line(line, start, LONG_LINE)
+      start = 0
+
+    widget = self.escape_ansi_colors([decode_line(line)])[0]
+    if not start and not hidden and self.wrap:
+      return widget
+
+    markup = clip_markup(widget, start)
+    if hidden:
+      markup = [ markup, ('highlight', " ... %s more bytes" % hidden) ]
+
+    return urwid.Text(markup, wrap=self.wrap_mode())
+
+  def wrap_mode(self):
+    return 'space' if self.wrap else 'clip'
+
+  def toggle_wrap(self):
+    self.wrap = not self.wrap
+    self.hscroll = 0
+    self.refresh_lines(True)
+    if self.wrap:
+      self.display_status_msg("Wrapping long lines")
+    else:
+      self.display_status_msg("Not wrapping lines, use left and right to scroll")
+
+  def scroll_horizontally(self, direction):
+    if self.wrap:
+      self.toggle_wrap()
+
+    cols, rows = self.loop.screen.get_cols_rows()
+    hscroll = max(self.hscroll + direction * max(cols / 2, 1), 0)
+    if hscroll == self.hscroll:
+      return
+
+    self.hscroll = hscroll
+    self.refresh_lines()
+    self.update_pager()
+
+  def refresh_lines(self, wrap_changed=False):
+    for listbox in [ self.window.original_widget, self.previous_widget ]:
+      body = getattr(listbox, 'body', None)
+      if isinstance(body, LineWalker):
+        body.refresh()
+      elif body is not None and wrap_changed:
+        # highlighted views are built up front, they only get to (un)wrap
+        for widget in body:
+          if isinstance(widget, urwid.Text):
+            widget.set_wrap_mode(self.wrap_mode())
+
   def display_lines(self, lines=[]):
     self.new_display()
-    lines = "".join(lines).split("\n")
-    wlist = self.escape_ansi_colors(lines)
-    self.walker.extend(wlist)
+    self.walker.extend(lines)
 
   def get_focus_index(self, widget):
     try:
@@ -1242,131 +2311,461 @@ class Viewer(object):
     listbox.set_focus_valign('middle')
     self.update_pager()
 
-  def read_line(self, line, ret=None):
-    if not ret:
-      ret = self.ret
+  # turns a chunk of input into everything the buffer needs from it. this runs
+  # on the workers, so it only builds new objects and never touches the buffer
+  # the diff index is fed here too, chunks of a buffer are parsed in order
+  def parse_chunk(self, lines, start_line=0, syntax_colored=False, diffs=None):
+    chunk = {
+      "lines" : [],
+      "maxx" : 0,
+      "numlines" : 0,
+      "is_diff" : False,
+      "syntax_colored" : syntax_colored
+    }
 
-    eline = clear_escape_codes(line)
+    elines = []
+    for index, line in enumerate(lines):
+      line = line.replace("\t", TAB_SPACES)
+      eline = clear_escape_codes(line)
+      chunk['maxx'] = max(chunk['maxx'], len(eline))
+      chunk['numlines'] += line.count("\n")
+      chunk['lines'].append(line)
+      elines.append(eline)
+
+    # numbers are crunched a chunk at a time during reading, so math mode
+    # doesn't need to look at the buffer again
+    chunk['numstats'] = crunch(chunk['lines'])
+
+    if diffs is not None:
+      diffs.feed(elines, start_line)
+      chunk['is_diff'] = bool(diffs)
+    return chunk
+
+  # runs on the UI thread
+  def apply_chunk(self, ret, chunk, walker):
+    if not chunk['lines']:
+      return
 
-    if not 'is_diff' in ret:
-      if line.find('diff --git') >= 0:
-        ret['is_diff'] = True
+    if chunk['is_diff']:
+      ret['is_diff'] = True
 
-    tokens = ret['tokens']
-    for index, token in enumerate(eline.split()):
-      tokens.append({
-        "line": ret['maxy'] + index,
-        "text" : token })
+    # a chunk that doesn't follow on from the stats is left for 'm' to scan
+    stats = ret.get('numstats')
+    if stats is not None and stats.scanned == len(ret['lines']):
+      stats.add(chunk['numstats'], len(chunk['lines']))
 
-    ret['maxx'] = max(ret['maxx'], len(eline))
-    ret['maxy'] += 1
-    ret['numlines'] += line.count("\n")
+    ret['lines'].extend(chunk['lines'])
+    ret['maxx'] = max(ret['maxx'], chunk['maxx'])
+    ret['maxy'] += len(chunk['lines'])
+    ret['numlines'] += chunk['numlines']
     ret['has_content'] = True
-    ret['lines'].append(line)
+    ret['version'] += 1
+    if isinstance(walker, LineWalker):
+      walker.extend(chunk['lines'])
+    else:
+      lines = [ decode_line(line) for line in chunk['lines'] ]
+      walker.extend(self.escape_ansi_colors(lines, chunk['syntax_colored']))
+
+  def finish_reading(self, ret):
+    ret['diffs'].finish()
+    ret['finished'] = True
+    if 'ingest' in ret:
+      del ret['ingest']
+    self.update_pager()
 
-  def read_while_displaying_lines(self, lines=None, walker=None, ret=None, syntax_colored=None):
+    if PREHIGHLIGHT and ret is self.ret and not self.previous_widget:
+      self.enable_syntax_coloring(preload=True)
+    if ret.get('sidecar'):
+      self.load_sidecar(ret)
+      self.save_offsets(ret)
+    ingest_log.debug("FINISHED READING AND DISPLAYING LINES")
+
+  # lines are in memory already, a stream is read as the buffer fills (from
+  # line_offset on, with the target line on screen right away). without
+  # either the input files are read
+  def read_while_displaying_lines(self, lines=None, walker=None, ret=None, syntax_colored=None,
+      stream=None, line_offset=0, target=0):
     if not walker:
       walker = self.walker
 
     if not ret:
       ret = self.ret
 
-    if not lines:
-      gen = fileinput.input()
+    # only stdin has to be drained, before the tty is re-opened in its place.
+    # in memory lines are already there
+    drain = lines is not None
+    ret['line_offset'] = line_offset
+    if stream is not None:
+      gen = stream
+    elif lines is None:
+      # a plain binary file is never read, only mapped
+      mapped = map_file(INPUT_PATHS[0]) if len(INPUT_PATHS) == 1 else None
+      if mapped is not None:
+        if is_binary(mapped[:SNIFF_SIZE]):
+          self.display_binary(ret, mapped)
+          return
+        mapped.close()
+
+      gen = read_input(INPUT_PATHS)
+      drain = not INPUT_PATHS or '-' in INPUT_PATHS
+      if len(INPUT_PATHS) == 1 and SIDECAR_DIR:
+        ret['sidecar'] = sidecar.open_sidecar(INPUT_PATHS[0], SIDECAR_DIR, SIDECAR_LIMIT * 1024 * 1024)
+        self.load_offsets(INPUT_PATHS[0], ret['sidecar'])
+      if len(INPUT_PATHS) == 1 and START_LINE:
+        near = open_lines_near(INPUT_PATHS[0], START_LINE)
+        if near:
+          ret['line_offset'], gen = near[0], reported_lines(INPUT_PATHS[0], near[1])
+      if START_LINE:
+        target = max(START_LINE - ret['line_offset'], 0)
     else:
       gen = iter(lines)
 
     if syntax_colored is None:
       syntax_colored = self.syntax_colored
 
-    index = 0
-    scheduled_work = False
-    append_lines = []
-    for line in gen:
-      index += 1
-      line = line.replace("\t", TAB_SPACES)
-      self.read_line(line, ret)
-      append_lines.append(line)
-
-      if self.quit:
-        sys.exit(0)
-
-      if not index % self.chunk_size:
-        wlines = self.escape_ansi_colors(append_lines, syntax_colored)
-
-        if self.chunk_size < self.max_chunk_size:
-          self.chunk_size *= 1.5
-
-        for wline in wlines:
-          if self.quit:
-            sys.exit(0)
-          walker.append(wline)
-
-        def future_call(lines):
-          self.read_while_displaying_lines(lines, walker, ret, syntax_colored)
-          self.update_pager()
-
-        next_lines = list(gen)
-        if len(next_lines):
-          thread = threading.Thread(target=future_call, args=[next_lines])
-          time.sleep(0.01)
-          if not self.quit:
-            thread.start()
-          scheduled_work = True
-        break
+    # the first chunk goes up right away, so there is something on screen
+    # (down to the line it is opened at)
+    first_lines = list(itertools.islice(gen, target + CHUNK_SIZE))
+    if lines is None and is_binary(sniff_head(first_lines)):
+      self.display_binary(ret, "".join(first_lines) + "".join(gen))
+      return
+    self.apply_chunk(ret, self.parse_chunk(first_lines, 0, syntax_colored, ret['diffs']), walker)
+    if target and first_lines:
+      self.window.original_widget.set_focus(min(target, len(first_lines) - 1))
+
+    # a file streams in behind what is on screen
+    if drain:
+      rest = list(gen)
+      if not rest:
+        self.finish_reading(ret)
+        return
+      gen = iter(rest)
 
-    if not scheduled_work:
-      wlines = self.escape_ansi_colors(append_lines, syntax_colored)
-      self.ret['syntax_lines'] += len(wlines)
-      for wline in wlines:
-        walker.append(wline)
+    ret['ingest'] = Ingest(self, ret, chunk_lines(gen), walker, len(first_lines), syntax_colored)
+    ret['ingest'].start()
 
-      ret['joined'] = "".join(ret['lines'])
-      self.update_pager()
-      debug("FINISHED READING AND DISPLAYING LINES")
+  # binary input skips the text pipeline (no tokens, stats or lexing), the
+  # buffer is its bytes
+  def display_binary(self, ret, data):
+    ret['binary'] = data
+    ret['mapped'] = not isinstance(data, str)
+    ret['maxy'] = len(HexRows(data))
+    ret['has_content'] = True
+    ret['finished'] = True
+    ret['diffs'].finish()
+    self.show_hexdump(ret)
+    self.display_status_msg("Binary input (%s bytes), showing a hexdump" % len(data))
 
+  def show_hexdump(self, ret):
+    self.new_display()
+    self.walker = HexWalker(ret['binary'])
+    self.window.original_widget = TextBox(self.walker)
+    self.syntax_lang = "hexdump"
+
+  # for output that shows up over time, nothing is read up front
+  def stream_while_displaying_lines(self, batches):
+    ret = self.ret
+    ret['ingest'] = Ingest(self, ret, batches, self.walker, dedicated=True)
+    ret['ingest'].start()
+
+  def current_view(self):
+    return {
+      "widget" : self.window.original_widget,
+      "walker" : self.walker,
+      "previous_widget" : self.previous_widget,
+      "syntax_colored" : self.syntax_colored,
+      "syntax_lang" : getattr(self, 'syntax_lang', None)
+    }
 
-  def read_and_display(self, lines=None):
-    debug("READ AND DISPLAY LINES")
-    del self.walker[:]
+  def read_and_display(self, lines=None, batches=None, stream=None, line_offset=0, target=0):
+    ingest_log.debug("READ AND DISPLAY LINES")
 
     if self.ret:
-      self.stack.append(self.ret)
+      self.ret['focused_index'] = self.get_focus_index(self.window.original_widget)
+      self.suspend_buffer(self.ret)
+      self.stack.push(self.ret, self.current_view())
 
     self.reset_line_stats()
     self.new_display()
 
-    self.ret['focused_index'] = self.get_focus_index(self.window.original_widget)
+    if batches is not None:
+      ingest_log.debug("STREAM WHILE DISPLAYING")
+      self.stream_while_displaying_lines(batches)
+      return
 
     if lines:
-      resplit_lines = ["%s\n" % line for line in "".join(lines).split("\n")]
-      resplit_lines[-1] = resplit_lines[-1].rstrip()
-      lines = resplit_lines
-    debug("READ WHILE DISPLAYING")
-    self.read_while_displaying_lines(lines)
+      lines = resplit(lines)
+    ingest_log.debug("READ WHILE DISPLAYING")
+    self.read_while_displaying_lines(lines, stream=stream, line_offset=line_offset, target=target)
+
+  # {{{ watch
+  def watch_command(self, command, interval, highlight=False):
+    self.read_and_display(run_command(command))
+    # an empty output still gets watched
+    self.ret['has_content'] = True
+    self.ret['watch'] = Watch(self, self.ret, command, interval, highlight)
+    self.ret['watch'].start()
+
+  # runs on the UI thread, with the changed lines already parsed. the lines
+  # and rows that changed are swapped in, a rebuilt diff index replaces the
+  # old one and the indexes built from the old lines are dropped
+  def apply_watch(self, ret, chunk, changes):
+    watch = ret['watch']
+    if ret is not self.ret:
+      # the buffer went on the stack, the next run diffs against what it has
+      watch.hashes = None
+      return
+
+    lines = chunk['lines']
+    # a highlighted view would be stale, the plain one is brought up to date
+    # and highlighted again
+    colored = self.syntax_colored
+    if 'syntax_token' in ret:
+      ret['syntax_token'].cancel()
+    if colored:
+      self.window.original_widget = self.previous_widget
+      self.syntax_colored = False
+    self.previous_widget = None
+    ret['highlighting'] = False
+
+    walker = self.walker
+    for row in watch.marked:
+      walker.overrides.pop(row, None)
+    watch.marked = []
+    self.last_search_token = None
+
+    for tag, i1, i2, j1, j2 in reversed(changes):
+      ret['lines'][i1:i2] = lines[j1:j2]
+    if any(i2 - i1 != j2 - j1 for tag, i1, i2, j1, j2 in changes):
+      ret['folds'].clear()
+    walker.apply_diff(changes, lines)
+
+    if watch.highlight:
+      for tag, i1, i2, j1, j2 in changes:
+        for row in xrange(j1, j2):
+          walker.overrides[row] = urwid.AttrMap(self.line_widget(lines[row]), 'highlight')
+          watch.marked.append(row)
+
+    if 'diffs' in chunk:
+      ret['diffs'] = chunk['diffs']
+      ret['is_diff'] = bool(chunk['diffs'])
+    ret['maxx'] = chunk['maxx']
+    ret['maxy'] = len(lines)
+    ret['numlines'] = chunk['numlines']
+    ret['version'] += 1
+    ret.pop('table', None)
+    ret.pop('templates', None)
+    ret.pop('times', None)
+    # the numbers are crunched again on 'm'
+    ret['numstats'] = BufferStats()
+    if not ret.get('is_diff'):
+      ret.pop('is_diff', None)
+
+    added = sum(j2 - j1 for tag, i1, i2, j1, j2 in changes if tag != 'delete')
+    removed = sum(i2 - i1 for tag, i1, i2, j1, j2 in changes if tag != 'insert')
+    watch.changed = (len(changes), added, removed)
+    watch.updated = time.time()
+
+    if colored:
+      self.enable_syntax_coloring()
+    self.update_pager()
+  # }}}
+
+  # {{{ compare
+  def compare_with_stack(self):
+    if not self.stack:
+      self.display_status_msg("There is no previous buffer to compare with")
+      return
+    self.compare_buffers(self.stack.peek_lines(), "previous buffer")
+
+  def compare_with_clipboard(self):
+    text = read_clipboard()
+    if text is None:
+      self.display_status_msg(('diff_del', "xsel is required to read the clipboard"))
+      return
+    self.compare_buffers(lambda: text.splitlines(True), "clipboard")
+
+  # the other buffer against this one, as a unified diff in a new buffer.
+  # hashing and diffing run on the workers, so millions of lines don't hold
+  # up the UI
+  def compare_buffers(self, other_lines, other_name):
+    ret = self.ret
+    if ret.get('binary'):
+      self.display_status_msg("Can't compare binary input")
+      return
+
+    lines = list(ret['lines'])
+    self.display_status_msg("Comparing with the %s..." % other_name)
+    token = self.work.token(ret['token'])
+    def compare():
+      old = [ clear_escape_codes(line) for line in other_lines() ]
+      new = [ clear_escape_codes(line) for line in lines ]
+      token.check()
+
+      changes = patience_diff(line_hashes(old), line_hashes(new), token.check)
+      if not changes:
+        self.work.post(lambda: self.display_status_msg("The buffers are identical"), token)
+        return
+
+      output = unified_diff(old, new, changes, other_name, "current buffer")
+      self.work.post(lambda: self.read_and_display(output), token)
+
+    self.work.submit(compare, PRIORITY_INPUT, token)
+  # }}}
+
+  # a buffer that goes on the stack stops competing for the workers: its
+  # derived work (highlighting, menus, columns) is cancelled and its reading
+  # is paused until it comes back
+  def suspend_buffer(self, ret):
+    ret['token'].cancel()
+    if 'ingest' in ret:
+      ret['ingest'].pause()
+
+  def resume_buffer(self, ret):
+    ret['token'] = self.work.token()
+    ret['table_parsing'] = False
+    ret['template_scanning'] = False
+    ret['time_indexing'] = False
+    ret['number_scanning'] = False
+    # its commit prefetches went with the old token
+    self.prefetched = None
+    if 'ingest' in ret:
+      ret['ingest'].resume(self.walker)
 
   def restore_last_display(self):
     if self.stack:
-      self.ret = self.stack.pop()
+      # the current buffer is being thrown away
+      self.suspend_buffer(self.ret)
+      if 'ingest' in self.ret:
+        self.ret['ingest'].stop()
+      if 'pipe' in self.ret:
+        self.kill_pipe(self.ret)
+
+      # anything the old buffer's workers already handed over goes in first
+      self.work.apply_pending()
+      self.ret, view = self.stack.pop()
+
+      if view:
+        # the view remembers its own scroll position
+        render_log.debug("RESTORING RENDERED VIEW")
+        self.window.original_widget = view['widget']
+        self.walker = view['walker']
+        self.previous_widget = view['previous_widget']
+        self.syntax_colored = view['syntax_colored']
+        self.syntax_lang = view['syntax_lang']
+        self.last_search_token = None
+
+        # highlighting was cut short when the buffer was suspended, so the
+        # colored view is incomplete. throw it away
+        if self.ret.get('highlighting'):
+          self.ret['highlighting'] = False
+          if self.syntax_colored:
+            self.window.original_widget = self.previous_widget
+            self.syntax_colored = False
+          self.previous_widget = None
+
+        self.resume_buffer(self.ret)
+        self.update_pager()
+        return
 
-      self.display_lines(self.ret['lines'])
+      if self.ret.get('binary') is not None:
+        self.show_hexdump(self.ret)
+      else:
+        self.display_lines(self.ret['lines'])
+      self.ret['highlighting'] = False
+      self.resume_buffer(self.ret)
       if 'focused_index' in self.ret:
         self.readjust_display(self.window.original_widget, self.ret['focused_index'])
 
+  # the buffer is fed to the command a chunk at a time from a writer thread,
+  # while its output streams into a new buffer
   def pipe_and_display(self, command):
-    import shlex
-    data_in = self.ret['joined']
-    args = shlex.split(command)
-    p = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    p.stdin.write(data_in)
+    source = self.ret
+    if not command.strip():
+      return
+
+    try:
+      p = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    except (OSError, ValueError), e:
+      self.display_status_msg(('diff_del', "Couldn't run %s: %s" % (command, e)))
+      return
+
+    pipe = {
+      "command" : command,
+      "source" : source,
+      "process" : p,
+      "written" : 0,
+      "writing" : True,
+      "killed" : False
+    }
+
+    def output_batches():
+      for batch in stream_batches(p.stdout.fileno()):
+        yield batch
+
+      p.stdout.close()
+      code = p.wait()
+      def finish():
+        if 'pipe' in ret:
+          del ret['pipe']
+        if ret is self.ret:
+          status = "killed" if pipe['killed'] else "exited with %s" % code
+          self.display_status_msg("!%s %s" % (command, status))
+
+      self.work.post(finish)
+
+    def feed_input():
+      try:
+        while not pipe['killed']:
+          lines = source['lines']
+          if pipe['written'] < len(lines):
+            end = pipe['written'] + MAX_CHUNK_SIZE
+            p.stdin.write("".join(lines[pipe['written']:end]))
+            pipe['written'] = min(end, len(lines))
+            self.update_pager()
+          elif source.get('finished'):
+            break
+          else:
+            time.sleep(IDLE_DELAY)
+
+        p.stdin.close()
+      except (IOError, OSError), e:
+        ingest_log.info("PIPE CLOSED", e)
+
+      pipe['writing'] = False
+      self.update_pager()
 
-    stdout = p.communicate()[0]
-    self.read_and_display([stdout])
+    self.read_and_display(batches=output_batches())
+    ret = self.ret
+    ret['pipe'] = pipe
+
+    # the command needs all of the source buffer, even from the stack
+    if 'ingest' in source:
+      source['ingest'].resume()
+
+    thread = threading.Thread(target=feed_input)
+    thread.daemon = True
+    thread.start()
+
+  def kill_pipe(self, ret=None):
+    pipe = (ret or self.ret).get('pipe')
+    if not pipe:
+      self.display_status_msg("No command is running in this buffer")
+      return
+
+    pipe['killed'] = True
+    try:
+      pipe['process'].kill()
+    except OSError:
+      pass
+    self.display_status_msg("Killing !%s" % pipe['command'])
 
   def find_and_focus(self, word=None, reverse=False):
     start_index = 0
     focused_widget, focused_index = self.window.original_widget.get_focus()
     start_index = focused_index
+    if focused_index is None:
+      return
 
     if not word:
       word = self.last_search
@@ -1374,40 +2773,42 @@ class Viewer(object):
     self.last_search = word
 
     tokens = self.window.original_widget.body
+    # plain buffers are searched on their raw lines, so searching doesn't
+    # build a widget for every line
+    if isinstance(tokens, LineWalker):
+      line_text = tokens.text
+    else:
+      line_text = lambda index: tokens[index].get_text()[0]
+
     def find_word(tokens, start_index):
       found = False
 
       if reverse:
-        tokens = tokens[:start_index-1]
+        end = start_index - 1 if start_index else len(tokens)
+        positions = xrange(end - 1, -1, -1)
       else:
-        tokens = tokens[start_index:]
+        positions = xrange(start_index, len(tokens))
 
       if self.last_search_token:
         self.set_line(self.last_search_index, self.last_search_token)
 
-      enum_tokens = enumerate(tokens)
-      if reverse:
-        enum_tokens = list(reversed(list(enumerate(tokens))))
-
-      word_re = re.compile(word)
-      for index, tok in enum_tokens:
-        text, opts = tok.get_text()
+      word_re = re.compile(decode_line(word))
+      for index in positions:
+        text = line_text(index)
         if word_re.search(text):
-          debug("FOUND WORD", word, "IN", text)
+          menu_log.trace("FOUND WORD", word, "IN", text)
           self.window.original_widget.set_focus_valign('middle')
 
-          self.last_search_index = start_index + index
-          if reverse:
-            self.last_search_index = index
-          self.last_search_token = tok
+          self.last_search_index = index
+          self.last_search_token = tokens[index]
 
           found = True
           break
 
       if found:
         found_text = self.last_search_token.get_text()[0]
-        debug("INDEX OF", found_text, "IS", self.last_search_index)
-        self.set_line(self.last_search_index, urwid.Text(('highlight', text)))
+        menu_log.debug("INDEX OF", repr(found_text), "IS", self.last_search_index)
+        self.set_line(self.last_search_index, urwid.Text(('highlight', text), wrap=self.wrap_mode()))
         self.window.original_widget.set_focus(self.last_search_index)
       return found
 
@@ -1419,6 +2820,212 @@ class Viewer(object):
       if not found:
         self.display_status_msg("Pattern not found  (Press RETURN)")
 
+  # {{{ diff navigation
+  def jump_diff(self, kind, reverse=False):
+    diffs = self.ret['diffs']
+    if not len(diffs.starts[kind]):
+      self.display_status_msg("No %ss in this buffer" % kind)
+      return
+
+    focused_index = self.current_line()
+    if reverse:
+      line = diffs.prev_start(kind, focused_index)
+    else:
+      line = diffs.next_start(kind, focused_index)
+
+    if line is None:
+      self.display_status_msg("No %s %s" % ("previous" if reverse else "next", kind))
+      return
+
+    self.focus_line(line)
+
+  # {{{ git log
+  def open_commit(self):
+    commit = self.ret['diffs'].commit_at(self.current_line())
+    if not commit:
+      self.display_status_msg("No commit under the cursor")
+      return
+
+    contents = self.commits.get(commit.sha)
+    if contents is None:
+      self.display_status_msg(('diff_del', "git show %s failed" % commit.sha[:12]))
+      return
+    self.read_and_display([contents])
+
+  # only for logs without patches, a log with them has the commits already
+  def prefetch_commits(self):
+    if not GIT_PREFETCH or not self.ret or self.window.overlay_opened:
+      return
+
+    diffs = self.ret['diffs']
+    if diffs or not diffs.commits:
+      return
+
+    index = diffs.commit_index(self.current_line())
+    if index is None or self.prefetched == (diffs, index):
+      return
+
+    self.prefetched = (diffs, index)
+    near = range(max(index - GIT_PREFETCH, 0), min(index + GIT_PREFETCH + 1, len(diffs.commits)))
+    near.sort(key=lambda i: abs(i - index))
+    self.commits.prefetch([ diffs.commits[i].sha for i in near ], self.ret['token'])
+
+  # lexes each file of a commit into the highlight cache, the way the colored
+  # view would lex it once the commit is opened
+  def prehighlight(self, contents, token):
+    if not self.hl_cache:
+      return
+
+    lines = [ "%s\n" % line for line in contents.split("\n") ]
+    lines[-1] = lines[-1].rstrip()
+    diffs = DiffIndex()
+    diffs.feed(lines, 0)
+    diffs.finish()
+
+    formatter = UrwidFormatter(style=PYGMENTS_STYLE)
+    for entry in diffs.files:
+      if entry.body_start is None:
+        continue
+
+      body = lines[entry.body_start:diffs.file_end(entry)]
+      output = "".join([ decode_line(clear_escape_codes(line)) for line in body ])
+      lexer = pick_lexer(entry.path, output)
+      if lexer.__class__ is pygments.lexers.TextLexer:
+        continue
+
+      token.check()
+      key = self.hl_cache.key(output, lexer.name, PYGMENTS_STYLE)
+      if key and not self.hl_cache.has(key):
+        self.hl_cache.put(key, list(formatter.formatgenerator(lexer.get_tokens(output))), formatter)
+  # }}}
+
+  # the buffer line under the cursor, folds make it different from the row
+  def current_line(self):
+    row = self.window.original_widget.get_focus()[1] or 0
+    return self.ret['folds'].to_line(row)
+
+  def focus_line(self, line):
+    listbox = self.window.original_widget
+    row = self.ret['folds'].to_row(line)
+    listbox.set_focus(max(min(row, len(listbox.body) - 1), 0))
+    listbox.set_focus_valign('top')
+    self.update_pager()
+
+  def toggle_fold(self):
+    diffs = self.ret['diffs']
+    folds = self.ret['folds']
+    if not diffs:
+      self.display_status_msg("No diff in this buffer")
+      return
+
+    line = self.current_line()
+    fold = folds.fold_starting(line)
+    if fold:
+      folds.unfold(fold.start, fold.end)
+      self.refold(line)
+      return
+
+    entry = diffs.file_at(line)
+    end = entry and diffs.file_end(entry)
+    if not entry or end is None:
+      self.display_status_msg("Not on a file of the diff")
+      return
+
+    # inside a hunk only the hunk folds, from the file header the whole file
+    hunk = diffs.hunk_at(line)
+    if hunk and hunk.end is not None and hunk.start >= entry.start:
+      folds.fold(hunk.start, hunk.end, "%s %s" % (entry.path, hunk.header))
+      line = hunk.start
+    else:
+      folds.fold(entry.start, end, entry.describe())
+      line = entry.start
+
+    self.refold(line)
+
+  def fold_all_files(self):
+    diffs = self.ret['diffs']
+    folds = self.ret['folds']
+    if not diffs:
+      self.display_status_msg("No diff in this buffer")
+      return
+
+    line = self.current_line()
+    ranges = []
+    for entry in diffs.files:
+      end = diffs.file_end(entry)
+      if end is not None:
+        ranges.append((entry.start, end, entry.describe()))
+
+    folds.clear()
+    folds.fold_many(ranges)
+    entry = diffs.file_at(line)
+    self.refold(entry.start if entry else line)
+    self.display_status_msg("Folded %s files, 'z' or 'e' to unfold" % len(ranges))
+
+  def unfold_matching(self, pattern):
+    folds = self.ret['folds']
+    try:
+      regex = re.compile(pattern)
+    except re.error:
+      self.display_status_msg("Bad pattern: %s" % pattern)
+      return
+
+    matched = [ fold for fold in folds.folds if regex.search(fold.label) ]
+    for fold in matched:
+      folds.unfold(fold.start, fold.end)
+
+    self.refold(matched[0].start if matched else self.current_line())
+    self.display_status_msg("Unfolded %s sections" % len(matched))
+
+  # rows moved around: plain views rebuild the visible rows, a colored view
+  # is highlighted again (only what isn't folded gets lexed)
+  def refold(self, line):
+    self.last_search_token = None
+    if self.syntax_colored:
+      self.window.original_widget = self.previous_widget
+      self.walker = self.window.original_widget.body
+      self.syntax_colored = False
+      self.walker.refresh(folded=True)
+      self.focus_line(line)
+      self.enable_syntax_coloring()
+      return
+
+    if self.previous_widget:
+      if 'syntax_token' in self.ret:
+        self.ret['syntax_token'].cancel()
+      self.previous_widget = None
+
+    self.walker.refresh(folded=True)
+    self.focus_line(line)
+
+  def open_file_list(self):
+    diffs = self.ret['diffs']
+    if not diffs:
+      self.display_status_msg("No diff in this buffer")
+      return
+
+    focused_index = self.current_line()
+    files = diffs.files_near(focused_index)
+    starts = {}
+
+    def jump_to(label):
+      self.window.close_overlay()
+      self.focus_line(starts[label])
+
+    commit = files[0].commit if files else None
+    title = "%s files changed" % len(files)
+    if commit:
+      title = "%s in %s" % (title, commit.sha[:12])
+
+    overlay = MenuOverlay(self.window, title=title, cb=jump_to, label_width=120, width=("relative", 80))
+    for entry in files:
+      label = "%s (%s hunks)" % (entry.describe(), len(entry.hunks))
+      starts[label] = entry.start
+      index = overlay.add_entry(label)
+      if entry.start <= focused_index:
+        overlay.focus(index)
+  # }}}
+
   def syntax_msg(self):
     if self.syntax_colored:
       self.display_status_msg("Setting syntax to %s" % self.syntax_lang)
@@ -1426,6 +3033,10 @@ class Viewer(object):
       self.display_status_msg("Disabling syntax coloring")
 
   def toggle_syntax_coloring(self):
+    if self.ret.get('binary') is not None:
+      self.display_status_msg("No syntax coloring for binary input")
+      return
+
     if self.last_search_token:
       self.set_line(self.last_search_index, self.last_search_token)
       self.last_search_token = None
@@ -1438,11 +3049,11 @@ class Viewer(object):
       self.window.original_widget = self.previous_widget
       self.previous_widget = original_text
 
-      debug("SYNTAX COLORING PREV WIDGET")
+      syntax_log.debug("SYNTAX COLORING PREV WIDGET")
 
       self.last_search_token = None
       self.syntax_colored = not self.syntax_colored
-      debug("FOCUSED INDEX", focused_index)
+      syntax_log.debug("FOCUSED INDEX", focused_index)
       self.readjust_display(self.window.original_widget, focused_index)
       self.syntax_msg()
 
@@ -1452,19 +3063,50 @@ class Viewer(object):
     self.enable_syntax_coloring()
 
 
-  # one time setup for syntax coloring
-  def enable_syntax_coloring(self):
-    debug("INITIALIZING SYNTAX COLORED WIDGET")
+  # one time setup for syntax coloring. when preloading, the colored widget is
+  # built in the background and left for toggle_syntax_coloring to swap in
+  def enable_syntax_coloring(self, preload=False):
+    syntax_log.debug("INITIALIZING SYNTAX COLORED WIDGET", preload)
+    if 'syntax_token' in self.ret:
+      self.ret['syntax_token'].cancel()
+
     walker = urwid.SimpleListWalker([])
+    ret = self.ret
+    token = ret['syntax_token'] = self.work.token(ret['token'])
+    priority = PRIORITY_IDLE if preload else PRIORITY_SYNTAX
 
-    self.previous_widget = self.window.original_widget
     listbox = TextBox(walker)
-    self.window.original_widget = listbox
-    self.syntax_colored = True
-    focused_index = self.get_focus_index(self.previous_widget)
+    focused_index = self.get_focus_index(self.window.original_widget)
+    if preload:
+      self.previous_widget = listbox
+    else:
+      self.previous_widget = self.window.original_widget
+      self.window.original_widget = listbox
+      self.syntax_colored = True
+
+    ret['highlighting'] = True
+    ret['highlighted'] = 0
+
+    # stay out of the way of input and rendering until the colored view is
+    # actually on screen
+    def is_idle():
+      if self.window.original_widget is listbox or self.quit:
+        return True
+      return time.time() - self.last_repaint > IDLE_DELAY
+
+    # a job that has to wait goes back to the UI thread, which resubmits it a
+    # moment later, so that it doesn't hold on to a worker
+    def resubmit_later(fn, *args):
+      def resubmit(loop, data):
+        self.work.submit(fn, PRIORITY_IDLE, token, *args)
+      self.work.post(lambda: self.loop.set_alarm_in(IDLE_DELAY, resubmit), token)
+
+    def finish_highlighting():
+      ret['highlighting'] = False
+      ret['highlighted'] = ret['maxy']
 
     formatter = UrwidFormatter(style=PYGMENTS_STYLE)
-    def handle_token(token, formatted_line, diff=False):
+    def handle_token(token, formatted_line, out, diff=False):
       text = token[1]
       if not text:
         return
@@ -1478,9 +3120,9 @@ class Viewer(object):
             split_line = split_line[n+1:]
             formatted_line.append(last_word)
             if diff:
-              walker.append(DiffLine(list(formatted_line)))
+              out.append(DiffLine(list(formatted_line)))
             else:
-              walker.append(urwid.Text(list(formatted_line)))
+              out.append(urwid.Text(list(formatted_line)))
 
             del formatted_line[:]
           else:
@@ -1492,126 +3134,101 @@ class Viewer(object):
 
       # end of handle_token function
 
-    def add_diff_lines_to_walker(ret, index, walker, clear_walker=True, cb=None, fname=None):
-
-      if clear_walker:
-        walker[:] = [ ]
-
-      wlines = []
-      # stupid \n ending required...
-      iterator = itertools.count(index)
-      for index in iterator:
-
-        if index >= len(ret['lines']) or self.quit:
-          break
-
-        line = clear_escape_codes(ret['lines'][index])
-
-        if line.startswith("diff --git"):
-          diff_index = index
-
-          commit_lines = [ line ]
-          def add_line():
-            commit_lines.append(clear_escape_codes(ret['lines'][iterator.next()]))
-            return 1
-            # doh. even though iterator is consuming it, we need this for later
-
-          index += add_line() # Author
-          index += add_line() # Date
-          index += add_line() # Blah
-
-          index += 1
-
-
-          # Look upwards for the commit line (find the first line that starts with Author and Date)
-          # and put them in commit_lines
-
-          author_index = None
-
-          for windex, wline in enumerate(wlines):
-            if wline.startswith("Author:"):
-              author_index = windex
-
-          if author_index:
-            commit_lines = wlines[author_index-1:] + commit_lines
-            wlines = wlines[:author_index-1]
+    # the workers build the colored lines for one file of the diff per job and
+    # hand them to the UI thread. the diff index says where each file's header
+    # and hunks are, if reading isn't that far yet they wait for it
+    def add_diff_lines_to_walker(file_no, cb=None, pos=0):
+      if preload and not is_idle():
+        return resubmit_later(add_diff_lines_to_walker, file_no, cb, pos)
+
+      token.check()
+      diffs = ret['diffs']
+      folds = ret['folds']
+      lines = ret['lines']
+      out = []
+
+      if file_no >= len(diffs.files):
+        if not ret.get('finished'):
+          return resubmit_later(add_diff_lines_to_walker, file_no, cb, pos)
+
+        # When we make it to the way end, put whatever is after the last file in
+        rest = [ clear_escape_codes(line) for line in lines[pos:] ]
+        if rest:
+          add_lines_to_walker(rest, out, None, skip_colors=True, diff=True)
+
+        def finish():
+          add_to_walker(out, len(lines))
+          # This is when we are finally done. (For reals)
+          if cb:
+            cb()
+
+        self.work.post(finish, token)
+        return
 
-          if wlines:
-            debug("ADDING SYNTAX LINES", wlines, self.fname)
-            add_lines_to_walker(wlines, walker, self.fname, diff=True)
+      entry = diffs.files[file_no]
+      end = diffs.file_end(entry)
+      if end is None:
+        return resubmit_later(add_diff_lines_to_walker, file_no, cb, pos)
 
-          if commit_lines:
-            debug("ADDING COMMIT LINES", commit_lines, self.fname)
+      body_start = entry.body_start if entry.body_start is not None else end
 
-            if not clear_walker and author_index:
-              walker.append(urwid.Text(""))
-            add_lines_to_walker(commit_lines, walker, None, skip_colors=True, diff=True)
+      # a folded file is never lexed, it is just its summary row
+      fold = folds.fold_starting(entry.start)
+      if fold:
+        body_start = entry.start
 
-          # next fname output
-          self.fname = line.split().pop()
-          debug("SETTING FNAME TO", self.fname)
+      # commit headers, messages and the file header go in as they are
+      header = [ clear_escape_codes(line) for line in lines[pos:body_start] ]
+      if header:
+        add_lines_to_walker(header, out, None, skip_colors=True, diff=True)
 
-          def future_call(index, walker):
-            self.update_pager()
-            self.ret['syntax_lines'] = index
-            add_diff_lines_to_walker(ret, index, walker, clear_walker=False, cb=cb)
-
-          thread = threading.Thread(target=future_call, args=(index, walker))
-          time.sleep(0.001)
-          if not self.quit:
-            thread.start()
-          return
-        else:
-          wlines.append(line)
-
-      if wlines:
-        # When we make it to the way end, put the last file contents in
-        add_lines_to_walker(wlines, walker, self.fname, diff=True)
-
-      if cb:
-        cb()
-
-      self.ret['syntax_lines'] = index
-      # This is when we are finally done. (For reals)
+      if fold:
+        out.append(fold_widget(fold))
+      else:
+        body = [ clear_escape_codes(line) for line in lines[body_start:end] ]
+        if body:
+          syntax_log.debug("ADDING SYNTAX LINES", entry.path)
+          add_lines_to_walker(body, out, entry.path, diff=True)
+
+        # folded hunks are lexed with their file, but only take up a row
+        for hunk_fold in reversed(folds.folds_between(body_start, end)):
+          out[hunk_fold.start - pos:hunk_fold.end - pos] = [ fold_widget(hunk_fold) ]
+
+      self.work.post(lambda: add_to_walker(out, end), token)
+      self.work.submit(add_diff_lines_to_walker, priority, token, file_no + 1, cb, end)
+
+    def add_to_walker(out, index):
+      walker.extend(out)
+      ret['syntax_lines'] = len(walker)
+      ret['highlighted'] = index
       self.update_pager()
 
     def add_lines_to_walker(lines, walker, fname=None, diff=False, skip_colors=False):
       if len(lines):
         lexer = None
         forced = False
+        lines = [ decode_line(line) for line in lines ]
 
         if not fname and skip_colors:
-          debug("LINES BEFORE LEXER", lines)
-          debug("SKIPPING COLORING", fname, diff)
+          syntax_log.trace("LINES BEFORE LEXER", lines)
+          syntax_log.debug("SKIPPING COLORING", fname, diff)
           lines = self.escape_ansi_colors([line.rstrip() for line in lines])
-          self.syntax_lang = "None"
+          if not diff:
+            self.syntax_lang = "None"
           walker.extend(lines)
           return
 
         output = "".join(lines)
-        try:
-          forced = True
-          if not fname in _lexer_fname_cache:
-            _lexer_fname_cache[fname] = pygments.lexers.get_lexer_for_filename(fname)
-
-          lexer = _lexer_fname_cache[fname]
-        except:
-          pass
-
-        if not lexer:
-          try:
-              lexer = guess_lexer(output)
-          except Exception, e:
-              debug("EXCEPTION", e);
-              lexer = pygments.lexers.TextLexer()
+        forced = True
+        lexer = pick_lexer(fname, output)
 
         if diff and forced:
           self.syntax_lang = "git diff"
-          debug("LEXER (FORCED) ", lexer)
+          syntax_log.debug("LEXER (FORCED) ", lexer)
         else:
           score = lexer.__class__.analyse_text(output)
           self.syntax_lang = lexer.name
-          debug("LEXER (TRIED: %s) and (GUESSED) SCORE" % (fname), lexer, score)
+          syntax_log.debug("LEXER (TRIED: %s) and (GUESSED) SCORE" % (fname), lexer, score)
           if score < 0.3:
             # COULDNT FIGURE OUT A GOOD SYNTAX HIGHLIGHTER
             # DISABLE IT
@@ -1623,20 +3240,35 @@ class Viewer(object):
             return
 
         if lexer.__class__ is pygments.lexers.TextLexer:
-          debug("TEXT LEXER! DISABLING")
+          syntax_log.debug("TEXT LEXER! DISABLING")
           lines = self.escape_ansi_colors(["%s" % line.rstrip() for line in lines], self.syntax_colored)
           walker.extend(lines)
           return
 
-        tokens = lexer.get_tokens(output)
-
-        # Build the syntax output up line by line, so that it can be highlighted
-        # one line at a time
-        formatted_tokens = list(formatter.formatgenerator(tokens))
+        cache_key = None
+        formatted_tokens = None
+        if self.hl_cache:
+          cache_key = self.hl_cache.key(output, lexer.name, PYGMENTS_STYLE)
+          formatted_tokens = self.hl_cache.get(cache_key, formatter)
+
+        if formatted_tokens is None:
+          tokens = self.lex_pool.lex(lexer, lines, token.check)
+          if tokens is None:
+            tokens = lexer.get_tokens(output)
+
+          # Build the syntax output up line by line, so that it can be highlighted
+          # one line at a time
+          formatted_tokens = list(formatter.formatgenerator(tokens))
+          if cache_key:
+            self.hl_cache.put(cache_key, formatted_tokens, formatter)
         formatted_line = []
 
-        for token in formatted_tokens:
-          handle_token(token, formatted_line, diff)
+        for index, formatted_token in enumerate(formatted_tokens):
+          handle_token(formatted_token, formatted_line, walker, diff)
+          if not index % 1000:
+            token.check()
+            if preload:
+              ret['highlighted'] = len(walker)
 
         if formatted_line:
           walker.append(urwid.Text(list(formatted_line)))
@@ -1644,27 +3276,46 @@ class Viewer(object):
 
     lines = self.ret['lines']
     if 'is_diff' in self.ret:
-      debug("ADDING DIFF LINES TO WALKER")
+      syntax_log.debug("ADDING DIFF LINES TO WALKER")
       def make_cb():
-        original_widget = self.window.original_widget
         started = time.time()
         def func():
           ended = time.time()
-          debug("TIME TOOK", ended - started)
-          if ended - started < 1:
-            self.readjust_display(original_widget, focused_index)
-
-          if not self.syntax_colored:
+          syntax_log.debug("TIME TOOK", ended - started)
+          finish_highlighting()
+          if ended - started < 1 and not preload:
+            self.readjust_display(listbox, focused_index)
+          else:
             self.update_pager()
 
         return func
-      add_diff_lines_to_walker(self.ret, 0, walker, cb=make_cb())
+      self.work.submit(add_diff_lines_to_walker, priority, token, 0, make_cb())
+      self.syntax_lang = "git diff"
+      if not preload:
+        self.syntax_msg()
     else:
-      wlines = [clear_escape_codes(line) for line in lines]
-      add_lines_to_walker(wlines, walker, None)
-      self.readjust_display(self.window.original_widget, focused_index)
+      def add_all_lines_to_walker():
+        if not ret.get('finished') or (preload and not is_idle()):
+          return resubmit_later(add_all_lines_to_walker)
+
+        out = []
+        wlines = [clear_escape_codes(line) for line in lines]
+        add_lines_to_walker(wlines, out, None)
+
+        def finish():
+          walker.extend(out)
+          finish_highlighting()
+          if not preload:
+            self.readjust_display(listbox, focused_index)
+            self.syntax_msg()
+          else:
+            self.update_pager()
 
-    self.syntax_msg()
+        self.work.post(finish, token)
+
+      self.work.submit(add_all_lines_to_walker, priority, token)
+      if not preload:
+        self.display_status_msg("Detecting syntax...")
 
 
   def display_status_msg(self, msg):
@@ -1680,66 +3331,45 @@ class Viewer(object):
     self.pager.set_text(msg)
 
   def summarize_math(self):
-    math_stats = defaultdict(lambda: defaultdict(int))
-    all_stats = defaultdict(int)
-
-    def initialize_stats(stats_dict):
-      stats_dict['min'] = sys.maxint
-      stats_dict['max'] = -sys.maxint + 1
-      stats_dict['vals'] = []
-
-    def update_stats(stats_dict, val):
-      stats_dict['count'] += 1
-      stats_dict['max'] = max(stats_dict['max'], val)
-      stats_dict['min'] = min(stats_dict['min'], val)
-      stats_dict['sum'] += val
-      stats_dict['vals'].append(val)
-
-    def finalize_stats(stats_dict):
-      if stats_dict['count'] is 0:
-        return False
-
-      mean = stats_dict['mean'] = stats_dict['sum'] / stats_dict['count']
-      stats_dict['vals'].sort()
-      error = 0
-      for val in stats_dict['vals']:
-        error += abs(mean - val) ** 2
-
-      error /= stats_dict['count']
-      std = math.sqrt(error)
-
-      stats_dict['big5'] = get_five(stats_dict)
-      stats_dict['std'] = std
-
-      return True
+    ret = self.ret
+    if not 'numstats' in ret:
+      ret['numstats'] = BufferStats()
+
+    stats = ret['numstats']
+    if stats.scanned >= len(ret['lines']):
+      self.save_index(ret, 'numstats')
+      self.open_math_overlay(stats)
+      return
 
-    def get_five(stats_dict):
-      vals = stats_dict['vals']
-      length = len(vals)
-      return {
-        "5" : vals[int(length * 0.05)],
-        "25" : vals[int(length * 0.25)],
-        "50" : vals[int(length * 0.50)],
-        "75" : vals[int(length * 0.75)],
-        "95" : vals[int(length * 0.95)]
-      }
+    if ret.get('number_scanning'):
+      return
 
-    initialize_stats(all_stats)
+    ret['number_scanning'] = True
+    self.display_status_msg("Crunching %s lines..." % (len(ret['lines']) - stats.scanned))
 
-    for token in self.ret['tokens']:
-      try:
-        val = float(token['text'])
-      except ValueError, e:
-        continue
+    # picks up where the last scan stopped, if more lines came in since
+    token = self.work.token(ret['token'])
+    end = len(ret['lines'])
+    def scan_numbers():
+      stats.scan(ret['lines'], min(stats.scanned + MAX_CHUNK_SIZE, end))
+      if stats.scanned < end:
+        self.work.submit(scan_numbers, PRIORITY_INPUT, token)
+        return
 
-      update_stats(all_stats, val)
+      def finish():
+        ret['number_scanning'] = False
+        self.save_index(ret, 'numstats')
+        if not self.window.overlay_opened:
+          self.open_math_overlay(stats)
 
-      # test the token to see if its numbery. if so... modify it
+      self.work.post(finish, token)
 
+    self.work.submit(scan_numbers, PRIORITY_INPUT, token)
 
-    has_stats = finalize_stats(all_stats)
+  def open_math_overlay(self, stats):
+    all_stats = stats.summary()
 
-    if not has_stats:
+    if not all_stats['count']:
       self.display_status_msg("No numbers found in buffer, can't math it up")
       return
 
@@ -1759,7 +3389,7 @@ class Viewer(object):
       listitems.append(columns)
 
     listitems.append(urwid.Text(""))
-    for item in ['5', '25', '50', '75', '95']:
+    for item in PERCENTILES:
       msg = str("%0.2f" % all_stats['big5'][item])
       shortcut = urwid.Text([ " ", ('highlight', "p%s" % item)])
       shortcut.align = "left"
@@ -1772,6 +3402,444 @@ class Viewer(object):
     self.window.open_overlay(urwid.LineBox(listbox),
       width=70)
 
+  # {{{ memory
+  def walker_views(self):
+    plain = colored = None
+    for listbox in [ self.window.original_widget, self.previous_widget ]:
+      body = getattr(listbox, 'body', None)
+      if isinstance(body, LineWalker):
+        plain = body
+      elif body is not None:
+        colored = body
+    return plain, colored
+
+  # (label, bytes) rows, a row without bytes is a heading
+  def memory_usage(self):
+    rows = [ ("current buffer", None) ]
+    rows.extend(memstats.buffer_usage(self.ret))
+    plain, colored = self.walker_views()
+    rows.append(("plain view widgets", memstats.walker_size(plain)))
+    rows.append(("highlighted view", memstats.walker_size(colored)))
+
+    rows.append(("buffer stack (%s, budget %s)" % (len(self.stack), memstats.format_size(self.stack.budget)), None))
+    for index, entry in enumerate(reversed(self.stack.entries)):
+      size = entry.resident_size
+      state = "live"
+      if entry.frozen is not None:
+        state = "compressed"
+      elif entry.spilled:
+        state = "spilled"
+
+      if entry.view:
+        state += " + view"
+        size += memstats.walker_size(entry.view['walker'])
+        previous = getattr(entry.view['previous_widget'], 'body', None)
+        size += memstats.walker_size(previous)
+      rows.append(("  %s: %s" % (index + 1, state), size))
+
+    rows.append(("process", None))
+    rows.append(("resident", memstats.process_rss()))
+    if SOFT_LIMIT:
+      rows.append(("soft limit", SOFT_LIMIT * 1024 * 1024))
+
+    top = memstats.top_allocations()
+    if TRACEMALLOC and not memstats.can_trace():
+      rows.append(("tracemalloc: not available, python 2 needs pytracemalloc", None))
+    if top:
+      rows.append(("tracemalloc", None))
+      rows.extend(top)
+
+    return rows
+
+  def show_memory_usage(self):
+    listitems = [
+      urwid.Text("where the memory went (roughly)"),
+      urwid.Text("") ]
+
+    for label, size in self.memory_usage():
+      if size is None:
+        listitems.append(urwid.Text(('highlight', label)))
+        continue
+
+      shortcut = urwid.Text([ " ", label ])
+      shortcut.align = "left"
+      size_msg = urwid.Text(memstats.format_size(size) + "  ")
+      size_msg.align = "right"
+      listitems.append(urwid.Columns([ ("weight", 3, shortcut), ("weight", 1, size_msg)]))
+
+    listbox = TextBox(listitems)
+    self.window.open_overlay(urwid.LineBox(listbox),
+      width=70)
+
+  def print_memory_report(self):
+    for label, size in self.memory_usage():
+      if size is None:
+        print >> sys.stderr, label
+      else:
+        print >> sys.stderr, "  %-40s %s" % (label, memstats.format_size(size))
+
+  def check_memory(self):
+    if not SOFT_LIMIT or time.time() - self.memory_checked < 1:
+      return
+
+    self.memory_checked = time.time()
+    rss = memstats.process_rss()
+    # freed memory doesn't always go back to the OS, so only shed again once
+    # things grew some more
+    if not rss or rss < SOFT_LIMIT * 1024 * 1024 or rss < self.memory_shed_at * 1.1:
+      return
+
+    self.memory_shed_at = rss
+    self.shed_memory()
+
+  # drop whatever can be rebuilt: the rendered views of stacked buffers, a
+  # parked highlighted view, the line widget cache. stacked buffers get
+  # compressed and spilled as if the stack was over its budget
+  def shed_memory(self):
+    for entry in self.stack.entries:
+      entry.view = None
+
+    if self.previous_widget and not self.syntax_colored:
+      if 'syntax_token' in self.ret:
+        self.ret['syntax_token'].cancel()
+      self.ret['highlighting'] = False
+      self.previous_widget = None
+
+    if isinstance(self.walker, LineWalker):
+      self.walker.widgets = {}
+
+    budget = self.stack.budget
+    self.stack.budget = 0
+    self.stack.enforce_budget()
+    self.stack.budget = budget
+
+    render_log.info("SHED MEMORY", memstats.process_rss())
+    self.display_status_msg("Over the %sMB memory limit, dropped cached views" % SOFT_LIMIT)
+  # }}}
+
+  def summarize_columns(self):
+    ret = self.ret
+    if not 'table' in ret:
+      layout = sniff_table(ret['lines'])
+      if not layout:
+        self.display_status_msg("No columns found in buffer, can't table it up")
+        return
+
+      menu_log.debug("TABLE LAYOUT", layout.describe(), layout.ncols, layout.names)
+      ret['table'] = ColumnTable(layout)
+
+    table = ret['table']
+    if table.parsed >= len(ret['lines']):
+      self.open_table_overlay(table)
+      return
+
+    if ret.get('table_parsing'):
+      return
+
+    ret['table_parsing'] = True
+    self.display_status_msg("Parsing %s columns..." % table.layout.ncols)
+
+    # columns are parsed on the workers a chunk at a time, the same way lines
+    # are read
+    token = self.work.token(ret['token'])
+    end = len(ret['lines'])
+    def parse_columns():
+      try:
+        table.parse(ret['lines'], min(table.parsed + MAX_CHUNK_SIZE, end))
+      except Cancelled:
+        raise
+      except Exception:
+        menu_log.error("TABLE PARSING EXCEPTION", traceback.format_exc(100))
+        self.work.post(lambda: self.table_failed(ret), token)
+        return
+
+      if table.parsed < end:
+        self.work.submit(parse_columns, PRIORITY_INPUT, token)
+        return
+
+      def finish():
+        ret['table_parsing'] = False
+        self.save_index(ret, 'table')
+        if not self.window.overlay_opened:
+          self.open_table_overlay(table)
+
+      self.work.post(finish, token)
+
+    self.work.submit(parse_columns, PRIORITY_INPUT, token)
+
+  # a half parsed table can't be picked up again, the next 't' starts over
+  def table_failed(self, ret):
+    ret['table_parsing'] = False
+    ret.pop('table', None)
+    self.display_status_msg(('diff_del', "Couldn't parse the columns of this buffer"))
+
+  def open_table_overlay(self, table):
+    widget = self.window
+    columns = {}
+
+    def sort_by(label, reverse=False):
+      widget.close_overlay()
+      self.sort_by_column(table, columns[label], reverse)
+
+    def sort_descending(kv, ret, widget):
+      label = None
+      if overlay.current_entry in overlay.entries:
+        label = overlay.get_current_entry()
+      else:
+        label = overlay.focused_entry()
+        if not label:
+          return
+
+      sort_by(label, reverse=True)
+
+    modal_keys = {
+      "r" : {
+        "fn" : sort_descending,
+        "help" : "",
+      }
+    }
+
+    title = "%s columns (%s delimited) in %s rows. enter to sort, 'r' to sort descending" % (
+      table.layout.ncols, table.layout.describe(), table.rows)
+    overlay = MenuOverlay(widget, title=title, cb=sort_by, modal_keys=modal_keys,
+      label_width=120, width=("relative", 90))
+
+    for col in xrange(table.layout.ncols):
+      stats = table.summary(col)
+      label = "%-12s count %-8s" % (stats['name'][:12], stats['count'])
+      if 'sum' in stats and stats['min'] is not None:
+        label += "sum %-9.4g min %-9.4g max %-9.4g mean %-9.4g p50 %-9.4g p95 %.4g" % (
+          stats['sum'], stats['min'], stats['max'], stats['mean'], stats['big5']['50'], stats['big5']['95'])
+
+      columns[label] = col
+      overlay.add_entry(label)
+
+  def sort_by_column(self, table, col, reverse=False):
+    lines = self.ret['lines']
+    order = table.sort_order(col, lines, reverse)
+    sorted_lines = [ lines[index] for index in order ]
+    if table.header_index is not None:
+      sorted_lines.insert(0, lines[table.header_index])
+
+    sorted_lines = [ line if line.endswith("\n") else line + "\n" for line in sorted_lines ]
+    self.read_and_display(sorted_lines)
+    self.display_status_msg("Sorted by %s" % table.layout.names[col])
+
+  # {{{ templates
+  def summarize_templates(self):
+    ret = self.ret
+    if ret.get('binary') is not None:
+      self.display_status_msg("Can't group binary input")
+      return
+
+    if not ret['lines']:
+      self.display_status_msg("No lines to group")
+      return
+
+    if not 'templates' in ret:
+      ret['templates'] = TemplateIndex()
+
+    templates = ret['templates']
+    if templates.scanned >= len(ret['lines']):
+      self.open_template_overlay(templates)
+      return
+
+    if ret.get('template_scanning'):
+      return
+
+    ret['template_scanning'] = True
+    self.display_status_msg("Grouping %s lines..." % (len(ret['lines']) - templates.scanned))
+
+    # picks up where the last scan stopped, if more lines came in since
+    token = self.work.token(ret['token'])
+    end = len(ret['lines'])
+    def scan_templates():
+      templates.scan(ret['lines'], min(templates.scanned + MAX_CHUNK_SIZE, end))
+      if templates.scanned < end:
+        self.work.submit(scan_templates, PRIORITY_INPUT, token)
+        return
+
+      def finish():
+        ret['template_scanning'] = False
+        self.save_index(ret, 'templates')
+        if not self.window.overlay_opened:
+          self.open_template_overlay(templates)
+
+      self.work.post(finish, token)
+
+    self.work.submit(scan_templates, PRIORITY_INPUT, token)
+
+  def open_template_overlay(self, templates):
+    ids = {}
+
+    def filter_template(label):
+      self.window.close_overlay()
+      self.filter_template(templates, ids[label])
+
+    title = "%s templates in %s lines" % (len(templates), templates.scanned)
+    overlay = MenuOverlay(self.window, title=title, cb=filter_template, label_width=200, width=("relative", 90))
+    for template_id in templates.ranked(TEMPLATE_MENU_SIZE):
+      label = "%8s  %s" % (templates.counts[template_id], templates.templates[template_id])
+      ids[label] = template_id
+      overlay.add_entry(label)
+
+  def filter_template(self, templates, template_id):
+    lines = templates.matching(self.ret['lines'], template_id)
+    self.read_and_display(lines)
+    self.display_status_msg("%s lines like %s" % (len(lines), templates.templates[template_id]))
+  # }}}
+
+  # {{{ time index
+  # brings the buffer's time index up to date on the workers, then hands it
+  # to `then` on the UI thread
+  def with_time_index(self, then):
+    ret = self.ret
+    if ret.get('binary') is not None:
+      self.display_status_msg("No timestamps in binary input")
+      return
+
+    if not 'times' in ret:
+      fmt = timeindex.sniff_format(ret['lines'])
+      if not fmt:
+        self.display_status_msg("No timestamps found in this buffer")
+        return
+      ret['times'] = timeindex.TimeIndex(fmt)
+
+    times = ret['times']
+    end = len(ret['lines'])
+    if times.scanned >= end:
+      then(times)
+      return
+
+    if ret.get('time_indexing'):
+      self.display_status_msg("Still indexing timestamps...")
+      return
+
+    ret['time_indexing'] = True
+    self.display_status_msg("Indexing the timestamps of %s lines..." % (end - times.scanned))
+
+    token = self.work.token(ret['token'])
+    def index_times():
+      times.scan(ret['lines'], min(times.scanned + MAX_CHUNK_SIZE, end))
+      if times.scanned < end:
+        self.work.submit(index_times, PRIORITY_INPUT, token)
+        return
+
+      def finish():
+        ret['time_indexing'] = False
+        if not len(times):
+          self.display_status_msg("No timestamps found in this buffer")
+          return
+        self.save_index(ret, 'times')
+        then(times)
+
+      self.work.post(finish, token)
+
+    self.work.submit(index_times, PRIORITY_INPUT, token)
+
+  def jump_to_time(self, text):
+    def jump(times):
+      fmt = times.format
+      near = times.time_at(self.current_line())
+      if near is None:
+        near = times.times[0]
+
+      epoch = timeindex.parse_query(text, fmt, near)
+      if epoch is None:
+        self.display_status_msg("Can't read '%s' as a time, try HH:MM:SS or YYYY-MM-DD HH:MM" % text)
+        return
+
+      line = times.find(epoch)
+      if line is None:
+        self.display_status_msg("The log ends before %s" % timeindex.format_time(epoch, fmt))
+        return
+
+      self.focus_line(line)
+      self.display_status_msg("Jumped to %s" % timeindex.format_time(times.time_at(line), fmt))
+
+    self.with_time_index(jump)
+
+  def show_time_histogram(self):
+    def show(times):
+      fmt = times.format
+      bucket, name, rows = times.histogram()
+      peak = max(row[1] for row in rows) or 1
+      near = times.time_at(self.current_line())
+      starts = {}
+
+      def jump_to(label):
+        self.window.close_overlay()
+        if starts[label] is not None:
+          self.focus_line(starts[label])
+
+      title = "lines per %s (%s timestamps)" % (name, fmt.name)
+      overlay = MenuOverlay(self.window, title=title, cb=jump_to, label_width=80, width=("relative", 90))
+      for start, count, line in rows:
+        label = "%s %8s %s" % (timeindex.format_time(start, fmt, seconds=False), count,
+          "#" * (HISTOGRAM_WIDTH * count / peak))
+        # an empty bucket jumps to whatever comes after it
+        starts[label] = line if line is not None else times.find(start)
+        index = overlay.add_entry(label)
+        if near is not None and start <= near < start + bucket:
+          overlay.focus(index)
+
+    self.with_time_index(show)
+  # }}}
+
+  # {{{ sidecar
+  # the indexes saved for the file are put in place once it is read, unless
+  # they were already built by then or don't cover the file as it was read
+  def load_sidecar(self, ret):
+    token = self.work.token(ret['token'])
+    def load():
+      indexes = ret['sidecar'].load_all([ key for key in SIDECAR_KEYS if key not in ret ])
+
+      def apply():
+        for key, index in indexes.iteritems():
+          covered = getattr(index, 'scanned', getattr(index, 'parsed', None))
+          if key not in ret and covered == len(ret['lines']):
+            ret[key] = index
+        ingest_log.info("LOADED SIDECAR INDEXES", indexes.keys())
+
+      self.work.post(apply, token)
+
+    self.work.submit(load, PRIORITY_IDLE, token)
+
+  # an index is only worth saving once it covers the whole file
+  def save_index(self, ret, key):
+    cache = ret.get('sidecar')
+    if not cache or not ret.get('finished') or ret['line_offset'] or key in cache.stored:
+      return
+
+    index = ret[key]
+    token = self.work.token(ret['token'])
+    def save():
+      if cache.save(key, index):
+        ingest_log.info("SAVED SIDECAR INDEX", key)
+
+    self.work.submit(save, PRIORITY_IDLE, token)
+
+  # a file's line offsets from an earlier read, so that it opens at any line
+  # without reading the lines above it. they are loaded right away (they're
+  # small), opening the file can't wait for the workers
+  def load_offsets(self, path, cache=None):
+    if not cache and SIDECAR_DIR:
+      cache = sidecar.open_sidecar(path, SIDECAR_DIR, SIDECAR_LIMIT * 1024 * 1024)
+    if not cache or get_index(path):
+      return
+
+    index = cache.load('offsets')
+    if index is not None:
+      put_index(path, index)
+      ingest_log.info("LOADED SIDECAR OFFSETS", path)
+
+  def save_offsets(self, ret):
+    index = get_index(INPUT_PATHS[0])
+    if index and index.complete and index.portable():
+      ret['offsets'] = index
+      self.save_index(ret, 'offsets')
+  # }}}
+
 def _run():
   kv = Viewer()
   curses.wrapper(kv.run)
@@ -1782,7 +3850,52 @@ def _run():
       except Exception, e:
         raise e
 
+# {{{ render mode
+def parse_args():
+  parser = optparse.OptionParser(usage="%prog [options] [file ...]")
+  parser.add_option("--render", action="store_true",
+    help="highlight the input to stdout instead of paging it")
+  parser.add_option("--plain", action="store_true",
+    help="with --render, write the input without any colors")
+  parser.add_option("-w", "--watch", dest="command",
+    help="run COMMAND and show its output, re-running it every --interval seconds", metavar="COMMAND")
+  parser.add_option("-n", "--interval", type="float", default=2,
+    help="seconds between runs of the watched command (default 2)")
+  parser.add_option("-d", "--differences", action="store_true",
+    help="highlight the lines that changed in the last run of the watched command")
+  parser.add_option("-l", "--line", type="int", default=0,
+    help="open the file at LINE. a file read before starts there right away", metavar="LINE")
+  return parser.parse_args()
+
+def render(paths, color=True):
+  fname = None
+  if len(paths) == 1 and paths[0] != '-':
+    fname = source_name(paths[0])
+
+  lex_pool = LexPool(LEX_PROCS, PARALLEL_LEX_LINES)
+  lex_pool.start()
+  renderer = BatchRenderer(sys.stdout, PYGMENTS_STYLE, color, lex_pool, ENCODING, fname)
+  try:
+    renderer.render(read_input(paths))
+  except IOError, e:
+    # the reader went away (| head)
+    if e.errno != errno.EPIPE:
+      raise
+  finally:
+    lex_pool.shutdown()
+# }}}
+
 def run():
+  global INPUT_PATHS, WATCH, START_LINE
+  options, INPUT_PATHS = parse_args()
+  START_LINE = options.line
+  if options.render:
+    render(INPUT_PATHS, not options.plain)
+    return
+
+  if options.command:
+    WATCH = options
+
   if PROFILE:
     import cProfile
     cProfile.run("_run()", "restats")
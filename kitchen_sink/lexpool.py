@@ -0,0 +1,138 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# lexes big (non diff) buffers on all cores. the buffer is cut into pieces at
+# lines where the lexer is known to start over in its initial state: any line
+# for line oriented languages, a top level line after a blank line for the
+# others (as long as no multi line string or comment is open there). each
+# piece is lexed in a worker process and the tokens are put back together in
+# order. lexers that aren't known to be safe to split are lexed in one go.
+# }}}
+
+import multiprocessing
+import threading
+
+import pygments.lexers
+
+# every line stands on its own
+LINE_LEXERS = set([ 'ini', 'properties', 'apacheconf', 'nginx', 'irc', 'squidconf' ])
+
+# a blank line followed by an unindented line is a fresh start, unless it is
+# inside one of these multi line strings (toggles) or comments (pairs)
+BLOCK_LEXERS = {
+  'python' : ([ '"""', "'''" ], []),
+  'python3' : ([ '"""', "'''" ], []),
+  'c' : ([], [ ('/*', '*/') ]),
+  'cpp' : ([], [ ('/*', '*/') ]),
+  'java' : ([], [ ('/*', '*/') ]),
+  'go' : ([ '`' ], [ ('/*', '*/') ]),
+  'rust' : ([], [ ('/*', '*/') ]),
+  'javascript' : ([ '`' ], [ ('/*', '*/') ]),
+  'css' : ([], [ ('/*', '*/') ]),
+  'scss' : ([], [ ('/*', '*/') ]),
+  'less' : ([], [ ('/*', '*/') ]),
+  'sql' : ([], [ ('/*', '*/') ]),
+  'yaml' : ([], []),
+}
+
+def lexer_alias(lexer):
+  for alias in lexer.aliases:
+    if alias in LINE_LEXERS or alias in BLOCK_LEXERS:
+      return alias
+
+# returns the line numbers the pieces start at (after the first one), or None
+# if the lexer can't be split
+def split_points(lines, alias, piece_lines):
+  points = []
+  last = 0
+  if alias in LINE_LEXERS:
+    return range(piece_lines, len(lines), piece_lines)
+
+  if alias not in BLOCK_LEXERS:
+    return
+
+  toggles, pairs = BLOCK_LEXERS[alias]
+  open_toggles = dict((toggle, False) for toggle in toggles)
+  depth = 0
+  blank = False
+  for index, line in enumerate(lines):
+    stripped = line.strip()
+    if not stripped:
+      blank = True
+      continue
+
+    if blank and index - last >= piece_lines and line[0] not in " \t" \
+        and not depth and not any(open_toggles.itervalues()):
+      points.append(index)
+      last = index
+    blank = False
+
+    for toggle in toggles:
+      if line.count(toggle) % 2:
+        open_toggles[toggle] = not open_toggles[toggle]
+    for start, end in pairs:
+      depth = max(depth + line.count(start) - line.count(end), 0)
+
+  return points
+
+# runs in the worker processes. token types go back as strings, the
+# formatter only looks at their names
+def lex_piece(args):
+  alias, text = args
+  lexer = pygments.lexers.get_lexer_by_name(alias, stripnl=False)
+  return [ (str(ttype), value) for ttype, value in lexer.get_tokens(text) ]
+
+class LexPool(object):
+  def __init__(self, processes, min_lines=20000):
+    self.processes = processes
+    self.min_lines = min_lines
+    self.pool = None
+    self.lock = threading.Lock()
+
+  # forks the worker processes. this has to happen before kk starts any
+  # threads of its own: a fork copies whatever locks the other threads hold at
+  # that moment, and a worker process that needs one of them hangs forever.
+  # (the debug log's writer may already be running, the workers never log)
+  def start(self):
+    with self.lock:
+      if self.processes >= 2 and not self.pool:
+        self.pool = multiprocessing.Pool(self.processes)
+
+  # the tokens for the lines, or None if they should be lexed sequentially.
+  # check() is called while waiting, so the lexing can be called off
+  def lex(self, lexer, lines, check=None):
+    with self.lock:
+      pool = self.pool
+    if not pool or len(lines) < self.min_lines:
+      return
+
+    alias = lexer_alias(lexer)
+    if not alias:
+      return
+
+    # a few pieces per process, so a slow piece doesn't hold up the rest
+    piece_lines = max(len(lines) / (self.processes * 4), 1000)
+    points = split_points(lines, alias, piece_lines)
+    if not points:
+      return
+
+    bounds = [ 0 ] + list(points) + [ len(lines) ]
+    pieces = [ (alias, "".join(lines[start:end])) for start, end in zip(bounds, bounds[1:]) ]
+    result = pool.map_async(lex_piece, pieces)
+    while not result.ready():
+      result.wait(0.1)
+      if check:
+        check()
+
+    tokens = []
+    for piece in result.get():
+      tokens.extend(piece)
+    return tokens
+
+  def shutdown(self):
+    with self.lock:
+      if self.pool:
+        self.pool.terminate()
+        self.pool = None
+
+# vim: set foldmethod=marker
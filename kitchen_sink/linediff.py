@@ -0,0 +1,201 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# line diffs over hashes of the lines. the lines are hashed once, then the
+# common head and tail are skipped and only the part in between is diffed.
+# output that mostly stays the same between two runs (the usual case for a
+# watched command) costs little more than hashing it.
+#
+# diff_lines hands the middle to difflib, which is fine for a few changes. a
+# middle too big for it is called a replacement as a whole. patience_diff is for comparing whole buffers: it anchors on lines that show
+# up once on each side and only falls back to difflib between anchors, for
+# stretches small enough that its quadratic worst case doesn't matter.
+# }}}
+
+import bisect
+import difflib
+
+# past this (lines on one side times lines on the other), a stretch that
+# difflib would have to search (diff_lines' middle, or a stretch without
+# unique lines in patience_diff) is called a replacement instead
+FALLBACK_SIZE = 1000000
+
+def line_hashes(lines):
+  return map(hash, lines)
+
+# the number of equal items at the start and at the end of both lists
+def common_ends(old, new):
+  limit = min(len(old), len(new))
+  head = 0
+  while head < limit and old[head] == new[head]:
+    head += 1
+
+  tail = 0
+  limit -= head
+  while tail < limit and old[-1 - tail] == new[-1 - tail]:
+    tail += 1
+
+  return head, tail
+
+# (tag, i1, i2, j1, j2) for each change that turns old into new, like
+# SequenceMatcher.get_opcodes, minus the 'equal' ones
+def diff_lines(old, new):
+  if old == new:
+    return []
+
+  head, tail = common_ends(old, new)
+  old_end = len(old) - tail
+  new_end = len(new) - tail
+  if (old_end - head) * (new_end - head) > FALLBACK_SIZE:
+    return [ ('replace', head, old_end, head, new_end) ]
+
+  matcher = difflib.SequenceMatcher(None, old[head:old_end], new[head:new_end], autojunk=False)
+
+  changes = []
+  for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    if tag != 'equal':
+      changes.append((tag, i1 + head, i2 + head, j1 + head, j2 + head))
+  return changes
+
+# {{{ patience
+# the lines in a[alo:ahi] and b[blo:bhi] that show up once on each side, as
+# (i, j) pairs, in order on both sides (the longest such run)
+def unique_anchors(a, alo, ahi, b, blo, bhi):
+  # line -> its index in a, or -1 if it shows up more than once
+  seen = {}
+  for i in xrange(alo, ahi):
+    line = a[i]
+    seen[line] = -1 if line in seen else i
+
+  found = {}
+  for j in xrange(blo, bhi):
+    line = b[j]
+    i = seen.get(line, -1)
+    if i >= 0:
+      found[line] = -1 if line in found else j
+
+  pairs = sorted((seen[line], j) for line, j in found.iteritems() if j >= 0)
+  if not pairs:
+    return []
+
+  # longest increasing run of j, patience sorting style
+  tops = []
+  tails = []
+  back = [ None ] * len(pairs)
+  for index, (i, j) in enumerate(pairs):
+    pile = bisect.bisect_left(tops, j)
+    if pile:
+      back[index] = tails[pile - 1]
+    if pile == len(tops):
+      tops.append(j)
+      tails.append(index)
+    else:
+      tops[pile] = j
+      tails[pile] = index
+
+  anchors = []
+  index = tails[-1]
+  while index is not None:
+    anchors.append(pairs[index])
+    index = back[index]
+  anchors.reverse()
+  return anchors
+
+# the equal stretches of a and b, as (i, j, length), in order
+def patience_blocks(a, b, check=None):
+  blocks = []
+  regions = [ (0, len(a), 0, len(b)) ]
+  while regions:
+    if check:
+      check()
+
+    alo, ahi, blo, bhi = regions.pop()
+    head = 0
+    while alo + head < ahi and blo + head < bhi and a[alo + head] == b[blo + head]:
+      head += 1
+    if head:
+      blocks.append((alo, blo, head))
+      alo += head
+      blo += head
+
+    tail = 0
+    while alo < ahi - tail and blo < bhi - tail and a[ahi - 1 - tail] == b[bhi - 1 - tail]:
+      tail += 1
+    if tail:
+      blocks.append((ahi - tail, bhi - tail, tail))
+      ahi -= tail
+      bhi -= tail
+
+    if alo == ahi or blo == bhi:
+      continue
+
+    anchors = unique_anchors(a, alo, ahi, b, blo, bhi)
+    if anchors:
+      for i, j in anchors:
+        regions.append((alo, i, blo, j))
+        blocks.append((i, j, 1))
+        alo, blo = i + 1, j + 1
+      regions.append((alo, ahi, blo, bhi))
+    elif (ahi - alo) * (bhi - blo) <= FALLBACK_SIZE:
+      matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+      for i, j, size in matcher.get_matching_blocks():
+        if size:
+          blocks.append((alo + i, blo + j, size))
+
+  blocks.sort()
+  return blocks
+
+# like diff_lines, for inputs of any size
+def patience_diff(a, b, check=None):
+  changes = []
+  i = j = 0
+  for bi, bj, size in patience_blocks(a, b, check) + [ (len(a), len(b), 0) ]:
+    if i < bi or j < bj:
+      tag = 'replace'
+      if i == bi:
+        tag = 'insert'
+      elif j == bj:
+        tag = 'delete'
+      changes.append((tag, i, bi, j, bj))
+    i, j = bi + size, bj + size
+  return changes
+# }}}
+
+# {{{ unified output
+def with_newline(line):
+  if line.endswith("\n"):
+    return line
+  return line + "\n"
+
+# the changes as a unified diff, hunks with `context` lines around them
+def unified_diff(a, b, changes, a_name, b_name, context=3):
+  out = [ "--- %s\n" % a_name, "+++ %s\n" % b_name ]
+
+  groups = []
+  for change in changes:
+    if groups and change[1] - groups[-1][-1][2] <= 2 * context:
+      groups[-1].append(change)
+    else:
+      groups.append([ change ])
+
+  for group in groups:
+    first, last = group[0], group[-1]
+    a_start = max(first[1] - context, 0)
+    a_end = min(last[2] + context, len(a))
+    b_start = first[3] - (first[1] - a_start)
+    b_end = last[4] + (a_end - last[2])
+    out.append("@@ -%s,%s +%s,%s @@\n" % (a_start + 1 if a_end > a_start else a_start, a_end - a_start,
+      b_start + 1 if b_end > b_start else b_start, b_end - b_start))
+
+    pos = a_start
+    for tag, i1, i2, j1, j2 in group:
+      out.extend(" " + with_newline(line) for line in a[pos:i1])
+      out.extend("-" + with_newline(line) for line in a[i1:i2])
+      out.extend("+" + with_newline(line) for line in b[j1:j2])
+      pos = i2
+    out.extend(" " + with_newline(line) for line in a[pos:a_end])
+
+  return out
+# }}}
+
+# vim: set foldmethod=marker
@@ -0,0 +1,137 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# rough memory accounting for buffers. walking every object of a big buffer
+# would take longer than reading it, so each part is sized from a sample of
+# its items and scaled up. good enough to tell which part of which buffer is
+# eating the memory. tracemalloc (if it is installed) gives the exact picture.
+# it is only in the standard library from python 3.4, on python 2 it takes
+# the pytracemalloc backport (a patched interpreter plus the module).
+# }}}
+
+import os
+import sys
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+SAMPLE_SIZE = 200
+
+def shallow_size(obj):
+  size = sys.getsizeof(obj)
+  attrs = getattr(obj, '__dict__', None)
+  if attrs is not None:
+    size += sys.getsizeof(attrs)
+    size += sum(sys.getsizeof(val) for val in attrs.itervalues())
+  return size
+
+# the size of a list of similar items, from a sample of them. the list's own
+# pointers are counted too
+def sampled_size(items, size_of=sys.getsizeof):
+  count = len(items)
+  if not count:
+    return 0
+
+  step = max(count / SAMPLE_SIZE, 1)
+  sample = [ items[index] for index in xrange(0, count, step) ][:SAMPLE_SIZE]
+  average = sum(size_of(item) for item in sample) / float(len(sample))
+  return int(average * count) + count * 8
+
+def walker_size(walker):
+  if walker is None:
+    return 0
+
+  # a LineWalker only holds on to the widgets that were looked at
+  widgets = getattr(walker, 'widgets', None)
+  if widgets is not None:
+    return sampled_size(widgets.values() + walker.overrides.values(), shallow_size)
+
+  return sampled_size(walker, shallow_size)
+
+def array_size(arr):
+  return arr.buffer_info()[1] * arr.itemsize
+
+def table_size(table):
+  if not table:
+    return 0
+  size = array_size(table.line_index)
+  size += sum(array_size(values) for values in table.values.itervalues())
+  return size
+
+def templates_size(templates):
+  if not templates:
+    return 0
+  return array_size(templates.line_ids) + sampled_size(templates.templates)
+
+def time_index_size(times):
+  if not times:
+    return 0
+  return array_size(times.lines) + array_size(times.times)
+
+def diff_index_size(diffs):
+  if not diffs:
+    return 0
+  return sampled_size(diffs.files, shallow_size) + sampled_size(diffs.hunks, shallow_size)
+
+# the parts of a buffer and how big they are, in bytes
+def buffer_usage(ret):
+  return [
+    ("lines", sampled_size(ret.get('lines') or [])),
+    ("diff index", diff_index_size(ret.get('diffs'))),
+    ("table", table_size(ret.get('table'))),
+    ("templates", templates_size(ret.get('templates'))),
+    ("time index", time_index_size(ret.get('times'))),
+  ]
+
+# resident memory of the process, or None if it can't be found out
+def process_rss():
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (IOError, OSError, ValueError, IndexError):
+    pass
+
+  try:
+    import resource
+    # max rss, not the current one, but better than nothing. kB on linux,
+    # bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+  except Exception:
+    return None
+
+# {{{ tracemalloc
+def can_trace():
+  return tracemalloc is not None
+
+def start_tracing():
+  if tracemalloc and not tracemalloc.is_tracing():
+    tracemalloc.start()
+    return True
+  return False
+
+def top_allocations(limit=10):
+  if not tracemalloc or not tracemalloc.is_tracing():
+    return []
+
+  snapshot = tracemalloc.take_snapshot()
+  ret = []
+  for stat in snapshot.statistics('lineno')[:limit]:
+    frame = stat.traceback[0]
+    ret.append(("%s:%s" % (os.path.basename(frame.filename), frame.lineno), stat.size))
+  return ret
+# }}}
+
+def format_size(size):
+  if size is None:
+    return "?"
+
+  for unit in [ "B", "KB", "MB" ]:
+    if abs(size) < 1024:
+      return "%.1f%s" % (size, unit)
+    size /= 1024.0
+  return "%.1fGB" % size
+
+# vim: set foldmethod=marker
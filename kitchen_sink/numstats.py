@@ -0,0 +1,218 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# online number crunching for math mode. numbers are pulled out of the buffer
+# a chunk at a time while it is being read, so pressing 'm' only has to print
+# what was already calculated, no matter how big the buffer is. a buffer whose
+# lines changed after reading (a watched command) is crunched again on 'm'.
+# }}}
+
+import array
+import math
+import re
+
+# a whitespace delimited token that float() would accept (minus nan & inf)
+NUMBER_RE = re.compile(r'(?<!\S)[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?!\S)')
+# colors and overstrikes would glue themselves to the numbers
+ESCAPE_RE = re.compile(r'\x1b\[[0-9;]*[mK]|.\x08')
+
+PERCENTILES = ['5', '25', '50', '75', '95']
+
+# past this the variance overflows. numbers that big are mostly hex ids that
+# happen to read as floats (8e400123), so the stats leave them out (and inf
+# and nan, which fail the comparison)
+MAX_MAGNITUDE = 1e150
+
+def usable(val):
+  return abs(val) < MAX_MAGNITUDE
+
+def extract_numbers(text):
+  return array.array('d', map(float, NUMBER_RE.findall(text)))
+
+# {{{ quantile sketch
+# log bucketed histogram (a la DDSketch): every value lands in a bucket whose
+# boundaries are within `accuracy` of each other, so any quantile is within
+# `accuracy` relative error. two sketches merge by adding their buckets.
+class QuantileSketch(object):
+  def __init__(self, accuracy=0.01, max_buckets=2048):
+    self.accuracy = accuracy
+    self.max_buckets = max_buckets
+    self.gamma = (1 + accuracy) / (1 - accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.min_value = 1e-9
+    self.positive = {}
+    self.negative = {}
+    self.zeros = 0
+    self.count = 0
+
+  def key(self, val):
+    return int(math.ceil(math.log(val) / self.log_gamma))
+
+  def value(self, key):
+    return 2 * self.gamma ** key / (self.gamma + 1)
+
+  def add_all(self, vals):
+    positive = self.positive
+    negative = self.negative
+    key = self.key
+    min_value = self.min_value
+    count = 0
+    for val in vals:
+      if not abs(val) < MAX_MAGNITUDE:
+        continue
+
+      count += 1
+      if val > min_value:
+        k = key(val)
+        positive[k] = positive.get(k, 0) + 1
+      elif val < -min_value:
+        k = key(-val)
+        negative[k] = negative.get(k, 0) + 1
+      else:
+        self.zeros += 1
+
+    self.count += count
+    self.collapse(positive)
+    self.collapse(negative)
+
+  # fold the smallest magnitude buckets together so memory stays bounded,
+  # the tails are what people look at
+  def collapse(self, store):
+    if len(store) <= self.max_buckets:
+      return
+
+    keys = sorted(store)
+    extra = keys[:len(keys) - self.max_buckets + 1]
+    total = sum(store.pop(k) for k in extra)
+    store[extra[-1]] = total
+
+  def merge(self, other):
+    for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+      for k, v in other_store.iteritems():
+        store[k] = store.get(k, 0) + v
+      self.collapse(store)
+
+    self.zeros += other.zeros
+    self.count += other.count
+
+  def quantile(self, q):
+    if not self.count:
+      return None
+
+    rank = q * (self.count - 1)
+    seen = 0
+    for k in sorted(self.negative, reverse=True):
+      seen += self.negative[k]
+      if seen > rank:
+        return -self.value(k)
+
+    seen += self.zeros
+    if seen > rank:
+      return 0.0
+
+    for k in sorted(self.positive):
+      seen += self.positive[k]
+      if seen > rank:
+        return self.value(k)
+
+    return self.value(max(self.positive))
+# }}}
+
+# {{{ running stats
+class RunningStats(object):
+  def __init__(self):
+    self.count = 0
+    self.sum = 0.0
+    self.min = None
+    self.max = None
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.sketch = QuantileSketch()
+
+  def update(self, vals):
+    vals = filter(usable, vals)
+    n = len(vals)
+    if not n:
+      return
+
+    total = math.fsum(vals)
+    mean = total / n
+    m2 = math.fsum((val - mean) ** 2 for val in vals)
+    lo = min(vals)
+    hi = max(vals)
+
+    self.combine(n, total, mean, m2, lo, hi)
+    self.sketch.add_all(vals)
+
+  def merge(self, other):
+    if not other.count:
+      return
+
+    self.combine(other.count, other.sum, other.mean, other.m2, other.min, other.max)
+    self.sketch.merge(other.sketch)
+
+  # parallel variance (chan et al.), so chunks can be folded in any order
+  def combine(self, n, total, mean, m2, lo, hi):
+    count = self.count + n
+    delta = mean - self.mean
+    self.m2 += m2 + delta ** 2 * self.count * n / count
+    self.mean += delta * n / count
+    self.count = count
+    self.sum += total
+
+    if self.min is None or lo < self.min:
+      self.min = lo
+    if self.max is None or hi > self.max:
+      self.max = hi
+
+  @property
+  def std(self):
+    if not self.count:
+      return 0.0
+
+    return math.sqrt(self.m2 / self.count)
+
+  def percentile(self, pct):
+    val = self.sketch.quantile(float(pct) / 100)
+    # the sketch only knows buckets, the extremes are exact
+    return min(max(val, self.min), self.max)
+
+  def summary(self):
+    return {
+      "count" : self.count,
+      "sum" : self.sum,
+      "min" : self.min,
+      "max" : self.max,
+      "mean" : self.mean,
+      "std" : self.std,
+      "big5" : dict((pct, self.percentile(pct)) for pct in PERCENTILES)
+    }
+
+# the stats of a run of lines
+def crunch(lines):
+  text = "".join(lines)
+  if '\x1b' in text or '\x08' in text:
+    text = ESCAPE_RE.sub('', text)
+
+  stats = RunningStats()
+  stats.update(extract_numbers(text))
+  return stats
+
+# the stats of a whole buffer, crunched from lines[self.scanned:end] at a time
+class BufferStats(RunningStats):
+  def __init__(self):
+    RunningStats.__init__(self)
+    self.scanned = 0
+
+  # the stats of the next `count` lines
+  def add(self, stats, count):
+    self.merge(stats)
+    self.scanned += count
+
+  def scan(self, lines, end=None):
+    if end is None:
+      end = len(lines)
+    self.add(crunch(lines[self.scanned:end]), end - self.scanned)
+# }}}
+
+# vim: set foldmethod=marker
@@ -0,0 +1,163 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# kk --render: highlighting without a terminal. the input goes through the
+# same diff index and lexers as the pager, but straight to a terminal
+# formatter instead of widgets. diffs are written out a file at a time, as
+# soon as the index knows where each file ends, so the output streams along
+# with the input. anything that isn't a diff has to be read whole first, to
+# guess its syntax.
+# }}}
+
+import itertools
+import os
+import re
+
+import pygments
+import pygments.formatters
+import pygments.lexers
+import pygments.token
+from pygments.lexers import guess_lexer
+
+from diffindex import DiffIndex
+
+READ_LINES = 2000
+
+ESCAPE_RE = re.compile(r'\x1b\[[0-9;]*[mK]|.\x08')
+# the +/- of a diff line, behind whatever color codes the formatter put first
+MARKER_RE = re.compile(r'^((?:\x1b\[[0-9;]*m)*)([+-])')
+MARKERS = {
+  "+" : "\x1b[37;42m+\x1b[0m",
+  "-" : "\x1b[37;41m-\x1b[0m",
+}
+
+COMPRESSED_SUFFIXES = [ ".gz", ".bz2", ".xz", ".zst" ]
+
+_lexer_fname_cache = {}
+_token_types = {}
+
+# the lex pool hands back token types by name
+def token_type(name):
+  if name not in _token_types:
+    _token_types[name] = pygments.token.string_to_tokentype(name.split(".", 1)[1] if "." in name else "")
+  return _token_types[name]
+
+def lexer_for_filename(fname):
+  if fname not in _lexer_fname_cache:
+    try:
+      lexer = pygments.lexers.get_lexer_for_filename(fname, stripnl=False)
+    except Exception:
+      lexer = None
+    _lexer_fname_cache[fname] = lexer
+  return _lexer_fname_cache[fname]
+
+# the lexer the pager would pick: by file name, or a guess. outside of diffs
+# it has to be a confident one. None means the text goes out as it is
+def choose_lexer(fname, text, diff=False):
+  lexer = fname and lexer_for_filename(fname)
+  if not lexer:
+    try:
+      lexer = guess_lexer(text, stripnl=False)
+    except Exception:
+      return
+
+  if not diff and lexer.__class__.analyse_text(text) < 0.3:
+    return
+
+  if lexer.__class__ is pygments.lexers.TextLexer:
+    return
+  return lexer
+
+def source_name(path):
+  base, ext = os.path.splitext(path)
+  if ext in COMPRESSED_SUFFIXES:
+    return base
+  return path
+
+class BatchRenderer(object):
+  def __init__(self, out, style, color=True, lex_pool=None, encoding='utf-8', fname=None):
+    self.out = out
+    self.color = color
+    self.lex_pool = lex_pool
+    self.encoding = encoding
+    self.fname = fname
+    self.formatter = pygments.formatters.Terminal256Formatter(style=style)
+
+  def render(self, lines):
+    if not self.color:
+      for line in lines:
+        self.out.write(ESCAPE_RE.sub('', line))
+      return
+
+    diffs = DiffIndex()
+    # lines that haven't been written yet, buffer[0] is line `pos`
+    buffer = []
+    pos = 0
+    file_no = 0
+    read = 0
+    while True:
+      chunk = list(itertools.islice(lines, READ_LINES))
+      if not chunk:
+        break
+
+      diffs.feed(chunk, read)
+      read += len(chunk)
+      buffer.extend(chunk)
+      buffer, pos, file_no = self.write_files(diffs, buffer, pos, file_no)
+
+    diffs.finish()
+    buffer, pos, file_no = self.write_files(diffs, buffer, pos, file_no)
+    if diffs:
+      self.write_plain(buffer)
+    else:
+      self.write_lexed(buffer, self.fname)
+    self.out.flush()
+
+  # writes out the diff's files that are complete, returns what is left
+  def write_files(self, diffs, buffer, pos, file_no):
+    while file_no < len(diffs.files):
+      entry = diffs.files[file_no]
+      end = diffs.file_end(entry)
+      if end is None:
+        break
+
+      body_start = entry.body_start if entry.body_start is not None else end
+      self.write_plain(buffer[:body_start - pos])
+      self.write_lexed(buffer[body_start - pos:end - pos], entry.path, diff=True)
+      buffer = buffer[end - pos:]
+      pos = end
+      file_no += 1
+      self.out.flush()
+
+    return buffer, pos, file_no
+
+  def write_plain(self, lines):
+    for line in lines:
+      self.out.write(line)
+
+  def write_lexed(self, lines, fname, diff=False):
+    if not lines:
+      return
+
+    text = "".join([ ESCAPE_RE.sub('', line) for line in lines ]).decode(self.encoding, 'replace')
+    lexer = choose_lexer(fname, text, diff)
+    if not lexer:
+      self.write_plain(lines)
+      return
+
+    tokens = None
+    if self.lex_pool:
+      tokens = self.lex_pool.lex(lexer, text.splitlines(True))
+    if tokens is None:
+      tokens = lexer.get_tokens(text)
+    else:
+      tokens = [ (token_type(ttype), value) for ttype, value in tokens ]
+
+    output = pygments.format(tokens, self.formatter)
+    if diff:
+      output = "".join([ MARKER_RE.sub(lambda m: MARKERS[m.group(2)] + m.group(1), line)
+        for line in output.splitlines(True) ])
+
+    self.out.write(output.encode(self.encoding, 'replace'))
+
+# vim: set foldmethod=marker
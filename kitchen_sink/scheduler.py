@@ -0,0 +1,108 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# all background work in kk goes through one scheduler: a small pool of worker
+# threads pulling jobs off a priority queue. jobs are kept small (one chunk of
+# work, then they resubmit themselves) so that higher priority work can get in
+# between them. workers never touch widgets, they post their results back and
+# the UI thread applies them.
+# }}}
+
+import collections
+import itertools
+import threading
+import traceback
+import Queue
+
+PRIORITY_INPUT = 0
+PRIORITY_INGEST = 1
+PRIORITY_SYNTAX = 2
+PRIORITY_IDLE = 3
+
+class Cancelled(Exception):
+  pass
+
+class CancelToken(object):
+  def __init__(self, parent=None):
+    self.parent = parent
+    self._cancelled = False
+
+  @property
+  def cancelled(self):
+    if self._cancelled:
+      return True
+
+    return self.parent is not None and self.parent.cancelled
+
+  def cancel(self):
+    self._cancelled = True
+
+  def check(self):
+    if self.cancelled:
+      raise Cancelled()
+
+class WorkScheduler(object):
+  def __init__(self, num_workers=2, wake=None, log=None):
+    self.root = CancelToken()
+    self.wake = wake
+    self.log = log
+    self.jobs = Queue.PriorityQueue()
+    self.results = collections.deque()
+    self.counter = itertools.count()
+    self.threads = []
+
+    for i in xrange(num_workers):
+      thread = threading.Thread(target=self.work, name="kk-worker-%s" % i)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def token(self, parent=None):
+    return CancelToken(parent or self.root)
+
+  def submit(self, fn, priority=PRIORITY_SYNTAX, token=None, *args):
+    if token is None:
+      token = self.root
+    if token.cancelled:
+      return
+
+    self.jobs.put((priority, self.counter.next(), fn, token, args))
+
+  def work(self):
+    while True:
+      priority, order, fn, token, args = self.jobs.get()
+      if fn is None:
+        return
+
+      if token.cancelled:
+        continue
+
+      try:
+        fn(*args)
+      except Cancelled:
+        pass
+      except Exception:
+        if self.log:
+          self.log("WORKER EXCEPTION", traceback.format_exc(100))
+
+  # hand a result to the UI thread. it is dropped if the token is cancelled by
+  # the time the UI thread gets to it
+  def post(self, fn, token=None):
+    self.results.append((fn, token))
+    if self.wake:
+      self.wake()
+
+  # runs on the UI thread
+  def apply_pending(self):
+    while self.results:
+      fn, token = self.results.popleft()
+      if token is not None and token.cancelled:
+        continue
+      fn()
+
+  def shutdown(self):
+    self.root.cancel()
+    for thread in self.threads:
+      self.jobs.put((-1, self.counter.next(), None, None, None))
+
+# vim: set foldmethod=marker
@@ -0,0 +1,144 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# indexes worked out for a file (its line offsets, timestamps, log templates,
+# columns) are saved in a cache directory, so opening the same big file again
+# doesn't mean scanning it again. they are stored under a hash of the file's
+# path, size and mtime: a file that changed simply misses. the directory is
+# kept under a size limit by dropping the entries that were used least
+# recently.
+# }}}
+
+import array
+import copy_reg
+import cPickle
+import hashlib
+import os
+import re
+import stat
+import tempfile
+
+# goes into the key, so entries pickled by an older kk are never loaded
+VERSION = 1
+
+# the names of the entries: the key, then the name of the index
+ENTRY_RE = re.compile(r'^[0-9a-f]{40}\.\w+$')
+
+# arrays pickle as lists of numbers by default, which is an order of magnitude
+# slower to load than their raw bytes
+def array_from_string(typecode, data):
+  arr = array.array(typecode)
+  arr.fromstring(data)
+  return arr
+
+def reduce_array(arr):
+  return array_from_string, (arr.typecode, arr.tostring())
+
+copy_reg.pickle(array.array, reduce_array)
+
+def default_dir():
+  base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+  # kk's other caches live next to it, pruning only ever looks in here
+  return os.path.join(base, "kk", "sidecar")
+
+# None for anything that isn't a regular file
+def file_key(path):
+  try:
+    path = os.path.realpath(path)
+    info = os.stat(path)
+  except OSError:
+    return
+
+  if not stat.S_ISREG(info.st_mode):
+    return
+  return hashlib.sha1("%s\0%s\0%s\0%r" % (VERSION, path, info.st_size, info.st_mtime)).hexdigest()
+
+def open_sidecar(path, directory, limit):
+  key = file_key(path)
+  if key:
+    return Sidecar(directory, key, limit)
+
+class Sidecar(object):
+  def __init__(self, directory, key, limit):
+    self.directory = directory
+    self.key = key
+    self.limit = limit
+    # the indexes that are already in the cache
+    self.stored = set()
+
+  def entry_path(self, name):
+    return os.path.join(self.directory, "%s.%s" % (self.key, name))
+
+  # the saved index, or None
+  def load(self, name):
+    path = self.entry_path(name)
+    try:
+      with open(path, "rb") as f:
+        index = cPickle.load(f)
+      # for pruning, the entries that are used stay
+      os.utime(path, None)
+    except (IOError, OSError, EOFError, ValueError, AttributeError, ImportError, cPickle.UnpicklingError):
+      return
+
+    self.stored.add(name)
+    return index
+
+  def load_all(self, names):
+    indexes = {}
+    for name in names:
+      index = self.load(name)
+      if index is not None:
+        indexes[name] = index
+    return indexes
+
+  # written to a temp file first, so a reader never sees half an index
+  def save(self, name, index):
+    if name in self.stored:
+      return
+
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+
+      fd, tmp_path = tempfile.mkstemp(prefix=".%s." % self.key, dir=self.directory)
+      try:
+        with os.fdopen(fd, "wb") as f:
+          cPickle.dump(index, f, 2)
+        os.rename(tmp_path, self.entry_path(name))
+      except:
+        os.unlink(tmp_path)
+        raise
+    # cPickle raises TypeError for the objects it can't pickle at all
+    except (IOError, OSError, TypeError, cPickle.PicklingError):
+      return False
+
+    self.stored.add(name)
+    self.prune()
+    return True
+
+  def prune(self):
+    entries = []
+    try:
+      for name in os.listdir(self.directory):
+        # KK_SIDECAR_DIR could point somewhere shared, anything that isn't
+        # one of the entries is never touched (or counted)
+        if not ENTRY_RE.match(name):
+          continue
+        path = os.path.join(self.directory, name)
+        info = os.lstat(path)
+        if stat.S_ISREG(info.st_mode):
+          entries.append((info.st_mtime, info.st_size, path))
+    except OSError:
+      return
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+      if total <= self.limit:
+        break
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+      total -= size
+
+# vim: set foldmethod=marker
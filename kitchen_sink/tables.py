@@ -0,0 +1,200 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# column aware table mode. the layout (delimiter, column count, header) is
+# guessed from a sample of the buffer, then every column is parsed into its
+# own array so it can be summed, summarized and sorted on without piping the
+# buffer through sort or awk.
+# }}}
+
+import array
+import csv
+import re
+
+from numstats import RunningStats, usable
+
+DELIMITERS = [ "\t", ",", "|", ";" ]
+SIZE_SUFFIXES = { "K" : 1024.0, "M" : 1024.0 ** 2, "G" : 1024.0 ** 3, "T" : 1024.0 ** 4 }
+NAN = float("nan")
+
+size_re = re.compile(r'^([-+]?(?:\d+\.?\d*|\.\d+))([KMGT])i?B?$', re.I)
+
+# inf, nan and numbers too big for the stats count as missing
+def parse_number(cell):
+  val = read_number(cell)
+  if val is not None and usable(val):
+    return val
+
+def read_number(cell):
+  try:
+    return float(cell)
+  except ValueError:
+    pass
+
+  if cell.endswith('%'):
+    try:
+      return float(cell[:-1])
+    except ValueError:
+      return None
+
+  match = size_re.match(cell)
+  if match:
+    return float(match.group(1)) * SIZE_SUFFIXES[match.group(2).upper()]
+
+# {{{ layout
+class TableLayout(object):
+  def __init__(self, delimiter, ncols):
+    self.delimiter = delimiter
+    self.ncols = ncols
+    self.has_header = False
+    self.names = [ "col%s" % (col + 1) for col in xrange(ncols) ]
+    self.numeric = [ False ] * ncols
+
+  def split(self, line):
+    line = line.rstrip("\r\n")
+    if self.delimiter is None:
+      # the last column of ps and friends has spaces in it
+      return line.split(None, self.ncols - 1)
+
+    if '"' in line and self.delimiter != "\t":
+      try:
+        return csv.reader([line], delimiter=self.delimiter).next()
+      except csv.Error:
+        pass
+
+    return line.split(self.delimiter)
+
+  def describe(self):
+    if self.delimiter is None:
+      return "whitespace"
+
+    return repr(self.delimiter)
+
+def modal_width(lines, delimiter):
+  counts = {}
+  for line in lines:
+    if delimiter is None:
+      width = len(line.split())
+    else:
+      width = line.count(delimiter) + 1
+    counts[width] = counts.get(width, 0) + 1
+
+  width, hits = max(counts.iteritems(), key=lambda pair: (pair[1], pair[0]))
+  return width, float(hits) / len(lines)
+
+def sniff_table(lines, sample_size=200):
+  sample = [ line.rstrip("\r\n") for line in lines[:sample_size] ]
+  sample = [ line for line in sample if line.strip() ]
+  if len(sample) < 2:
+    return
+
+  layout = None
+  for delimiter in DELIMITERS + [ None ]:
+    width, consistency = modal_width(sample, delimiter)
+    # ps, du and friends have ragged last columns, so whitespace is judged
+    # more leniently than a real delimiter
+    if width > 1 and consistency >= (0.6 if delimiter is None else 0.8):
+      layout = TableLayout(delimiter, width)
+      break
+
+  if not layout:
+    return
+
+  rows = [ layout.split(line) for line in sample ]
+  for col in xrange(layout.ncols):
+    cells = [ row[col].strip() for row in rows[1:] if len(row) > col and row[col].strip() ]
+    parsed = [ cell for cell in cells if parse_number(cell) is not None ]
+    layout.numeric[col] = bool(cells) and len(parsed) >= 0.9 * len(cells)
+
+  # a header is a first row with words where the rest of the column has numbers
+  first = rows[0]
+  for col in xrange(min(len(first), layout.ncols)):
+    if layout.numeric[col] and parse_number(first[col].strip()) is None:
+      layout.has_header = True
+
+  if layout.has_header:
+    for col in xrange(min(len(first), layout.ncols)):
+      layout.names[col] = first[col].strip() or layout.names[col]
+
+  return layout
+# }}}
+
+# {{{ column table
+class ColumnTable(object):
+  def __init__(self, layout):
+    self.layout = layout
+    self.parsed = 0
+    self.header_index = None
+    self.line_index = array.array('l')
+    self.values = {}
+    self.stats = {}
+    self.counts = [ 0 ] * layout.ncols
+
+    for col in xrange(layout.ncols):
+      if layout.numeric[col]:
+        self.values[col] = array.array('d')
+        self.stats[col] = RunningStats()
+
+  @property
+  def rows(self):
+    return len(self.line_index)
+
+  # parse lines[self.parsed:end] into the column arrays
+  def parse(self, lines, end=None):
+    layout = self.layout
+    if end is None:
+      end = len(lines)
+
+    chunks = dict((col, array.array('d')) for col in self.values)
+    for index in xrange(self.parsed, end):
+      line = lines[index]
+      if not line.strip():
+        continue
+
+      if layout.has_header and self.header_index is None:
+        self.header_index = index
+        continue
+
+      row = layout.split(line)
+      self.line_index.append(index)
+      for col in xrange(layout.ncols):
+        cell = row[col].strip() if col < len(row) else ""
+        if cell:
+          self.counts[col] += 1
+
+        if col in chunks:
+          val = parse_number(cell) if cell else None
+          chunks[col].append(NAN if val is None else val)
+
+    for col, chunk in chunks.iteritems():
+      self.values[col].extend(chunk)
+      self.stats[col].update(array.array('d', [ val for val in chunk if val == val ]))
+
+    self.parsed = end
+
+  def summary(self, col):
+    ret = { "name" : self.layout.names[col], "count" : self.counts[col] }
+    if col in self.stats:
+      ret.update(self.stats[col].summary())
+      ret['count'] = self.counts[col]
+    return ret
+
+  # returns the line indexes of the buffer, ordered by the column
+  def sort_order(self, col, lines, reverse=False):
+    if col in self.values:
+      values = self.values[col]
+      # NaNs (missing cells) always sink to the bottom
+      missing = float("inf") if not reverse else float("-inf")
+      key = lambda row: values[row] if values[row] == values[row] else missing
+    else:
+      line_index = self.line_index
+      split = self.layout.split
+      def key(row):
+        cells = split(lines[line_index[row]])
+        return cells[col] if col < len(cells) else ""
+
+    order = sorted(xrange(self.rows), key=key, reverse=reverse)
+    return [ self.line_index[row] for row in order ]
+# }}}
+
+# vim: set foldmethod=marker
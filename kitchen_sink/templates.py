@@ -0,0 +1,78 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# log lines grouped by template, like sort | uniq -c but without piping the
+# buffer out. the parts of a line that change from one message to the next
+# (timestamps, ids, addresses, numbers) are masked out, and whatever is left
+# is the line's template. each line remembers its template so a template's
+# lines can be picked out again without masking the buffer a second time.
+# }}}
+
+import array
+import re
+
+# the order matters: the wider patterns go first, so a timestamp isn't masked
+# as a handful of numbers
+MASKS = [
+  (re.compile(r'\d{4}-\d\d-\d\d[T ]\d\d:\d\d(?::\d\d)?(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d)?'
+    r'|\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +\d\d? \d\d:\d\d:\d\d'
+    r'|\d{4}[-/]\d\d[-/]\d\d|\d\d?:\d\d:\d\d(?:[.,]\d+)?'), '<ts>'),
+  (re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'), '<uuid>'),
+  (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'), '<ip>'),
+  (re.compile(r'\b0x[0-9a-fA-F]+\b|\b(?=[0-9a-f]*\d)[0-9a-f]{7,}\b'), '<hex>'),
+  (re.compile(r'\d+(?:\.\d+)*'), '<num>'),
+]
+
+ESCAPE_RE = re.compile(r'\x1b\[[0-9;]*[mK]|.\x08')
+
+def template_of(line):
+  if '\x1b' in line or '\x08' in line:
+    line = ESCAPE_RE.sub('', line)
+  for pattern, mask in MASKS:
+    line = pattern.sub(mask, line)
+  return line.rstrip("\r\n")
+
+class TemplateIndex(object):
+  def __init__(self):
+    self.scanned = 0
+    self.templates = []
+    self.counts = []
+    self.ids = {}
+    # the template of each line, by id
+    self.line_ids = array.array('i')
+
+  def __len__(self):
+    return len(self.templates)
+
+  # template lines[self.scanned:end]
+  def scan(self, lines, end=None):
+    if end is None:
+      end = len(lines)
+
+    ids = self.ids
+    counts = self.counts
+    chunk = array.array('i')
+    for index in xrange(self.scanned, end):
+      template = template_of(lines[index])
+      template_id = ids.get(template)
+      if template_id is None:
+        template_id = ids[template] = len(self.templates)
+        self.templates.append(template)
+        counts.append(0)
+
+      counts[template_id] += 1
+      chunk.append(template_id)
+
+    self.line_ids.extend(chunk)
+    self.scanned = end
+
+  # template ids, the most common first
+  def ranked(self, limit=None):
+    order = sorted(xrange(len(self.templates)), key=self.counts.__getitem__, reverse=True)
+    return order[:limit]
+
+  def matching(self, lines, template_id):
+    line_ids = self.line_ids
+    return [ lines[index] for index in xrange(len(line_ids)) if line_ids[index] == template_id ]
+
+# vim: set foldmethod=marker
@@ -0,0 +1,237 @@
+# -*- coding: latin-1 -*-
+
+# {{{ about
+# an index of the timestamps in a log, for jumping to a time without searching
+# the buffer. the format is picked from a sample of lines, then every line is
+# checked for it. only the lines where the time changes are recorded (as line
+# and epoch in two arrays), a line without a timestamp belongs to the one
+# above it. logs are mostly in order, so a time is found by binary search.
+# }}}
+
+import array
+import bisect
+import calendar
+import re
+import time
+
+SAMPLE_SIZE = 200
+# a format needs to match this much of the sample to be picked
+MIN_MATCHES = 0.3
+# the histogram has buckets of a minute, unless that makes more than
+# MAX_BUCKETS of them. then it takes the next size up that doesn't
+MAX_BUCKETS = 2000
+BUCKET_SIZES = [
+  (60, "minute"),
+  (300, "5 minutes"),
+  (900, "15 minutes"),
+  (3600, "hour"),
+  (6 * 3600, "6 hours"),
+  (86400, "day"),
+  (7 * 86400, "week"),
+]
+# a timestamp this much (in seconds) before the one above it means the log
+# isn't in order
+DISORDER = 1.0
+
+MONTHS = dict((name, index + 1) for index, name in
+  enumerate("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()))
+
+# {{{ formats
+def parse_iso(match):
+  year, month, day, hour, minute, second, fraction = match.groups()
+  epoch = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+  return epoch + float("0." + fraction if fraction else 0)
+
+def parse_syslog(match):
+  month, day, hour, minute, second = match.groups()
+  # syslog has no year
+  year = time.gmtime().tm_year
+  return calendar.timegm((year, MONTHS[month], int(day), int(hour), int(minute), int(second)))
+
+def parse_clf(match):
+  day, month, year, hour, minute, second = match.groups()
+  return calendar.timegm((int(year), MONTHS[month], int(day), int(hour), int(minute), int(second)))
+
+def parse_epoch(match):
+  return float(match.group(1))
+
+def parse_clock(match):
+  hour, minute, second, fraction = match.groups()
+  return int(hour) * 3600 + int(minute) * 60 + int(second) + float("0." + fraction if fraction else 0)
+
+class TimeFormat(object):
+  def __init__(self, name, pattern, parse, dated=True):
+    self.name = name
+    self.pattern = re.compile(pattern)
+    self.parse = parse
+    # a clock time alone has no date, its epochs are seconds into the day
+    self.dated = dated
+
+  def __repr__(self):
+    return "TimeFormat(%s)" % self.name
+
+FORMATS = [
+  TimeFormat("iso", r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:[.,](\d+))?', parse_iso),
+  TimeFormat("syslog", r'\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +(\d\d?) (\d\d):(\d\d):(\d\d)\b', parse_syslog),
+  TimeFormat("clf", r'\[(\d\d)/(\w{3})/(\d{4}):(\d\d):(\d\d):(\d\d)', parse_clf),
+  TimeFormat("epoch", r'^\[?(1\d{9}(?:\.\d+)?)\b', parse_epoch),
+  TimeFormat("clock", r'\b(\d\d):(\d\d):(\d\d)(?:[.,](\d+))?\b', parse_clock, dated=False),
+]
+FORMATS_BY_NAME = dict((fmt.name, fmt) for fmt in FORMATS)
+
+# the format most of the sampled lines have (the first one that fits, on a
+# tie), or None
+def sniff_format(lines):
+  count = len(lines)
+  if not count:
+    return
+
+  step = max(count / SAMPLE_SIZE, 1)
+  sample = [ lines[index] for index in xrange(0, count, step) ][:SAMPLE_SIZE]
+
+  best = None
+  best_matches = 0
+  for fmt in FORMATS:
+    matches = sum(1 for line in sample if fmt.pattern.search(line))
+    if matches > best_matches:
+      best, best_matches = fmt, matches
+
+  if best_matches >= len(sample) * MIN_MATCHES:
+    return best
+# }}}
+
+# {{{ index
+class TimeIndex(object):
+  def __init__(self, fmt):
+    self.format = fmt
+    self.scanned = 0
+    # the line each new timestamp starts on, and its epoch
+    self.lines = array.array('l')
+    self.times = array.array('d')
+    self.ordered = True
+
+  def __len__(self):
+    return len(self.lines)
+
+  # the format is pickled by name (for the stack and the sidecar cache)
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['format'] = self.format.name
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.format = FORMATS_BY_NAME[state['format']]
+
+  # index lines[self.scanned:end]
+  def scan(self, lines, end=None):
+    if end is None:
+      end = len(lines)
+
+    search = self.format.pattern.search
+    parse = self.format.parse
+    starts = array.array('l')
+    times = array.array('d')
+    last = self.times[-1] if self.times else None
+    # logs put the same stamp on many lines in a row, those aren't parsed again
+    last_text = None
+    for index in xrange(self.scanned, end):
+      match = search(lines[index])
+      if not match:
+        continue
+
+      text = match.group(0)
+      if text == last_text:
+        continue
+      last_text = text
+
+      try:
+        epoch = parse(match)
+      except (ValueError, KeyError, OverflowError):
+        continue
+
+      if epoch == last:
+        continue
+      if last is not None and epoch < last - DISORDER:
+        self.ordered = False
+
+      starts.append(index)
+      times.append(epoch)
+      last = epoch
+
+    self.lines.extend(starts)
+    self.times.extend(times)
+    self.scanned = end
+
+  # the first line at or after the time, or None if the log ends before it
+  def find(self, epoch):
+    if self.ordered:
+      position = bisect.bisect_left(self.times, epoch)
+      if position < len(self.times):
+        return self.lines[position]
+      return
+
+    for position, val in enumerate(self.times):
+      if val >= epoch:
+        return self.lines[position]
+
+  # the epoch of the line (of the closest timestamp above it)
+  def time_at(self, line):
+    position = bisect.bisect_right(self.lines, line) - 1
+    if position >= 0:
+      return self.times[position]
+
+  # the bucket size (and its name), and (bucket start, lines, first line) for
+  # each bucket of the log, empty ones included
+  def histogram(self):
+    if not self.times:
+      return None, None, []
+
+    first = min(self.times)
+    last = max(self.times)
+    for bucket, name in BUCKET_SIZES:
+      if (last - first) / bucket <= MAX_BUCKETS:
+        break
+
+    start = first - first % bucket
+    rows = [ [ start + index * bucket, 0, None ] for index in xrange(int((last - start) / bucket) + 1) ]
+    ends = self.lines[1:].tolist() + [ self.scanned ]
+    for line, end, epoch in zip(self.lines, ends, self.times):
+      row = rows[int((epoch - start) / bucket)]
+      row[1] += end - line
+      if row[2] is None or line < row[2]:
+        row[2] = line
+
+    return bucket, name, [ tuple(row) for row in rows ]
+# }}}
+
+# {{{ queries
+TIME_RE = re.compile(r'^(?:(\d{4})-(\d\d)-(\d\d)[T ])?(\d\d?):(\d\d)(?::(\d\d)(?:[.,](\d+))?)?$')
+
+# a time typed in as [YYYY-MM-DD ]HH:MM[:SS], as an epoch the index can look
+# up. without a date, it is on the same day as `near` (an epoch)
+def parse_query(text, fmt, near=None):
+  match = TIME_RE.match(text.strip())
+  if not match:
+    return
+
+  year, month, day, hour, minute, second, fraction = match.groups()
+  clock = int(hour) * 3600 + int(minute) * 60 + int(second or 0) + float("0." + fraction if fraction else 0)
+  if not fmt.dated:
+    return clock
+
+  if year:
+    return calendar.timegm((int(year), int(month), int(day), 0, 0, 0)) + clock
+
+  if near is None:
+    return
+  return near - near % 86400 + clock
+
+def format_time(epoch, fmt, seconds=True):
+  clock = "%H:%M:%S" if seconds else "%H:%M"
+  if not fmt.dated:
+    return time.strftime(clock, time.gmtime(epoch))
+  return time.strftime("%Y-%m-%d " + clock, time.gmtime(epoch))
+# }}}
+
+# vim: set foldmethod=marker
@@ -0,0 +1,6 @@
+# the kitchen_sink modules import each other py2 style (import numstats), so
+# the tests import them the same way
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kitchen_sink"))
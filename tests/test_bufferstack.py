@@ -0,0 +1,87 @@
+import pytest
+
+from bufferstack import BufferStack, freeze, thaw
+
+def make_buffer(name, count=1000, finished=True):
+  return {
+    'name' : name,
+    'lines' : [ "%s line %s\n" % (name, i) for i in xrange(count) ],
+    'finished' : finished,
+    'token' : object(),
+    'table' : object(),
+  }
+
+def test_freeze_drops_rebuilt_keys():
+  ret = make_buffer("a")
+  back = thaw(freeze(ret))
+  assert back['lines'] == ret['lines']
+  assert back['name'] == "a"
+  assert 'token' not in back and 'table' not in back
+
+def test_pop_in_order_with_views():
+  stack = BufferStack(budget=1 << 30)
+  stack.push(make_buffer("a"), "view a")
+  stack.push(make_buffer("b"), "view b")
+  assert len(stack) == 2
+
+  ret, view = stack.pop()
+  assert ret['name'] == "b" and view == "view b"
+  ret, view = stack.pop()
+  assert ret['name'] == "a" and view == "view a"
+  assert len(stack) == 0
+
+def test_pop_empty():
+  with pytest.raises(IndexError):
+    BufferStack(budget=0).pop()
+
+def test_only_recent_buffers_keep_views():
+  stack = BufferStack(budget=1 << 30, keep_views=2)
+  for name in "abcd":
+    stack.push(make_buffer(name), "view " + name)
+
+  assert [ entry.view for entry in stack.entries ] == [ None, None, "view c", "view d" ]
+
+def test_restore_frozen_buffer():
+  stack = BufferStack(budget=1 << 30)
+  original = make_buffer("a")
+  stack.push(original, "view a")
+  stack.push(make_buffer("b"))
+
+  # drop the budget so the oldest finished buffer gets compressed
+  stack.budget = stack.entries[1].size + 1
+  stack.enforce_budget()
+  entry = stack.entries[0]
+  assert entry.ret is None and entry.frozen is not None and entry.view is None
+
+  stack.pop()
+  assert stack.peek_lines()() == original['lines']
+  ret, view = stack.pop()
+  assert view is None
+  assert ret['lines'] == original['lines']
+  assert 'token' not in ret
+
+def test_restore_spilled_buffer():
+  stack = BufferStack(budget=0)
+  buffers = [ make_buffer(name) for name in "abc" ]
+  for ret in buffers:
+    stack.push(ret)
+
+  assert stack.resident_size() == 0
+  assert all(entry.spilled for entry in stack.entries)
+  assert stack.peek_lines()() == buffers[2]['lines']
+
+  for ret in reversed(buffers):
+    back, view = stack.pop()
+    assert back['lines'] == ret['lines']
+
+def test_unfinished_and_mapped_buffers_stay():
+  stack = BufferStack(budget=0)
+  reading = make_buffer("a", finished=False)
+  mapped = make_buffer("b")
+  mapped['mapped'] = True
+  stack.push(reading)
+  stack.push(mapped)
+
+  assert [ entry.ret for entry in stack.entries ] == [ reading, mapped ]
+  assert stack.pop()[0] is mapped
+  assert stack.pop()[0] is reading
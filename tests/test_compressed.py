@@ -0,0 +1,119 @@
+import bz2
+import gzip
+import StringIO
+import zlib
+
+import pytest
+
+import compressed
+from compressed import CorruptInput, UnsupportedFormat, open_lines, open_lines_near, read_lines, sniff_format
+
+LINES = [ "line %s %s\n" % (i, "x" * (i % 50)) for i in xrange(20000) ]
+TEXT = "".join(LINES)
+
+def gzipped(data):
+  out = StringIO.StringIO()
+  f = gzip.GzipFile(fileobj=out, mode="wb")
+  f.write(data)
+  f.close()
+  return out.getvalue()
+
+def read(data):
+  return list(read_lines(StringIO.StringIO(data)))
+
+def write(tmpdir, name, data):
+  path = tmpdir.join(name)
+  path.write(data, mode="wb")
+  return str(path)
+
+def test_sniff_format():
+  assert sniff_format(gzipped("x")) == "gzip"
+  assert sniff_format(bz2.compress("x")) == "bzip2"
+  assert sniff_format("\xfd7zXZ\x00...") == "xz"
+  assert sniff_format("\x28\xb5\x2f\xfd...") == "zstd"
+  assert sniff_format("plain text") is None
+
+@pytest.mark.parametrize("compress", [ gzipped, bz2.compress ])
+def test_round_trip(compress):
+  assert read(compress(TEXT)) == LINES
+
+@pytest.mark.parametrize("compress", [ gzipped, bz2.compress ])
+def test_concatenated_streams(compress):
+  # pigz and friends write several streams back to back
+  data = compress("".join(LINES[:7])) + compress("".join(LINES[7:]))
+  assert read(data) == LINES
+
+def test_stream_ending_at_a_block_boundary(monkeypatch):
+  first = bz2.compress("".join(LINES[:100]))
+  monkeypatch.setattr(compressed, "BLOCK_SIZE", len(first))
+  assert read(first + bz2.compress("".join(LINES[100:]))) == LINES
+
+def test_plain_input_and_last_line():
+  assert read("a\nb\nno newline") == [ "a\n", "b\n", "no newline" ]
+  assert read("") == []
+
+@pytest.mark.parametrize("compress", [ gzipped, bz2.compress ])
+def test_truncated_stream(compress):
+  data = compress(TEXT)
+  with pytest.raises(CorruptInput):
+    read(data[:len(data) / 2])
+
+@pytest.mark.parametrize("compress", [ gzipped, bz2.compress ])
+def test_corrupt_stream(compress):
+  data = compress(TEXT)
+  middle = len(data) / 2
+  with pytest.raises(CorruptInput):
+    read(data[:middle] + "garbage" * 100 + data[middle:])
+
+def test_missing_module(monkeypatch):
+  monkeypatch.setattr(compressed, "zstandard", None)
+  with pytest.raises(UnsupportedFormat):
+    read("\x28\xb5\x2f\xfd" + "\0" * 20)
+
+def test_open_near_gzip_checkpoint(tmpdir, monkeypatch):
+  monkeypatch.setattr(compressed, "BLOCK_SIZE", 4096)
+  monkeypatch.setattr(compressed, "CHECKPOINT_EVERY", 64 * 1024)
+  path = write(tmpdir, "big.gz", gzipped(TEXT))
+
+  assert open_lines_near(path, 15000) is None
+  assert list(open_lines(path)) == LINES
+
+  index = compressed.get_index(path)
+  assert index.complete and not index.portable()
+  assert len(index.checkpoints) > 2
+
+  first, lines = open_lines_near(path, 15000)
+  assert 0 < first <= 15000
+  assert list(lines) == LINES[first:]
+
+def test_open_near_plain_checkpoint(tmpdir, monkeypatch):
+  monkeypatch.setattr(compressed, "BLOCK_SIZE", 4096)
+  monkeypatch.setattr(compressed, "CHECKPOINT_EVERY", 64 * 1024)
+  path = write(tmpdir, "big.txt", TEXT)
+
+  list(open_lines(path))
+  index = compressed.get_index(path)
+  assert index.portable()
+
+  # nothing to skip to before the first checkpoint
+  assert open_lines_near(path, 0) is None
+  for line in [ 5000, 19999 ]:
+    first, lines = open_lines_near(path, line)
+    assert 0 < first <= line
+    assert list(lines) == LINES[first:]
+
+def test_bz2_is_not_indexed(tmpdir):
+  path = write(tmpdir, "big.bz2", bz2.compress(TEXT))
+  assert list(open_lines(path)) == LINES
+  assert compressed.get_index(path) is None
+  assert open_lines_near(path, 1000) is None
+
+def test_index_goes_stale(tmpdir, monkeypatch):
+  monkeypatch.setattr(compressed, "CHECKPOINT_EVERY", 64 * 1024)
+  path = write(tmpdir, "a.txt", TEXT)
+  list(open_lines(path))
+  assert compressed.get_index(path)
+
+  write(tmpdir, "a.txt", TEXT + "more\n")
+  assert compressed.get_index(path) is None
+  assert compressed.get_index(str(tmpdir.join("missing"))) is None
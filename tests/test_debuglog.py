@@ -0,0 +1,73 @@
+import json
+
+from debuglog import DebugLog, LEVELS, parse_levels, read_binary
+
+class Unprintable(object):
+  def __str__(self):
+    raise ValueError("nope")
+
+def test_parse_levels():
+  assert parse_levels("syntax=trace, menus=INFO,bogus,render=whatever") == {
+    "syntax" : LEVELS["trace"], "menus" : LEVELS["info"], "render" : LEVELS["debug"] }
+  assert parse_levels("") == {}
+
+def test_no_path_is_off():
+  log = DebugLog(None)
+  channel = log.channel("syntax")
+  assert not channel.enabled("error")
+  channel.error("dropped")
+  assert not log.records
+  log.close()
+
+def test_levels_per_channel(tmpdir):
+  path = str(tmpdir.join("log"))
+  log = DebugLog(path, levels={ "syntax" : LEVELS["trace"] }, default="warn")
+  syntax = log.channel("syntax")
+  menus = log.channel("menus")
+  assert syntax.enabled("trace")
+  assert not menus.enabled("info") and menus.enabled("warn")
+
+  syntax.trace("LEXING", 1)
+  menus.info("HIDDEN")
+  menus.error("SHOWN", u"\xe9")
+  log.close()
+
+  lines = open(path).read().splitlines()
+  assert len(lines) == 2
+  assert lines[0].split(" ", 1)[1] == "syntax TRACE LEXING 1"
+  assert lines[1].split(" ", 1)[1] == "menus ERROR SHOWN \xc3\xa9"
+
+def test_jsonl(tmpdir):
+  path = str(tmpdir.join("log.jsonl"))
+  log = DebugLog(path, fmt="jsonl")
+  log.channel("ingest").info("CHUNK", [ 1, 2 ])
+  log.close()
+
+  record = json.loads(open(path).read())
+  assert record["subsystem"] == "ingest"
+  assert record["level"] == "info"
+  assert record["message"] == "CHUNK [1, 2]"
+
+def test_binary_round_trip(tmpdir):
+  path = str(tmpdir.join("log.bin"))
+  log = DebugLog(path, fmt="binary")
+  for i in xrange(1000):
+    log.channel("render").debug("FRAME", i)
+  log.close()
+
+  with open(path, "rb") as f:
+    records = list(read_binary(f))
+  assert [ message for when, name, level, message in records ] == [ "FRAME %s" % i for i in xrange(1000) ]
+  assert set((name, level) for when, name, level, message in records) == set([ ("render", LEVELS["debug"]) ])
+
+def test_bad_argument_doesnt_stop_logging(tmpdir):
+  path = str(tmpdir.join("log"))
+  log = DebugLog(path)
+  log.channel("general").error("BROKEN", Unprintable())
+  log.channel("general").error("AFTER")
+  log.close()
+  log.close()
+
+  lines = open(path).read().splitlines()
+  assert "couldn't format" in lines[0]
+  assert lines[1].endswith("AFTER")
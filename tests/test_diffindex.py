@@ -0,0 +1,132 @@
+from diffindex import DiffIndex, strip_prefix
+
+LOG = """commit 1111111111111111111111111111111111111111
+Author: a <a@example.com>
+
+    change things
+
+diff --git a/kk.py b/kk.py
+index 1234567..89abcde 100644
+--- a/kk.py
++++ b/kk.py
+@@ -1,3 +1,3 @@
+ one
+-two
++TWO
+
+@@ -10 +10,2 @@ def f():
+ ten
++eleven
+\\ No newline at end of file
+diff --git a/new.txt b/new.txt
+new file mode 100644
+--- /dev/null
++++ b/new.txt
+@@ -0,0 +1 @@
++hello
+commit 2222222222222222222222222222222222222222
+Author: b <b@example.com>
+
+    move and drop
+
+diff --git a/old name.py b/new name.py
+similarity index 90%
+rename from old name.py
+rename to new name.py
+diff --git a/gone.txt b/gone.txt
+deleted file mode 100644
+--- a/gone.txt
++++ /dev/null
+@@ -1 +0,0 @@
+-bye
+diff --git a/img.png b/img.png
+Binary files a/img.png and b/img.png differ
+
+    trailing text
+""".splitlines(True)
+
+UNIFIED = """--- a.txt\t2024-01-01
++++ b.txt\t2024-01-02
+@@ -1,2 +1,2 @@
+-a
++b
+ c
+""".splitlines(True)
+
+def index_of(lines, chunk=None):
+  index = DiffIndex()
+  chunk = chunk or len(lines)
+  for start in xrange(0, len(lines), chunk):
+    index.feed(lines[start:start + chunk], start)
+  index.finish()
+  return index
+
+def shape(index):
+  return [ (entry.status, entry.old_path, entry.path, entry.start, entry.end, entry.body_start,
+    [ (hunk.start, hunk.end) for hunk in entry.hunks ]) for entry in index.files ]
+
+def test_strip_prefix():
+  assert strip_prefix("a/x.py") == "x.py"
+  assert strip_prefix(' "b/with space" ') == "with space"
+  assert strip_prefix("/dev/null") == "/dev/null"
+
+def test_git_log():
+  index = index_of(LOG)
+  assert index
+  assert [ (commit.sha[:4], commit.start, commit.end) for commit in index.commits ] == [ ("1111", 0, 24), ("2222", 24, 43) ]
+  assert shape(index) == [
+    ("M", "kk.py", "kk.py", 5, 18, 9, [ (9, 14), (14, 18) ]),
+    ("A", "new.txt", "new.txt", 18, 24, 22, [ (22, 24) ]),
+    ("R", "old name.py", "new name.py", 29, 33, None, []),
+    ("D", "gone.txt", "gone.txt", 33, 39, 37, [ (37, 39) ]),
+    # binary patches have no hunks to end them, the rest is their header
+    ("B", "img.png", "img.png", 39, 43, None, []),
+  ]
+  assert [ entry.describe() for entry in index.commits[1].files ] == [
+    "R old name.py -> new name.py", "D gone.txt", "B img.png" ]
+  assert index.hunks[1].header == "@@ -10 +10,2 @@ def f():"
+
+def test_fed_in_chunks():
+  whole = shape(index_of(LOG))
+  for chunk in [ 1, 3, 7 ]:
+    assert shape(index_of(LOG, chunk)) == whole
+
+def test_plain_unified_diff():
+  index = index_of(UNIFIED)
+  assert not index.commits
+  assert shape(index) == [ ("M", "a.txt", "b.txt", 0, 6, 2, [ (2, 6) ]) ]
+  assert index.files_near(3) == index.files
+
+def test_not_a_diff():
+  index = index_of([ "hello\n", "@@ not a hunk\n", "--- nope\n" ])
+  assert not index
+  assert index.file_at(0) is None
+  assert index.hunk_at(1) is None
+  assert index.commit_at(0) is None
+
+def test_lookups():
+  index = index_of(LOG)
+  assert index.next_start("file", 5) == 18
+  assert index.next_start("file", 40) is None
+  assert index.prev_start("hunk", 14) == 9
+  assert index.prev_start("hunk", 9) is None
+  assert index.next_start("commit", 0) == 24
+
+  assert index.file_at(12).path == "kk.py"
+  assert index.file_at(3) is None
+  assert index.hunk_at(10).start == 9
+  assert index.hunk_at(5) is None
+  assert index.commit_index(30) == 1
+  assert [ entry.path for entry in index.files_near(2) ] == [ "kk.py", "new.txt" ]
+
+def test_unfinished_file_has_no_end():
+  index = DiffIndex()
+  index.feed(LOG[:12], 0)
+  entry = index.files[0]
+  assert index.file_end(entry) is None
+  assert index.file_at(11) is entry
+
+  index.feed(LOG[12:], 12)
+  index.finish()
+  assert index.complete
+  assert index.file_end(index.files[-1]) == len(LOG)
@@ -0,0 +1,68 @@
+import fuzzy
+from fuzzy import FuzzyIndex, query_pattern
+
+FILES = [
+  "kitchen_sink/kk.py",
+  "kitchen_sink/scheduler.py",
+  "README.rst",
+  "docs/keys.md",
+  "bin/kk",
+  "kitchen_sink/fuzzy.py",
+]
+
+def names(index, indices):
+  return [ index.items[i] for i in indices ]
+
+def test_query_pattern_escapes():
+  assert query_pattern("a.(").search("xa--.--(")
+  assert not query_pattern("a.(").search("a-x-(")
+  assert query_pattern("[]").search("[x]")
+
+def test_empty_query_is_everything():
+  index = FuzzyIndex(FILES)
+  assert len(index) == len(FILES)
+  assert index.filter("") == range(len(FILES))
+  assert index.query == ""
+
+def test_ranking():
+  index = FuzzyIndex(FILES)
+  # substring matches first, then the tightest match, shortest entry last
+  assert names(index, index.filter("KK")) == [ "bin/kk", "kitchen_sink/kk.py", "kitchen_sink/fuzzy.py", "kitchen_sink/scheduler.py" ]
+  assert names(index, index.filter("ksp")) == [ "kitchen_sink/kk.py", "kitchen_sink/fuzzy.py", "kitchen_sink/scheduler.py" ]
+  assert index.filter("zzz") == []
+
+def test_narrowing_and_backspace():
+  index = FuzzyIndex(FILES)
+  everything = set(index.filter("s"))
+  narrower = index.filter("sch")
+  assert index.query == "sch"
+  assert set(narrower) <= everything
+  assert names(index, narrower) == [ "kitchen_sink/scheduler.py" ]
+
+  # going back to a shorter query uses the earlier results
+  assert set(index.filter("s")) == everything
+  assert [ query for query, indices in index.results ] == [ "s" ]
+
+  # a different query starts over
+  assert names(index, index.filter("rst")) == [ "README.rst" ]
+
+def test_same_query_twice():
+  index = FuzzyIndex(FILES)
+  first = index.filter("py")
+  assert index.filter("PY") is first
+
+def test_add_while_filtering():
+  index = FuzzyIndex(FILES)
+  index.filter("s")
+  index.filter("sch")
+  added = index.add("tests/test_scheduler.py")
+  index.add("nothing here")
+
+  assert added in index.results[0][1]
+  assert added in index.filter("sch")
+  assert added in index.filter("sche")
+
+def test_many_matches_skip_scoring(monkeypatch):
+  monkeypatch.setattr(fuzzy, "RANK_LIMIT", 3)
+  index = FuzzyIndex([ "a-x-b", "ab", "zab", "a--b", "b" ])
+  assert names(index, index.filter("ab")) == [ "ab", "zab", "a-x-b", "a--b" ]
@@ -0,0 +1,100 @@
+import random
+
+import linediff
+from linediff import common_ends, diff_lines, line_hashes, patience_diff, unified_diff
+
+def apply_changes(old, new, changes):
+  out = []
+  pos = 0
+  for tag, i1, i2, j1, j2 in changes:
+    out.extend(old[pos:i1])
+    out.extend(new[j1:j2])
+    pos = i2
+  out.extend(old[pos:])
+  return out
+
+def test_line_hashes():
+  assert line_hashes([ "a\n", "b\n", "a\n" ]) == [ hash("a\n"), hash("b\n"), hash("a\n") ]
+
+def test_common_ends():
+  assert common_ends([ 1, 2, 3 ], [ 1, 2, 3 ]) == (3, 0)
+  assert common_ends([ 1, 2, 3 ], [ 1, 9, 3 ]) == (1, 1)
+  # the tail doesn't overlap the head
+  assert common_ends([ 1, 1 ], [ 1, 1, 1 ]) == (2, 0)
+  assert common_ends([], [ 1 ]) == (0, 0)
+
+def test_no_change():
+  assert diff_lines([ 1, 2 ], [ 1, 2 ]) == []
+  assert patience_diff([ 1, 2 ], [ 1, 2 ]) == []
+
+def test_changed_head():
+  old = [ "a", "b", "c", "d" ]
+  new = [ "x", "b", "c", "d" ]
+  assert diff_lines(old, new) == [ ('replace', 0, 1, 0, 1) ]
+  assert diff_lines(old, new[1:]) == [ ('delete', 0, 1, 0, 0) ]
+  assert diff_lines(old[1:], new) == [ ('insert', 0, 0, 0, 1) ]
+
+def test_changed_tail():
+  old = [ "a", "b", "c", "d" ]
+  new = [ "a", "b", "c", "x" ]
+  assert diff_lines(old, new) == [ ('replace', 3, 4, 3, 4) ]
+  assert diff_lines(old, old + [ "e", "f" ]) == [ ('insert', 4, 4, 4, 6) ]
+  assert diff_lines(old, old[:2]) == [ ('delete', 2, 4, 2, 2) ]
+
+def test_changed_head_and_tail():
+  old = [ "a", "b", "c", "d" ]
+  new = [ "x", "b", "c", "y" ]
+  assert diff_lines(old, new) == [ ('replace', 0, 1, 0, 1), ('replace', 3, 4, 3, 4) ]
+
+def test_empty_sides():
+  assert diff_lines([], [ "a" ]) == [ ('insert', 0, 0, 0, 1) ]
+  assert diff_lines([ "a" ], []) == [ ('delete', 0, 1, 0, 0) ]
+  assert patience_diff([], [ "a" ]) == [ ('insert', 0, 0, 0, 1) ]
+
+def test_big_middle_is_one_replace(monkeypatch):
+  monkeypatch.setattr(linediff, "FALLBACK_SIZE", 10)
+  old = [ "head" ] + range(10) + [ "tail" ]
+  new = [ "head" ] + range(5, 15) + [ "tail" ]
+  assert diff_lines(old, new) == [ ('replace', 1, 11, 1, 11) ]
+  assert apply_changes(old, new, diff_lines(old, new)) == new
+
+def test_random_edits_round_trip():
+  rand = random.Random(3)
+  for run in xrange(50):
+    old = [ rand.randint(0, 20) for i in xrange(rand.randint(0, 60)) ]
+    new = list(old)
+    for edit in xrange(rand.randint(1, 5)):
+      at = rand.randint(0, len(new))
+      new[at:at + rand.randint(0, 3)] = [ rand.randint(0, 20) for i in xrange(rand.randint(0, 3)) ]
+
+    for diff in [ diff_lines, patience_diff ]:
+      changes = diff(old, new)
+      assert apply_changes(old, new, changes) == new
+      assert all(tag != 'equal' for tag, i1, i2, j1, j2 in changes)
+
+def test_patience_anchors_on_unique_lines():
+  # the braces show up twice, so the function lines are what gets matched
+  old = [ "a()", "{", "{", "b()", "end" ]
+  new = [ "b()", "end", "c()", "{", "{" ]
+  assert patience_diff(old, new) == [ ('delete', 0, 3, 0, 0), ('insert', 5, 5, 2, 5) ]
+
+def test_patience_checks_for_cancel():
+  calls = []
+  patience_diff(range(10), range(5) + [ "x" ] + range(6, 10), check=lambda: calls.append(1))
+  assert calls
+
+def test_unified_diff():
+  a = [ "%s\n" % i for i in xrange(20) ]
+  b = list(a)
+  b[1] = "one\n"
+  b[18:19] = []
+  out = unified_diff(a, b, diff_lines(a, b), "a", "b", context=2)
+  assert out == [
+    "--- a\n", "+++ b\n",
+    "@@ -1,4 +1,4 @@\n", " 0\n", "-1\n", "+one\n", " 2\n", " 3\n",
+    "@@ -17,4 +17,3 @@\n", " 16\n", " 17\n", "-18\n", " 19\n",
+  ]
+
+def test_unified_diff_without_newline():
+  out = unified_diff([ "a" ], [ "b" ], [ ('replace', 0, 1, 0, 1) ], "x", "y")
+  assert out[2:] == [ "@@ -1,1 +1,1 @@\n", "-a\n", "+b\n" ]
@@ -0,0 +1,101 @@
+import math
+import random
+
+import pytest
+
+from numstats import BufferStats, QuantileSketch, RunningStats, crunch, extract_numbers
+
+def test_extract_numbers():
+  assert list(extract_numbers("a 1 -2.5 +3 .5 1e3 x1 2x 1.2.3 nan inf")) == [ 1, -2.5, 3, 0.5, 1000 ]
+
+def test_crunch_strips_escapes():
+  stats = crunch([ "\x1b[31m12\x1b[0m apples\n", "b\x08b 30\n" ])
+  assert stats.count == 2
+  assert stats.sum == 42
+
+def test_running_stats():
+  vals = [ 3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0 ]
+  stats = RunningStats()
+  stats.update(vals)
+
+  mean = sum(vals) / len(vals)
+  assert stats.count == len(vals)
+  assert stats.min == 1 and stats.max == 9
+  assert stats.mean == pytest.approx(mean)
+  assert stats.std == pytest.approx(math.sqrt(sum((v - mean) ** 2 for v in vals) / len(vals)))
+
+def test_huge_values_are_left_out():
+  stats = RunningStats()
+  stats.update([ 1.0, 8e400, float("nan"), 1e200, 3.0 ])
+  assert stats.count == 2
+  assert stats.mean == 2
+
+def test_empty_stats():
+  stats = RunningStats()
+  stats.update([])
+  stats.merge(RunningStats())
+  assert stats.count == 0
+  assert stats.std == 0
+  assert stats.sketch.quantile(0.5) is None
+
+def test_merge_matches_one_pass():
+  rand = random.Random(7)
+  vals = [ rand.gauss(100, 30) for i in xrange(5000) ]
+
+  whole = RunningStats()
+  whole.update(vals)
+
+  merged = RunningStats()
+  for i in xrange(0, len(vals), 777):
+    chunk = RunningStats()
+    chunk.update(vals[i:i + 777])
+    merged.merge(chunk)
+
+  assert merged.count == whole.count
+  assert merged.sum == pytest.approx(whole.sum)
+  assert merged.mean == pytest.approx(whole.mean)
+  assert merged.std == pytest.approx(whole.std)
+  assert (merged.min, merged.max) == (whole.min, whole.max)
+  for pct in [ '5', '50', '95' ]:
+    assert merged.percentile(pct) == whole.percentile(pct)
+
+def test_sketch_merge_adds_buckets():
+  a = QuantileSketch()
+  b = QuantileSketch()
+  a.add_all([ -5.0, 0.0, 1.0, 2.0 ])
+  b.add_all([ -5.0, 2.0, 1e300 ])
+
+  a.merge(b)
+  assert a.count == 6
+  assert a.zeros == 1
+  assert sum(a.negative.values()) == 2
+  assert sum(a.positive.values()) == 3
+
+def test_sketch_accuracy():
+  sketch = QuantileSketch(accuracy=0.01)
+  vals = range(1, 10001)
+  sketch.add_all(vals)
+  for q in [ 0.05, 0.5, 0.95 ]:
+    exact = vals[int(q * (len(vals) - 1))]
+    assert abs(sketch.quantile(q) - exact) <= 0.01 * exact + 1
+
+def test_sketch_collapse_keeps_the_count():
+  sketch = QuantileSketch(max_buckets=16)
+  sketch.add_all([ 1.5 ** i for i in xrange(100) ])
+  assert len(sketch.positive) <= 16
+  assert sum(sketch.positive.values()) == 100
+  assert sketch.quantile(1.0) == pytest.approx(1.5 ** 99, rel=0.02)
+
+def test_buffer_stats_scan():
+  lines = [ "%s\n" % i for i in xrange(100) ]
+  stats = BufferStats()
+  stats.scan(lines, 40)
+  assert stats.scanned == 40
+  stats.scan(lines)
+  assert stats.scanned == 100
+  assert stats.count == 100
+  assert stats.sum == sum(xrange(100))
+
+  stats.add(crunch([ "1000\n" ]), 1)
+  assert stats.scanned == 101
+  assert stats.max == 1000
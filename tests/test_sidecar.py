@@ -0,0 +1,87 @@
+import array
+import os
+import threading
+
+import sidecar
+from sidecar import Sidecar, file_key, open_sidecar
+
+def write(path, data):
+  with open(path, "wb") as f:
+    f.write(data)
+  return path
+
+def entry_names(directory):
+  return sorted(name for name in os.listdir(directory) if sidecar.ENTRY_RE.match(name))
+
+def test_file_key(tmpdir):
+  path = write(str(tmpdir.join("log")), "a\n")
+  key = file_key(path)
+  assert len(key) == 40
+  assert file_key(path) == key
+
+  os.utime(path, (1000, 1000))
+  assert file_key(path) != key
+  assert file_key(str(tmpdir)) is None
+  assert file_key(str(tmpdir.join("missing"))) is None
+  assert open_sidecar(str(tmpdir.join("missing")), str(tmpdir), 100) is None
+
+def test_save_and_load(tmpdir):
+  directory = str(tmpdir.join("cache", "sidecar"))
+  path = write(str(tmpdir.join("log")), "a\n")
+  index = { "offsets" : array.array('l', range(1000)), "name" : "x" }
+
+  side = open_sidecar(path, directory, 1 << 20)
+  assert side.load("offsets") is None
+  assert side.save("offsets", index)
+  # saved once per open
+  assert side.save("offsets", index) is None
+
+  again = open_sidecar(path, directory, 1 << 20)
+  loaded = again.load_all([ "offsets", "times" ])
+  assert loaded.keys() == [ "offsets" ]
+  assert loaded["offsets"] == index
+  assert isinstance(loaded["offsets"]["offsets"], array.array)
+  assert not [ name for name in os.listdir(directory) if name.startswith(".") ]
+
+def test_bad_entries(tmpdir):
+  directory = str(tmpdir)
+  side = Sidecar(directory, "a" * 40, 1 << 20)
+  write(side.entry_path("broken"), "not a pickle")
+  assert side.load("broken") is None
+
+  # an index that can't be pickled leaves nothing behind
+  assert side.save("lock", threading.Lock()) is False
+  assert sorted(os.listdir(directory)) == [ "a" * 40 + ".broken" ]
+
+def test_unwritable_directory(tmpdir):
+  blocker = write(str(tmpdir.join("file")), "")
+  side = Sidecar(os.path.join(blocker, "sidecar"), "a" * 40, 1 << 20)
+  assert side.save("offsets", [ 1 ]) is False
+
+def test_prune_drops_least_recently_used(tmpdir):
+  directory = str(tmpdir)
+  sides = [ Sidecar(directory, "%040x" % i, 1500) for i in xrange(3) ]
+  for i, side in enumerate(sides):
+    side.stored.add("offsets")
+    write(side.entry_path("offsets"), "x" * 1000)
+    os.utime(side.entry_path("offsets"), (1000 + i, 1000 + i))
+
+  # loading the oldest one makes it the most recently used
+  write(sides[0].entry_path("offsets"), sidecar.cPickle.dumps([ 0 ] * 100, 2))
+  os.utime(sides[0].entry_path("offsets"), (1000, 1000))
+  assert sides[0].load("offsets") == [ 0 ] * 100
+
+  sides[2].prune()
+  assert entry_names(directory) == [ "%040x.offsets" % 0, "%040x.offsets" % 2 ]
+
+def test_prune_leaves_other_files_alone(tmpdir):
+  directory = str(tmpdir)
+  write(str(tmpdir.join("notes.txt")), "x" * 10000)
+  tmpdir.mkdir("highlight").join("f").write("x" * 10000)
+  os.symlink(str(tmpdir.join("notes.txt")), str(tmpdir.join("%040x.link" % 1)))
+
+  side = Sidecar(directory, "%040x" % 2, 100)
+  assert side.save("offsets", range(1000))
+  assert entry_names(directory) == [ "%040x.link" % 1 ]
+  assert os.path.getsize(str(tmpdir.join("notes.txt"))) == 10000
+  assert tmpdir.join("highlight", "f").check()
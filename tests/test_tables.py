@@ -0,0 +1,80 @@
+import math
+
+from tables import ColumnTable, parse_number, sniff_table
+
+CSV = [
+  "name,size,pct\n",
+  "a,10,5%\n",
+  "b,2K,50%\n",
+  "\"c, d\",,\n",
+  "e,1.5MiB,7.5%\n",
+]
+
+PS = [
+  "PID TTY TIME CMD\n",
+  "1 ? 00:00:01 init\n",
+  "22 ? 00:00:00 bash\n",
+  "333 pts/0 00:00:02 python kk.py\n",
+]
+
+def test_parse_number():
+  assert parse_number("12") == 12
+  assert parse_number("50%") == 50
+  assert parse_number("2K") == 2048
+  assert parse_number("1.5MiB") == 1.5 * 1024 ** 2
+  assert parse_number("abc") is None
+  assert parse_number("inf") is None
+  assert parse_number("nan") is None
+  assert parse_number("1e400") is None
+
+def test_sniff_csv():
+  layout = sniff_table(CSV)
+  assert layout.delimiter == ","
+  assert layout.ncols == 3
+  assert layout.has_header
+  assert layout.names == [ "name", "size", "pct" ]
+  assert layout.numeric == [ False, True, True ]
+  assert layout.split(CSV[3]) == [ "c, d", "", "" ]
+
+def test_sniff_whitespace_keeps_the_last_column_whole():
+  layout = sniff_table(PS)
+  assert layout.delimiter is None
+  assert layout.describe() == "whitespace"
+  assert layout.ncols == 4
+  assert layout.split(PS[3]) == [ "333", "pts/0", "00:00:02", "python kk.py" ]
+
+def test_sniff_rejects_non_tables():
+  assert sniff_table([ "just one line\n" ]) is None
+  assert sniff_table([ "\n", "  \n", "x\n" ]) is None
+  assert sniff_table([ "hello there\n", "a,b,c,d,e\n", "1\n", "no|pe\n", "x y z w v u\n" ]) is None
+
+def test_parse_in_chunks():
+  table = ColumnTable(sniff_table(CSV))
+  table.parse(CSV, 2)
+  table.parse(CSV)
+
+  assert table.header_index == 0
+  assert table.rows == 4
+  assert list(table.line_index) == [ 1, 2, 3, 4 ]
+  assert table.counts == [ 4, 3, 3 ]
+
+  sizes = table.values[1]
+  assert list(sizes[:2]) == [ 10, 2048 ]
+  assert math.isnan(sizes[2])
+
+  summary = table.summary(1)
+  assert summary['name'] == "size"
+  assert summary['count'] == 3
+  assert summary['min'] == 10
+  assert summary['max'] == 1.5 * 1024 ** 2
+
+  assert table.summary(0) == { "name" : "name", "count" : 4 }
+
+def test_sort_order():
+  table = ColumnTable(sniff_table(CSV))
+  table.parse(CSV)
+
+  # missing cells go last either way
+  assert table.sort_order(1, CSV) == [ 1, 2, 4, 3 ]
+  assert table.sort_order(1, CSV, reverse=True) == [ 4, 2, 1, 3 ]
+  assert table.sort_order(0, CSV, reverse=True) == [ 4, 3, 2, 1 ]
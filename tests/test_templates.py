@@ -0,0 +1,53 @@
+import pytest
+
+from templates import TemplateIndex, template_of
+
+LOG = [
+  "2024-01-02 10:00:01,123 GET /users/17 from 10.0.0.1:4431 took 12ms\n",
+  "2024-01-02 10:00:02,456 GET /users/3 from 10.0.0.7:5512 took 9ms\n",
+  "Jan  2 10:00:03 worker 0x7f3a crashed\n",
+  "2024-01-02 10:00:04,001 GET /users/99 from 192.168.1.20:80 took 120ms\n",
+  "\n",
+  "job 123e4567-e89b-12d3-a456-426614174000 done in 3.5s\n",
+  "job 00000000-0000-0000-0000-000000000000 done in 1s\n",
+]
+
+@pytest.mark.parametrize("line, template", [
+  (LOG[0], "<ts> GET /users/<num> from <ip> took <num>ms"),
+  (LOG[2], "<ts> worker <hex> crashed"),
+  (LOG[5], "job <uuid> done in <num>s"),
+  ("commit deadbeef1 and abcdefg\n", "commit <hex> and abcdefg"),
+  ("2024/01/02 at 7:05:09.5\n", "<ts> at <ts>"),
+  ("\x1b[31merror\x1b[0m 42\r\n", "error <num>"),
+  ("no variables here", "no variables here"),
+])
+def test_template_of(line, template):
+  assert template_of(line) == template
+
+def test_scan_in_chunks():
+  index = TemplateIndex()
+  index.scan(LOG, 3)
+  assert index.scanned == 3
+  index.scan(LOG)
+  assert index.scanned == len(LOG)
+  assert len(index.line_ids) == len(LOG)
+
+  assert len(index) == 4
+  top = index.ranked()
+  assert index.templates[top[0]] == template_of(LOG[0])
+  assert index.counts[top[0]] == 3
+  assert index.ranked(2) == top[:2]
+  assert sum(index.counts) == len(LOG)
+
+def test_matching_lines():
+  index = TemplateIndex()
+  index.scan(LOG)
+  jobs = index.ids[template_of(LOG[5])]
+  assert index.matching(LOG, jobs) == [ LOG[5], LOG[6] ]
+  assert index.matching(LOG, index.ids[""]) == [ "\n" ]
+
+def test_empty():
+  index = TemplateIndex()
+  index.scan([])
+  assert len(index) == 0
+  assert index.ranked() == []
@@ -0,0 +1,114 @@
+import calendar
+import cPickle
+
+import pytest
+
+from timeindex import FORMATS_BY_NAME, TimeIndex, format_time, parse_query, sniff_format
+
+def iso_log(minutes, per_minute=2):
+  lines = []
+  for minute in xrange(minutes):
+    for i in xrange(per_minute):
+      lines.append("2024-03-01 10:%02d:%02d.5 request %s\n" % (minute, i * 10, i))
+      lines.append("  continued\n")
+  return lines
+
+def epoch(text):
+  return parse_query(text, FORMATS_BY_NAME["iso"])
+
+@pytest.mark.parametrize("line, name", [
+  ("2024-03-01T10:00:00Z hello", "iso"),
+  ("Mar  1 10:00:00 host sshd[1]: hi", "syslog"),
+  ('1.2.3.4 - - [01/Mar/2024:10:00:00 +0000] "GET /"', "clf"),
+  ("[1709287200.25] woke up", "epoch"),
+  ("10:00:00.123 tick", "clock"),
+])
+def test_sniff_format(line, name):
+  assert sniff_format([ line ] * 5).name == name
+
+def test_sniff_needs_enough_matches():
+  assert sniff_format([]) is None
+  assert sniff_format([ "no time here\n" ] * 9 + [ "2024-03-01 10:00:00\n" ]) is None
+
+def test_scan_records_changes_only():
+  lines = iso_log(3)
+  index = TimeIndex(sniff_format(lines))
+  index.scan(lines, 5)
+  index.scan(lines)
+  assert index.scanned == len(lines)
+  assert len(index) == 6
+  assert list(index.lines) == [ 0, 2, 4, 6, 8, 10 ]
+  assert index.times[0] == epoch("2024-03-01 10:00:00.5")
+  assert index.ordered
+
+def test_find_and_time_at():
+  lines = iso_log(10)
+  index = TimeIndex(FORMATS_BY_NAME["iso"])
+  index.scan(lines)
+
+  assert index.find(epoch("2024-03-01 09:00")) == 0
+  assert index.find(epoch("2024-03-01 10:05")) == 20
+  assert index.find(epoch("2024-03-01 10:05:01")) == 22
+  assert index.find(epoch("2024-03-01 11:00")) is None
+
+  assert index.time_at(21) == epoch("2024-03-01 10:05:00.5")
+  assert index.time_at(-1) is None
+
+def test_out_of_order_log():
+  lines = [ "2024-03-01 10:00:00 a\n", "2024-03-01 10:05:00 b\n", "2024-03-01 10:01:00 c\n" ]
+  index = TimeIndex(FORMATS_BY_NAME["iso"])
+  index.scan(lines)
+  assert not index.ordered
+  assert index.find(epoch("2024-03-01 10:01")) == 1
+
+def test_bad_dates_are_skipped():
+  lines = [ "2024-13-45 10:00:00 nope\n", "2024-03-01 10:00:00 ok\n" ]
+  index = TimeIndex(FORMATS_BY_NAME["iso"])
+  index.scan(lines)
+  assert list(index.lines) == [ 1 ]
+
+def test_histogram():
+  lines = iso_log(3) + [ "2024-03-01 10:05:30 late\n" ]
+  index = TimeIndex(FORMATS_BY_NAME["iso"])
+  index.scan(lines)
+
+  bucket, name, rows = index.histogram()
+  assert (bucket, name) == (60, "minute")
+  start = epoch("2024-03-01 10:00")
+  assert rows == [
+    (start, 4, 0), (start + 60, 4, 4), (start + 120, 4, 8),
+    (start + 180, 0, None), (start + 240, 0, None), (start + 300, 1, 12),
+  ]
+  assert TimeIndex(FORMATS_BY_NAME["iso"]).histogram() == (None, None, [])
+
+def test_histogram_picks_a_bigger_bucket():
+  lines = [ "2024-03-01 10:00:00 a\n", "2024-03-05 10:00:00 b\n" ]
+  index = TimeIndex(FORMATS_BY_NAME["iso"])
+  index.scan(lines)
+  bucket, name, rows = index.histogram()
+  assert name == "5 minutes"
+  assert sum(row[1] for row in rows) == 2
+
+def test_pickle_round_trip():
+  lines = iso_log(2)
+  index = TimeIndex(FORMATS_BY_NAME["iso"])
+  index.scan(lines)
+  back = cPickle.loads(cPickle.dumps(index, 2))
+  assert back.format is FORMATS_BY_NAME["iso"]
+  assert list(back.lines) == list(index.lines)
+  assert list(back.times) == list(index.times)
+
+def test_parse_query():
+  iso = FORMATS_BY_NAME["iso"]
+  clock = FORMATS_BY_NAME["clock"]
+  near = calendar.timegm((2024, 3, 1, 23, 0, 0))
+
+  assert parse_query("2024-03-01 10:00:30", iso) == calendar.timegm((2024, 3, 1, 10, 0, 30))
+  assert parse_query("10:00", iso, near) == calendar.timegm((2024, 3, 1, 10, 0, 0))
+  assert parse_query("10:00", iso) is None
+  assert parse_query("1:02:03.5", clock) == 3723.5
+  assert parse_query("yesterday", iso, near) is None
+
+def test_format_time():
+  assert format_time(calendar.timegm((2024, 3, 1, 10, 2, 3)), FORMATS_BY_NAME["iso"]) == "2024-03-01 10:02:03"
+  assert format_time(3723, FORMATS_BY_NAME["clock"], seconds=False) == "01:02"